@@ -0,0 +1,54 @@
+'''
+Administrative commands, run inside the API container with the same environment:
+
+    python3 -m app.cli import-messages messages.ndjson
+'''
+
+import argparse
+import asyncio
+import sys
+import typing
+
+async def _iter_file_lines(filepath: str) -> typing.AsyncIterator[bytes]:
+    if filepath == '-':
+        for line in sys.stdin.buffer:
+            yield line
+        return
+
+    with open(filepath, 'rb') as f:
+        for line in f:
+            yield line
+
+async def _import_messages(args: argparse.Namespace) -> int:
+    # configures dependency container from the environment the same way the API does
+    from app.main import dependency_container
+
+    version_service = dependency_container.version_service()
+    import_service = dependency_container.import_service()
+
+    await version_service.start()
+    try:
+        result = await import_service.import_messages(_iter_file_lines(args.file))
+    finally:
+        await version_service.stop()
+        await dependency_container.db_engine().dispose()
+
+    print(result.model_dump_json(indent=2))
+
+    return 0 if result.rejected == 0 else 1
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python3 -m app.cli')
+    subparsers = parser.add_subparsers(required=True)
+
+    import_parser = subparsers.add_parser(
+        'import-messages',
+        help='bulk import messages from NDJSON file (one {sender_id, room_id, type, content, sent_at} object per line)')
+    import_parser.add_argument('file', help='path to NDJSON file, - reads standard input')
+    import_parser.set_defaults(command=_import_messages)
+
+    args = parser.parse_args()
+    return asyncio.run(args.command(args))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import calendar
+import datetime
+import typing
+import fastapi
+import msgpack
+
+from app.media_type import MediaType
+
+class ColumnarEncoder:
+    '''
+    Encodes list of rows (SQLAlchemy rows or models, read by attribute) into columnar
+    structure packed with MessagePack:
+
+        {
+            'length': <number of rows>,
+            'columns': {<column>: [<value of every row>, ...], ...},
+            'dictionaries': {<group>: {<column>: [<distinct value>, ...], ...}, ...}
+        }
+
+    Columns grouped in `dictionaries` (e.g. sender ID and username) are stored once per
+    distinct combination and rows only hold index of the entry in a column named after
+    the group. Datetime columns listed in `timestamps` are sent as UNIX time in milliseconds.
+    '''
+
+    def __init__(self,
+                 columns: typing.Sequence[str],
+                 timestamps: typing.Collection[str] = (),
+                 dictionaries: typing.Mapping[str, typing.Sequence[str]] | None = None) -> None:
+        self._columns = tuple(columns)
+        self._timestamps = frozenset(timestamps)
+        self._dictionaries = dict(dictionaries or {})
+
+    def encode(self, rows: typing.Iterable[typing.Any]) -> dict[str, typing.Any]:
+        columns = {name: list[typing.Any]() for name in self._columns}
+        indices = {group: list[int]() for group in self._dictionaries}
+        entries = {group: dict[tuple, int]() for group in self._dictionaries}
+
+        length = 0
+        for row in rows:
+            length += 1
+
+            for (name, values) in columns.items():
+                value = getattr(row, name)
+                if name in self._timestamps and value is not None:
+                    value = _to_milliseconds(value)
+
+                values.append(value)
+
+            for (group, group_columns) in self._dictionaries.items():
+                key = tuple(getattr(row, x) for x in group_columns)
+                indices[group].append(entries[group].setdefault(key, len(entries[group])))
+
+        dictionaries = dict[str, dict[str, list]]()
+        for (group, group_columns) in self._dictionaries.items():
+            # dicts keep insertion order, so entry position matches index assigned above
+            dictionaries[group] = {
+                name: [key[i] for key in entries[group]]
+                for (i, name) in enumerate(group_columns)}
+
+        return {
+            'length': length,
+            'columns': columns | indices,
+            'dictionaries': dictionaries}
+
+ROOM_MESSAGES = ColumnarEncoder(
+    ('id', 'type', 'content', 'sent_at'),
+    timestamps=('sent_at',),
+    dictionaries={'sender': ('sender_id', 'sender_username')})
+ROOM_USERS = ColumnarEncoder(
+    ('user_id', 'username', 'activity_status', 'last_active', 'is_owner', 'profile_picture_hash'),
+    timestamps=('last_active',))
+FRIENDS = ColumnarEncoder(
+    ('user_id', 'username', 'last_active', 'activity_status', 'profile_picture_hash'),
+    timestamps=('last_active',))
+USERS = ColumnarEncoder(
+    ('id', 'username', 'accepts_friend_requests', 'created_at', 'last_active', 'activity_status', 'profile_picture_hash'),
+    timestamps=('created_at', 'last_active'))
+ROOMS = ColumnarEncoder(
+    ('id', 'name', 'description'))
+
+def accepts_msgpack(request: fastapi.Request, response: fastapi.Response) -> bool:
+    '''
+    Dependency checking whether client prefers MessagePack over JSON according
+    to the `Accept` header. JSON stays the default on a tie.
+    '''
+
+    # responses differ by Accept, caches must not mix them up
+    response.headers['Vary'] = 'Accept'
+
+    accept = request.headers.get('accept')
+    if not accept:
+        return False
+
+    qualities = _parse_accept(accept)
+    msgpack_quality = qualities.get(MediaType.APPLICATION_MSGPACK, 0.0)
+    json_quality = qualities.get(MediaType.APPLICATION_JSON, 0.0)
+    # explicitly listed type is more specific than a wildcard of the same quality
+    wildcard_quality = max(
+        qualities.get('application/*', 0.0),
+        qualities.get('*/*', 0.0))
+
+    return msgpack_quality > 0.0 \
+        and msgpack_quality > json_quality \
+        and msgpack_quality >= wildcard_quality
+
+def msgpack_response(content: typing.Any, headers: typing.Mapping[str, str] | None = None) -> fastapi.Response:
+    return fastapi.Response(
+        content=msgpack.packb(content),
+        media_type=MediaType.APPLICATION_MSGPACK,
+        headers={**(headers or {}), 'Vary': 'Accept'})
+
+def _parse_accept(accept: str) -> dict[str, float]:
+    qualities = dict[str, float]()
+    for item in accept.split(','):
+        (media_type, *params) = item.split(';')
+        media_type = media_type.strip().lower()
+        if not media_type:
+            continue
+
+        quality = 1.0
+        for param in params:
+            (name, _, value) = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        qualities[media_type] = max(quality, qualities.get(media_type, 0.0))
+
+    return qualities
+
+def _to_milliseconds(value: datetime.datetime) -> int:
+    # naive datetimes coming from the database are UTC
+    if value.tzinfo is not None:
+        return int(value.timestamp() * 1000)
+
+    return calendar.timegm(value.timetuple()) * 1000 + value.microsecond // 1000
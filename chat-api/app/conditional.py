@@ -0,0 +1,46 @@
+import fastapi
+
+_BODY_HEADERS = frozenset(('content-length', 'content-type'))
+
+def evaluate_etag(request: fastapi.Request,
+                  response: fastapi.Response,
+                  etag: str,
+                  variant: str = '') -> fastapi.Response | None:
+    '''
+    Attaches `etag` to the response and returns `304 Not Modified` response if it
+    matches `If-None-Match` request header, in which case the endpoint should return
+    it right away. `variant` distinguishes representations of the same resource
+    (e.g. JSON and MessagePack), which must not share tags.
+    '''
+
+    if variant:
+        etag = f'{etag[:-1]}-{variant}"'
+
+    response.headers['ETag'] = etag
+
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None and _matches(if_none_match, etag):
+        # 304 has no body, headers describing the full one don't apply
+        return fastapi.Response(
+            status_code=fastapi.status.HTTP_304_NOT_MODIFIED,
+            headers={
+                name: value
+                for (name, value) in response.headers.items()
+                if name not in _BODY_HEADERS})
+
+    return None
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == '*':
+        return True
+
+    # weak comparison, as required for If-None-Match
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+
+        if candidate == etag:
+            return True
+
+    return False
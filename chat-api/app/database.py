@@ -0,0 +1,79 @@
+import asyncio
+import contextlib
+import time
+import typing
+import sqlalchemy
+from sqlalchemy import event
+import sqlalchemy.pool
+import sqlalchemy.ext.asyncio as sqlalchemy_asyncio
+
+from app import metrics, request_timing
+
+class _InstrumentedPool(sqlalchemy.pool.AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.DB_POOL_CHECKOUT_WAIT_SECONDS.observe(time.perf_counter() - start_time)
+
+def _on_checkout(*_) -> None:
+    metrics.DB_POOL_CHECKOUTS.inc()
+
+def create_engine(username: str,
+                  password: str,
+                  address: str,
+                  n_plus_one_threshold: int) -> sqlalchemy_asyncio.AsyncEngine:
+    engine = sqlalchemy_asyncio.create_async_engine(
+        f'mysql+asyncmy://{username}:{password}@{address}/chat',
+        echo=True,
+        poolclass=_InstrumentedPool)
+
+    pool = engine.sync_engine.pool
+    event.listen(pool, 'checkout', _on_checkout)
+    metrics.DB_POOL_CHECKED_OUT.set_function(pool.checkedout)
+    # pool reports negative overflow while it still has spare capacity
+    metrics.DB_POOL_OVERFLOW.set_function(lambda: max(pool.overflow(), 0))
+
+    request_timing.instrument_engine(engine.sync_engine, n_plus_one_threshold)
+
+    return engine
+
+async def prewarm_pool(engine: sqlalchemy_asyncio.AsyncEngine) -> None:
+    '''
+    Opens all connections the pool keeps (`pool_size`) at once, so that first requests
+    after startup don't pay for connecting and authenticating.
+    '''
+
+    async with contextlib.AsyncExitStack() as stack:
+        # connections are held until all of them are open, otherwise the pool would
+        # hand out the same few connections again
+        await asyncio.gather(*(
+            stack.enter_async_context(engine.connect())
+            for _ in range(engine.sync_engine.pool.size())))
+
+@contextlib.asynccontextmanager
+async def named_lock_session(db_sessionmaker: sqlalchemy_asyncio.async_sessionmaker[sqlalchemy_asyncio.AsyncSession],
+                             lock_name: str) -> typing.AsyncIterator[sqlalchemy_asyncio.AsyncSession | None]:
+    '''
+    Session holding MySQL named lock `lock_name`, `None` if another connection holds it.
+    Named locks belong to a connection and a session returns its connection to the pool on
+    every commit, so the session is bound to one connection kept until the lock is released.
+    '''
+
+    async with db_sessionmaker.kw['bind'].connect() as connection:
+        query = sqlalchemy.select(sqlalchemy.func.get_lock(lock_name, 0))
+        acquired = await connection.scalar(query)
+        # a session bound to a connection in a transaction would never commit it
+        await connection.commit()
+        if not acquired:
+            yield None
+            return
+
+        try:
+            async with db_sessionmaker(bind=connection) as session:
+                yield session
+        finally:
+            await connection.rollback()
+            query = sqlalchemy.select(sqlalchemy.func.release_lock(lock_name))
+            await connection.execute(query)
@@ -1,47 +1,83 @@
 import pathlib
 import datetime
-import ipinfo
 import sqlalchemy.ext.asyncio as sqlalchemy_asyncio
 from dependency_injector import containers, providers
 
+from app import database
+from app.directory import Directory
 from app.services.auth_service import AuthorizationService
 from app.services.datetime_service import DatetimeService
 from app.services.user_service import UserService
+from app.services.avatar_service import AvatarService
 from app.services.email_service import EmailService
 from app.services.location_service import LocationService
 from app.services.room_service import RoomService
 from app.services.message_service import MessageService
 from app.services.search_service import SearchService
+from app.services.event_bus import create_event_bus
+from app.services.version_service import create_version_service
+from app.services.rate_limit_service import create_rate_limit_service
+from app.services.partition_service import PartitionService
+from app.services.archive_service import ArchiveService
+from app.services.import_service import ImportService
+from app.services.typing_service import TypingService
+from app.services.read_receipt_service import ReadReceiptService
+from app.services.sync_service import SyncService
+from app.services.stream_service import StreamService
+
+def _create_ipinfo_handler(access_token: str):
+    if not access_token:
+        return None
+
+    # ipinfo pulls in aiohttp, only import it when the fallback is configured
+    import ipinfo
+
+    return ipinfo.getHandlerAsync(access_token)
 
 class Container(containers.DeclarativeContainer):
     wiring_config = containers.WiringConfiguration(packages=['app.routers'])
 
     config = providers.Configuration()
     db_engine = providers.Singleton(
-        lambda username, password, address: sqlalchemy_asyncio.create_async_engine(f'mysql+asyncmy://{username}:{password}@{address}/chat', echo=True),
+        database.create_engine,
         config.db.username,
         config.db.password,
-        config.db.address)
+        config.db.address,
+        config.db.n_plus_one_threshold.as_int())
+    event_bus = providers.Singleton(
+        create_event_bus,
+        config.event_bus.url)
+    version_service = providers.Singleton(
+        create_version_service,
+        config.event_bus.url)
+    rate_limit_service = providers.Singleton(
+        create_rate_limit_service,
+        config.event_bus.url,
+        config.security.rate_limits_enabled.as_(lambda x: x.lower() in ('1', 'true', 'yes')))
     ipinfo_handler = providers.Singleton(
-        lambda access_token: ipinfo.getHandlerAsync(access_token),
+        _create_ipinfo_handler,
         config.ipinfo.access_token)
-    db_sessionmaker = providers.Factory(
+    db_sessionmaker = providers.Singleton(
         sqlalchemy_asyncio.async_sessionmaker,
         db_engine)
-    auth_service = providers.Factory(
+    auth_service = providers.Singleton(
         AuthorizationService,
-        ipinfo_handler,
         db_sessionmaker,
         config.security.min_password_length.as_int(),
         config.security.password_salt_rounds.as_int(),
         config.security.jwt_secret,
         config.security.jwt_expire_time.as_(lambda x: datetime.timedelta(seconds=int(x))),
         config.security.email_verification_key,
-        config.security.email_confirm_code_max_age.as_int())
-    location_service = providers.Factory(
+        config.security.email_confirm_code_max_age.as_int(),
+        version_service)
+    location_service = providers.Singleton(
         LocationService,
-        ipinfo_handler)
-    email_service = providers.Factory(
+        ipinfo_handler,
+        providers.Callable(
+            lambda data_directory, filename: pathlib.Path(data_directory) / Directory.GEOIP / filename,
+            config.fs.data_directory,
+            config.geoip.database_file))
+    email_service = providers.Singleton(
         EmailService,
         config.smtp.host,
         config.smtp.port.as_int(),
@@ -49,24 +85,76 @@ class Container(containers.DeclarativeContainer):
         config.smtp.password,
         config.fs.data_directory.as_(pathlib.Path))
     datetime_service = providers.Singleton(DatetimeService)
+    avatar_service = providers.Singleton(
+        AvatarService,
+        config.fs.data_directory.as_(pathlib.Path),
+        config.user.profile_picture_size.as_int(),
+        config.user.profile_picture_sizes.as_(lambda x: [int(s) for s in x.split(',') if s.strip()]),
+        config.user.profile_picture_cache_size.as_int())
     user_service = providers.Singleton(
         UserService,
         db_sessionmaker,
+        avatar_service,
+        event_bus,
+        version_service)
+    archive_service = providers.Singleton(
+        ArchiveService,
+        db_sessionmaker,
         config.fs.data_directory.as_(pathlib.Path),
-        config.user.profile_picture_size.as_int())
+        version_service,
+        config.db.archive_after_days.as_int())
     room_service = providers.Singleton(
         RoomService,
         db_sessionmaker,
         config.fs.data_directory.as_(pathlib.Path),
-        config.user.profile_picture_size.as_int())
+        config.user.profile_picture_size.as_int(),
+        archive_service,
+        version_service)
     message_service = providers.Singleton(
         MessageService,
         db_sessionmaker,
         db_writer_tasks=1,
-        message_queue_size=32,
-        message_upload_batch_size=8,
-        message_upload_batch_timeout=1.0,
-        data_directory=config.fs.data_directory.as_(pathlib.Path))
+        message_queue_size=config.messages.queue_size.as_int(),
+        message_batch_min_size=config.messages.batch_min_size.as_int(),
+        message_batch_max_size=config.messages.batch_max_size.as_int(),
+        message_batch_target_latency=config.messages.batch_target_latency_ms.as_(lambda x: int(x) / 1000),
+        data_directory=config.fs.data_directory.as_(pathlib.Path),
+        event_bus=event_bus,
+        version_service=version_service)
+    typing_service = providers.Singleton(
+        TypingService,
+        room_service,
+        event_bus,
+        broadcast_interval=3.0,
+        expire_time=6.0)
+    read_receipt_service = providers.Singleton(
+        ReadReceiptService,
+        db_sessionmaker,
+        room_service,
+        version_service,
+        flush_interval=5.0)
+    sync_service = providers.Singleton(
+        SyncService,
+        db_sessionmaker,
+        config.sync.retention_days.as_int())
+    stream_service = providers.Singleton(
+        StreamService,
+        db_sessionmaker,
+        event_bus,
+        replay_size=256,
+        max_pending=128,
+        linger=60.0)
     search_service = providers.Singleton(
         SearchService,
-        db_sessionmaker)
\ No newline at end of file
+        db_sessionmaker)
+    partition_service = providers.Singleton(
+        PartitionService,
+        db_sessionmaker,
+        config.db.partition_months_ahead.as_int(),
+        config.db.message_retention_months.as_int())
+    import_service = providers.Singleton(
+        ImportService,
+        db_sessionmaker,
+        version_service,
+        batch_size=10000,
+        rows_per_statement=1000)
\ No newline at end of file
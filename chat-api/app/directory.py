@@ -6,3 +6,5 @@ class Directory(enum.StrEnum):
     PROFILE_PICTURES = 'profile_pictures'
     ATTACHMENTS = 'attachments'
     EMAIL_TEMPLATES = 'email_templates'
+    GEOIP = 'geoip'
+    ARCHIVE = 'archive'
\ No newline at end of file
@@ -0,0 +1,37 @@
+import io
+import typing
+
+class InvalidImageError(Exception):
+    '''
+    File is not an image in a format Pillow can read.
+    '''
+
+def render_jpegs(file: typing.BinaryIO,
+                 sizes: typing.Iterable[tuple[int, int]],
+                 quality: int) -> list[bytes]:
+    '''
+    Resizes the image to each of `sizes` (width, height) and encodes it as JPEG.
+
+    :raises InvalidImageError: If the file is not a valid image.
+    '''
+
+    # Pillow and its format plugins are only loaded when the first image gets processed
+    from PIL import Image
+
+    try:
+        img = Image.open(file)
+    except Image.UnidentifiedImageError as e:
+        raise InvalidImageError() from e
+
+    renders = list[bytes]()
+    with img:
+        if img.mode in ('RGBA', 'P'):
+            img = img.convert('RGB')
+
+        for size in sizes:
+            output = io.BytesIO()
+            img.resize(size=size, resample=Image.Resampling.LANCZOS) \
+                .save(output, format='JPEG', quality=quality)
+            renders.append(output.getvalue())
+
+    return renders
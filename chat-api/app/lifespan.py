@@ -1,23 +1,75 @@
+import asyncio
 import contextlib
+import logging
+import time
 import fastapi
 from sqlalchemy.ext.asyncio import AsyncEngine
 from dependency_injector.wiring import inject, Provide
 
-from app.models.sql import Base
+from app import database, metrics, migrations, tracing
 from app.services.message_service import MessageService
+from app.services.read_receipt_service import ReadReceiptService
+from app.services.sync_service import SyncService
+from app.services.stream_service import StreamService
+from app.services.location_service import LocationService
+from app.services.event_bus import EventBus
+from app.services.version_service import VersionService
+from app.services.rate_limit_service import RateLimitService
+from app.services.partition_service import PartitionService
+from app.services.archive_service import ArchiveService
+
+_logger = logging.getLogger(__name__)
 
 @contextlib.asynccontextmanager
 @inject
 async def lifespan(app: fastapi.FastAPI,
                    db_engine: AsyncEngine = Provide['db_engine'],
-                   message_service: MessageService = Provide['message_service']):
+                   message_service: MessageService = Provide['message_service'],
+                   read_receipt_service: ReadReceiptService = Provide['read_receipt_service'],
+                   sync_service: SyncService = Provide['sync_service'],
+                   stream_service: StreamService = Provide['stream_service'],
+                   location_service: LocationService = Provide['location_service'],
+                   event_bus: EventBus = Provide['event_bus'],
+                   version_service: VersionService = Provide['version_service'],
+                   rate_limit_service: RateLimitService = Provide['rate_limit_service'],
+                   partition_service: PartitionService = Provide['partition_service'],
+                   archive_service: ArchiveService = Provide['archive_service'],
+                   tracing_file: str = Provide['config.tracing.file'],
+                   tracing_otlp_endpoint: str = Provide['config.tracing.otlp_endpoint']):
     # startup
-    async with db_engine.begin() as connection:
-        await connection.run_sync(Base.metadata.create_all)
-    
+    start_time = time.perf_counter()
+    tracing.configure_tracing(tracing_file, tracing_otlp_endpoint)
+
+    # an up to date schema only costs a version lookup
+    await asyncio.gather(
+        migrations.upgrade(db_engine),
+        asyncio.to_thread(location_service.load_database))
+    # before the worker starts accepting requests (and reports itself healthy)
+    await database.prewarm_pool(db_engine)
+
+    partition_service.start_maintenance_task()
+    archive_service.start_archiver_task()
+    sync_service.start_prune_task()
+
+    await event_bus.start()
+    await version_service.start()
+    await rate_limit_service.start()
     message_service.start_db_writer_task()
-    
+    read_receipt_service.start_flush_task()
+
+    _logger.info('Startup finished in %.2f s', time.perf_counter() - start_time)
+
     yield
 
     #cleanup
-    await message_service.shutdown_db_writer_task()
\ No newline at end of file
+    await message_service.shutdown_db_writer_task()
+    await read_receipt_service.shutdown_flush_task()
+    await partition_service.shutdown_maintenance_task()
+    await archive_service.shutdown_archiver_task()
+    await sync_service.shutdown_prune_task()
+    await stream_service.close()
+    await event_bus.stop()
+    await version_service.stop()
+    await rate_limit_service.stop()
+    tracing.shutdown_tracing()
+    metrics.mark_process_dead()
\ No newline at end of file
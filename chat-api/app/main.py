@@ -1,21 +1,39 @@
 import fastapi
 import fastapi.middleware.cors
 import inspect
+import os
+from dependency_injector import providers
 
-from app import routers, dependencies, middleware
+from app import routers, dependencies, middleware, metrics
 from app.lifespan import lifespan
 
+def _from_env(option: providers.ConfigurationOption, name: str, default: str) -> None:
+    # env files list optional settings as `KEY=`, which docker-compose passes as empty strings
+    option.from_value(os.environ.get(name) or default)
+
 dependency_container = dependencies.Container()
 dependency_container.config.db.username.from_env('DB_USERNAME')
 dependency_container.config.db.password.from_env('DB_PASSWORD')
 dependency_container.config.db.address.from_env('DB_ADDRESS')
-dependency_container.config.ipinfo.access_token.from_env('IPINFO_ACCESS_TOKEN')
+_from_env(dependency_container.config.db.n_plus_one_threshold, 'DB_N_PLUS_ONE_THRESHOLD', '10')
+_from_env(dependency_container.config.db.partition_months_ahead, 'DB_PARTITION_MONTHS_AHEAD', '3')
+_from_env(dependency_container.config.db.message_retention_months, 'DB_MESSAGE_RETENTION_MONTHS', '0')
+_from_env(dependency_container.config.db.archive_after_days, 'DB_ARCHIVE_AFTER_DAYS', '0')
+_from_env(dependency_container.config.messages.queue_size, 'MESSAGE_QUEUE_SIZE', '512')
+_from_env(dependency_container.config.messages.batch_min_size, 'MESSAGE_BATCH_MIN_SIZE', '1')
+_from_env(dependency_container.config.messages.batch_max_size, 'MESSAGE_BATCH_MAX_SIZE', '256')
+_from_env(dependency_container.config.messages.batch_target_latency_ms, 'MESSAGE_BATCH_TARGET_LATENCY_MS', '50')
+_from_env(dependency_container.config.sync.retention_days, 'SYNC_RETENTION_DAYS', '7')
+dependency_container.config.ipinfo.access_token.from_env('IPINFO_ACCESS_TOKEN', default='')
+_from_env(dependency_container.config.geoip.database_file, 'GEOIP_DATABASE_FILE', 'ip_country.csv')
 dependency_container.config.security.min_password_length.from_env('MIN_PASSWORD_LENGTH')
 dependency_container.config.security.password_salt_rounds.from_env('PASSWORD_SALT_ROUNDS')
 dependency_container.config.security.jwt_secret.from_env('JWT_SECRET')
 dependency_container.config.security.jwt_expire_time.from_env('JWT_EXPIRE_TIME')
 dependency_container.config.security.email_verification_key.from_env('EMAIL_VERIFICATION_KEY')
 dependency_container.config.security.email_verification_salt.from_env('EMAIL_VERIFICATION_SALT')
+dependency_container.config.security.admin_token.from_env('ADMIN_TOKEN', default='')
+_from_env(dependency_container.config.security.rate_limits_enabled, 'RATE_LIMITS_ENABLED', '1')
 dependency_container.config.security.email_confirm_code_max_age.from_env('EMAIL_CONFIRM_CODE_MAX_AGE')
 dependency_container.config.security.email_verification_token_salt_rounds.from_env('EMAIL_VERIFICATION_TOKEN_SALT_ROUNDS')
 dependency_container.config.smtp.host.from_env('SMTP_HOST')
@@ -24,21 +42,27 @@ dependency_container.config.smtp.user.from_env('SMTP_USER')
 dependency_container.config.smtp.password.from_env('SMTP_PASSWORD')
 dependency_container.config.fs.data_directory.from_env('FS_DATA_DIRECTORY')
 dependency_container.config.user.profile_picture_size.from_env('PROFILE_PICTURE_SIZE')
+_from_env(dependency_container.config.user.profile_picture_sizes, 'PROFILE_PICTURE_SIZES', '32,64,128')
+_from_env(dependency_container.config.user.profile_picture_cache_size, 'PROFILE_PICTURE_CACHE_SIZE', str(32 * 1024 * 1024))
+dependency_container.config.event_bus.url.from_env('EVENT_BUS_URL', default='')
+dependency_container.config.tracing.file.from_env('TRACING_FILE', default='')
+dependency_container.config.tracing.otlp_endpoint.from_env('TRACING_OTLP_ENDPOINT', default='')
 dependency_container.wire(
     packages=['app.routers'],
-    modules=['app.middleware', 'app.lifespan'],
+    modules=['app.middleware', 'app.lifespan', 'app.rate_limit'],
     warn_unresolved=True)
 
 app = fastapi.FastAPI(lifespan=lifespan)
-app.middleware('http')(middleware.validate_api_key_header)
-app.middleware('http')(middleware.add_process_time_header)
+# last added middleware runs first
+app.add_middleware(middleware.APIKeyMiddleware)
+app.add_middleware(middleware.TimingMiddleware)
 app.add_middleware(
     fastapi.middleware.cors.CORSMiddleware,
     allow_credentials=True,
     allow_origins=('*',),
     allow_methods=('*',),
     allow_headers=('*',),
-    expose_headers=('x-process-time', ))
+    expose_headers=('x-process-time', 'server-timing'))
 
 @app.exception_handler(fastapi.HTTPException)
 async def http_exception_handler(_: fastapi.Request, exc: fastapi.HTTPException):
@@ -57,4 +81,14 @@ async def get_health():
     Check API health. Returns `ok` if the API is running.
     '''
 
-    return 'ok'
\ No newline at end of file
+    return 'ok'
+
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    '''
+    Exposes runtime metrics in Prometheus text format.
+    '''
+
+    return fastapi.Response(
+        content=metrics.generate_latest(),
+        media_type=metrics.CONTENT_TYPE)
\ No newline at end of file
@@ -3,6 +3,7 @@ import enum
 class MediaType(enum.StrEnum):
     # --- Application ---
     APPLICATION_JSON = 'application/json'
+    APPLICATION_NDJSON = 'application/x-ndjson'
     APPLICATION_JAVASCRIPT = 'application/javascript'
     APPLICATION_XML = 'application/xml'
     APPLICATION_XHTML = 'application/xhtml+xml'
@@ -29,6 +30,7 @@ class MediaType(enum.StrEnum):
     TEXT_CSV = 'text/csv'
     TEXT_XML = 'text/xml'
     TEXT_MARKDOWN = 'text/markdown'
+    TEXT_EVENT_STREAM = 'text/event-stream'
 
     # --- Image ---
     IMAGE_JPEG = 'image/jpeg'
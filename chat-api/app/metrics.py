@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+import typing
+import prometheus_client
+import prometheus_client.multiprocess
+
+_T = typing.TypeVar('_T')
+
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+REQUEST_LATENCY = prometheus_client.Histogram(
+    'chat_http_request_duration_seconds',
+    'HTTP request processing time by route template.',
+    ('method', 'route', 'status'),
+    buckets=_LATENCY_BUCKETS)
+
+MESSAGE_QUEUE_DEPTH = prometheus_client.Gauge(
+    'chat_message_queue_depth',
+    'Number of messages waiting in the upload queue.',
+    multiprocess_mode='livesum')
+MESSAGE_BATCH_SIZE = prometheus_client.Histogram(
+    'chat_message_batch_size',
+    'Number of messages written by the database writer in a single batch.',
+    buckets=_BATCH_SIZE_BUCKETS)
+MESSAGE_BATCH_SIZE_LIMIT = prometheus_client.Gauge(
+    'chat_message_batch_size_limit',
+    'Current upper bound of message batch size, adapted to queue depth and write time.',
+    multiprocess_mode='liveall')
+MESSAGE_BATCH_COMMIT_SECONDS = prometheus_client.Histogram(
+    'chat_message_batch_commit_seconds',
+    'Time spent inserting and committing a single batch of messages.',
+    buckets=_LATENCY_BUCKETS)
+
+DB_POOL_CHECKOUTS = prometheus_client.Counter(
+    'chat_db_pool_checkouts_total',
+    'Number of connections checked out from the database pool.')
+DB_POOL_CHECKOUT_WAIT_SECONDS = prometheus_client.Histogram(
+    'chat_db_pool_checkout_wait_seconds',
+    'Time spent waiting for a database pool connection (including opening new connections).',
+    buckets=_LATENCY_BUCKETS)
+DB_POOL_CHECKED_OUT = prometheus_client.Gauge(
+    'chat_db_pool_checked_out',
+    'Number of database connections currently checked out.',
+    multiprocess_mode='livesum')
+DB_POOL_OVERFLOW = prometheus_client.Gauge(
+    'chat_db_pool_overflow',
+    'Number of database connections opened above the pool size.',
+    multiprocess_mode='livesum')
+
+EXECUTOR_QUEUE_SECONDS = prometheus_client.Histogram(
+    'chat_executor_queue_seconds',
+    'Time a blocking job waited for a worker thread.',
+    ('executor',),
+    buckets=_LATENCY_BUCKETS)
+EXECUTOR_RUN_SECONDS = prometheus_client.Histogram(
+    'chat_executor_run_seconds',
+    'Time a blocking job spent running on a worker thread.',
+    ('executor',),
+    buckets=_LATENCY_BUCKETS)
+
+EMAIL_OUTBOX_DEPTH = prometheus_client.Gauge(
+    'chat_email_outbox_depth',
+    'Number of emails currently being delivered.',
+    multiprocess_mode='livesum')
+
+EVENT_STREAMS_OPEN = prometheus_client.Gauge(
+    'chat_event_streams_open',
+    'Number of open Server-Sent Events connections.',
+    multiprocess_mode='livesum')
+EVENT_STREAMS_DROPPED = prometheus_client.Counter(
+    'chat_event_streams_dropped_total',
+    'Server-Sent Events connections closed for reading events too slowly.')
+
+async def to_thread(executor: str,
+                    func: typing.Callable[..., _T],
+                    /,
+                    *args,
+                    **kwargs) -> _T:
+    '''
+    Same as `asyncio.to_thread` but records how long the job waited for a free
+    worker thread and how long it ran, labeled with the given executor name.
+    '''
+
+    submitted_at = time.perf_counter()
+
+    def run() -> _T:
+        started_at = time.perf_counter()
+        EXECUTOR_QUEUE_SECONDS.labels(executor).observe(started_at - submitted_at)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            EXECUTOR_RUN_SECONDS.labels(executor).observe(time.perf_counter() - started_at)
+
+    return await asyncio.to_thread(run)
+
+def generate_latest() -> bytes:
+    '''
+    Renders metrics of all worker processes when `PROMETHEUS_MULTIPROC_DIR` is set (it has
+    to be set before start, workers share metric values through files in it), otherwise
+    only metrics of the current process.
+    '''
+
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return prometheus_client.generate_latest()
+
+    registry = prometheus_client.CollectorRegistry()
+    prometheus_client.multiprocess.MultiProcessCollector(registry)
+    return prometheus_client.generate_latest(registry)
+
+def mark_process_dead() -> None:
+    '''
+    Drops live gauges of the current process from metrics of other workers.
+    '''
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        prometheus_client.multiprocess.mark_process_dead(os.getpid())
@@ -1,42 +1,130 @@
 import fastapi
 import time
 from dependency_injector.wiring import Provide, inject
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.services.auth_service import AuthorizationService
-from app import error
+from app import error, metrics, request_timing
 
 _OPEN_ENDPOINTS = ('/health', '/docs', '/redoc', '/openapi.json')
+# close code sent to websocket clients failing API key validation (policy violation)
+_WEBSOCKET_POLICY_VIOLATION = 1008
 
 class ErrorAPIKeyMissing(error.Error):
     error_code: str = 'api_key_missing'
     error_message: str = 'API key must be present in X-Api-Key header to access this endpoint.'
 
-@inject
-async def validate_api_key_header(request: fastapi.Request,
-                                  call_next,
-                                  auth_service: AuthorizationService = Provide['auth_service']):
-    if request.url.path not in _OPEN_ENDPOINTS:
-        api_key = request.headers.get('x-api-key')
+# Both middlewares are plain ASGI applications instead of `app.middleware('http')`
+# functions; those run on Starlette's BaseHTTPMiddleware, which moves every response
+# body through an extra task and memory stream, slowing down file and streaming responses.
+
+class APIKeyMiddleware:
+    '''
+    Rejects HTTP requests and websocket connections without a valid `X-Api-Key` header.
+    '''
+
+    def __init__(self, app: ASGIApp) -> None:
+        self._app = app
+
+    @inject
+    async def __call__(self,
+                       scope: Scope,
+                       receive: Receive,
+                       send: Send,
+                       auth_service: AuthorizationService = Provide['auth_service']) -> None:
+        if scope['type'] not in ('http', 'websocket') or scope['path'] in _OPEN_ENDPOINTS:
+            await self._app(scope, receive, send)
+            return
+
+        api_key = Headers(scope=scope).get('x-api-key')
         if api_key is None:
-            return fastapi.Response(
-                content=ErrorAPIKeyMissing().model_dump_json(),
-                status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
-                media_type='application/json')
-        
+            await self._reject(
+                scope,
+                receive,
+                send,
+                fastapi.Response(
+                    content=ErrorAPIKeyMissing().model_dump_json(),
+                    status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
+                    media_type='application/json'))
+            return
+
         try:
             await auth_service.validate_api_key(api_key)
         except fastapi.HTTPException as e:
-            return fastapi.Response(
-                content=e.detail,
-                headers=e.headers,
-                status_code=e.status_code,
-                media_type='application/json')
-    
-    return await call_next(request)
-
-async def add_process_time_header(request: fastapi.Request,
-                                  call_next,):
-    start_time = time.perf_counter()
-    response = await call_next(request)
-    response.headers['X-Process-Time'] = str(time.perf_counter() - start_time)
-    return response
\ No newline at end of file
+            await self._reject(scope, receive, send, _error_response(e))
+            return
+
+        await self._app(scope, receive, send)
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send, response: fastapi.Response) -> None:
+        if scope['type'] == 'websocket':
+            await send({'type': 'websocket.close', 'code': _WEBSOCKET_POLICY_VIOLATION})
+            return
+
+        await response(scope, receive, send)
+
+class TimingMiddleware:
+    '''
+    Adds `X-Process-Time` and `Server-Timing` headers, logs request summary and records
+    request latency. Time is measured until the response starts, streamed bodies
+    are not included.
+    '''
+
+    def __init__(self, app: ASGIApp) -> None:
+        self._app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self._app(scope, receive, send)
+            return
+
+        timings = request_timing.start_request(scope['path'])
+        start_time = time.perf_counter()
+        recorded = False
+
+        def record(status_code: int) -> float:
+            nonlocal recorded
+            recorded = True
+
+            process_time = time.perf_counter() - start_time
+            request_timing.log_request_summary(timings, process_time)
+
+            # label by route template to keep metric cardinality bounded
+            route = scope.get('route')
+            metrics.REQUEST_LATENCY \
+                .labels(scope['method'], route.path if route is not None else 'unmatched', status_code) \
+                .observe(process_time)
+
+            return process_time
+
+        async def send_with_timing(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                process_time = record(message['status'])
+
+                headers = MutableHeaders(scope=message)
+                headers['X-Process-Time'] = str(process_time)
+                headers['Server-Timing'] = request_timing.format_server_timing(timings, process_time)
+                headers['Timing-Allow-Origin'] = '*'
+
+            await send(message)
+
+        try:
+            await self._app(scope, receive, send_with_timing)
+        finally:
+            # response never started, the exception is turned into 500 further up
+            if not recorded:
+                record(fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _error_response(e: fastapi.HTTPException) -> fastapi.Response:
+    if isinstance(e.detail, str):
+        return fastapi.Response(
+            content=e.detail,
+            headers=e.headers,
+            status_code=e.status_code,
+            media_type='application/json')
+
+    return fastapi.responses.JSONResponse(
+        content=e.detail,
+        headers=e.headers,
+        status_code=e.status_code)
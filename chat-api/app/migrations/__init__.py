@@ -0,0 +1,118 @@
+import importlib
+import logging
+import sqlalchemy
+import sqlalchemy.exc
+from sqlalchemy.dialects import mysql
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+_logger = logging.getLogger(__name__)
+
+# Applied in order, schema version is the number of applied migrations. Only ever
+# append to this list, a deployed migration must not be changed or removed.
+MIGRATIONS = (
+    'm0001_initial_schema',
+    'm0002_room_member_count',
+    'm0003_profile_picture_hash',
+    'm0004_room_users_joined_at_index',
+    'm0005_read_receipts',
+    'm0006_change_log',
+)
+LATEST_VERSION = len(MIGRATIONS)
+
+_LOCK_NAME = 'chat_schema_migrations'
+_LOCK_TIMEOUT = 600
+_VERSION_ROW_ID = 1
+
+_metadata = sqlalchemy.MetaData()
+_schema_version = sqlalchemy.Table(
+    'schema_version',
+    _metadata,
+    sqlalchemy.Column('id', sqlalchemy.SmallInteger, primary_key=True, autoincrement=False),
+    sqlalchemy.Column('version', sqlalchemy.Integer, nullable=False))
+
+async def upgrade(engine: AsyncEngine) -> int:
+    '''
+    Brings the database schema to `LATEST_VERSION` and returns the version. An up to date
+    schema costs a single primary key lookup; otherwise pending migrations are imported
+    and applied by one worker at a time, the others wait for the lock and find the schema
+    up to date.
+    '''
+
+    async with engine.connect() as connection:
+        version = await get_version(connection)
+        if version == LATEST_VERSION:
+            return version
+
+        _check_version(version)
+
+        # locks are held by connection, it has to stay open until the lock is released
+        query = sqlalchemy.select(sqlalchemy.func.get_lock(_LOCK_NAME, _LOCK_TIMEOUT))
+        if not await connection.scalar(query):
+            raise RuntimeError(f'Timed out waiting for schema migration lock {_LOCK_NAME}')
+
+        try:
+            await connection.run_sync(_metadata.create_all)
+            await connection.commit()
+
+            version = await get_version(connection)
+            _check_version(version)
+
+            for (i, name) in enumerate(MIGRATIONS[version:], start=version + 1):
+                _logger.info('Applying schema migration %d: %s', i, name)
+
+                module = importlib.import_module(f'{__name__}.{name}')
+                await module.upgrade(connection)
+                await _set_version(connection, i)
+                # MySQL commits DDL implicitly, this only commits data changes and the version
+                await connection.commit()
+
+                version = i
+        finally:
+            await connection.rollback()
+            query = sqlalchemy.select(sqlalchemy.func.release_lock(_LOCK_NAME))
+            await connection.execute(query)
+
+    return version
+
+async def get_version(connection: AsyncConnection) -> int:
+    '''
+    Version of the database schema, 0 for databases created before schema versioning.
+    '''
+
+    query = sqlalchemy.select(_schema_version.c.version).where(_schema_version.c.id == _VERSION_ROW_ID)
+    try:
+        version = await connection.scalar(query)
+    except sqlalchemy.exc.ProgrammingError:
+        # version table doesn't exist yet
+        await connection.rollback()
+        return 0
+
+    await connection.commit()
+    return version or 0
+
+async def has_column(connection: AsyncConnection, table_name: str, column_name: str) -> bool:
+    query = sqlalchemy.text(
+        'SELECT COUNT(*) FROM information_schema.COLUMNS '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name AND COLUMN_NAME = :column_name')
+
+    return await connection.scalar(query, {'table_name': table_name, 'column_name': column_name}) > 0
+
+async def has_index(connection: AsyncConnection, table_name: str, index_name: str) -> bool:
+    query = sqlalchemy.text(
+        'SELECT COUNT(*) FROM information_schema.STATISTICS '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name AND INDEX_NAME = :index_name')
+
+    return await connection.scalar(query, {'table_name': table_name, 'index_name': index_name}) > 0
+
+async def _set_version(connection: AsyncConnection, version: int) -> None:
+    query = mysql.insert(_schema_version) \
+        .values(id=_VERSION_ROW_ID, version=version)
+    query = query.on_duplicate_key_update(version=query.inserted.version)
+
+    await connection.execute(query)
+
+def _check_version(version: int) -> None:
+    if version > LATEST_VERSION:
+        raise RuntimeError(
+            f'Database schema version {version} is newer than the latest known version {LATEST_VERSION}, '
+            'refusing to run against a schema migrated by a newer release')
@@ -0,0 +1,95 @@
+'''
+Creates the schema of databases set up before schema versioning, tables those databases
+already have are kept as they are. Written out as plain DDL, so it keeps creating the same
+tables whatever later migrations change in the models.
+'''
+
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+_STATEMENTS = (
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGINT NOT NULL AUTO_INCREMENT,
+        username VARCHAR(256) NOT NULL,
+        email VARCHAR(254) NOT NULL,
+        password_hash BINARY(60) NOT NULL,
+        is_email_verified BOOL NOT NULL DEFAULT '0',
+        accepts_friend_requests BOOL NOT NULL DEFAULT '1',
+        created_at DATETIME NOT NULL DEFAULT now(),
+        last_active DATETIME NOT NULL DEFAULT now(),
+        user_activity_status ENUM('ACTIVE','OFFLINE','BRB','DONT_DISTURB') NOT NULL DEFAULT 'OFFLINE',
+        PRIMARY KEY (id),
+        UNIQUE (username),
+        UNIQUE (email))
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS chat_rooms (
+        id BIGINT NOT NULL AUTO_INCREMENT,
+        name VARCHAR(256) NOT NULL,
+        description TEXT(2048) NOT NULL DEFAULT '',
+        type ENUM('PUBLIC','PRIVATE','INVITE_ONLY','INTERNAL') NOT NULL,
+        created_at DATETIME NOT NULL DEFAULT now(),
+        owner_id BIGINT,
+        PRIMARY KEY (id),
+        UNIQUE (name),
+        FULLTEXT INDEX ft_room_name_description (name, description),
+        FOREIGN KEY (owner_id) REFERENCES users (id) ON DELETE CASCADE)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS chat_room_users (
+        user_id BIGINT NOT NULL,
+        room_id BIGINT NOT NULL,
+        joined_at DATETIME NOT NULL DEFAULT now(),
+        PRIMARY KEY (user_id, room_id),
+        CONSTRAINT unique_chat_room_user UNIQUE (user_id, room_id),
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+        FOREIGN KEY (room_id) REFERENCES chat_rooms (id) ON DELETE CASCADE)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS messages (
+        id BIGINT NOT NULL AUTO_INCREMENT,
+        sender_id BIGINT NOT NULL,
+        room_id BIGINT NOT NULL,
+        type ENUM('TEXT','IMAGE','FILE') NOT NULL,
+        content VARCHAR(256) NOT NULL,
+        sent_at DATETIME NOT NULL DEFAULT now(),
+        PRIMARY KEY (id, sent_at),
+        INDEX ix_messages_room_id_sent_at (room_id, sent_at),
+        INDEX ix_messages_sender_id (sender_id))
+    PARTITION BY RANGE (TO_DAYS(sent_at)) (PARTITION p_future VALUES LESS THAN MAXVALUE)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS friends (
+        user_id BIGINT NOT NULL,
+        friend_id BIGINT NOT NULL,
+        accepted_at DATETIME NOT NULL DEFAULT now(),
+        PRIMARY KEY (user_id, friend_id),
+        CONSTRAINT unique_friends UNIQUE (user_id, friend_id),
+        CONSTRAINT check_no_self_friend CHECK (user_id <> friend_id),
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+        FOREIGN KEY (friend_id) REFERENCES users (id) ON DELETE CASCADE)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS friend_requests (
+        sender_id BIGINT NOT NULL,
+        receiver_id BIGINT NOT NULL,
+        sent_at DATETIME NOT NULL DEFAULT now(),
+        PRIMARY KEY (sender_id, receiver_id),
+        CONSTRAINT unique_friend_request UNIQUE (sender_id, receiver_id),
+        CONSTRAINT check_no_self_friend_request CHECK (sender_id <> receiver_id),
+        CONSTRAINT friend_requests_fk_sender FOREIGN KEY (sender_id) REFERENCES users (id) ON DELETE CASCADE,
+        CONSTRAINT friend_requests_fk_receiver FOREIGN KEY (receiver_id) REFERENCES users (id) ON DELETE CASCADE)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS api_keys (
+        `key` BINARY(16) NOT NULL DEFAULT (UUID_TO_BIN(UUID(), 1)),
+        is_active BOOL NOT NULL DEFAULT '1',
+        created_at DATETIME NOT NULL DEFAULT now(),
+        PRIMARY KEY (`key`))
+    ''',
+)
+
+async def upgrade(connection: AsyncConnection) -> None:
+    for statement in _STATEMENTS:
+        await connection.execute(sqlalchemy.text(statement))
@@ -0,0 +1,18 @@
+'''
+Adds denormalized member count of rooms.
+'''
+
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app import migrations
+
+async def upgrade(connection: AsyncConnection) -> None:
+    if await migrations.has_column(connection, 'chat_rooms', 'member_count'):
+        return
+
+    await connection.execute(sqlalchemy.text(
+        'ALTER TABLE chat_rooms ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0'))
+    await connection.execute(sqlalchemy.text(
+        'UPDATE chat_rooms SET member_count = '
+        '(SELECT COUNT(*) FROM chat_room_users WHERE chat_room_users.room_id = chat_rooms.id)'))
@@ -0,0 +1,16 @@
+'''
+Adds hash of the current profile picture of users. Pictures uploaded before stay
+available through the unhashed profile picture endpoints until replaced.
+'''
+
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app import migrations
+
+async def upgrade(connection: AsyncConnection) -> None:
+    if await migrations.has_column(connection, 'users', 'profile_picture_hash'):
+        return
+
+    await connection.execute(sqlalchemy.text(
+        'ALTER TABLE users ADD COLUMN profile_picture_hash VARCHAR(16) NULL'))
@@ -0,0 +1,15 @@
+'''
+Adds index for member listing of rooms ordered by join date.
+'''
+
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app import migrations
+
+async def upgrade(connection: AsyncConnection) -> None:
+    if await migrations.has_index(connection, 'chat_room_users', 'ix_chat_room_users_room_id_joined_at'):
+        return
+
+    await connection.execute(sqlalchemy.text(
+        'CREATE INDEX ix_chat_room_users_room_id_joined_at ON chat_room_users (room_id, joined_at, user_id)'))
@@ -0,0 +1,19 @@
+'''
+Adds per room read receipts of users.
+'''
+
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+async def upgrade(connection: AsyncConnection) -> None:
+    await connection.execute(sqlalchemy.text(
+        '''
+        CREATE TABLE IF NOT EXISTS read_receipts (
+            room_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            message_id BIGINT NOT NULL,
+            updated_at DATETIME NOT NULL DEFAULT now(),
+            PRIMARY KEY (room_id, user_id),
+            FOREIGN KEY (room_id) REFERENCES chat_rooms (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE)
+        '''))
@@ -0,0 +1,23 @@
+'''
+Adds change log read by delta sync.
+'''
+
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+async def upgrade(connection: AsyncConnection) -> None:
+    await connection.execute(sqlalchemy.text(
+        '''
+        CREATE TABLE IF NOT EXISTS change_log (
+            id BIGINT NOT NULL AUTO_INCREMENT,
+            kind ENUM('ROOM_MESSAGES','ROOM_MEMBER','ROOM_UPDATED','ROOM_DELETED','FRIEND_REQUEST','FRIEND_REMOVED','PRESENCE') NOT NULL,
+            room_id BIGINT,
+            recipient_id BIGINT,
+            user_id BIGINT,
+            data JSON NOT NULL,
+            created_at DATETIME NOT NULL DEFAULT now(),
+            PRIMARY KEY (id),
+            INDEX ix_change_log_room_id_id (room_id, id),
+            INDEX ix_change_log_recipient_id_id (recipient_id, id),
+            INDEX ix_change_log_created_at (created_at))
+        '''))
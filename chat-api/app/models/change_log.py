@@ -0,0 +1,113 @@
+import datetime
+import enum
+import typing
+import pydantic
+import sqlalchemy
+from sqlalchemy import sql, orm
+from app.models.sql import Base
+from app.models.message import RoomMessage
+
+class ChangeKind(enum.StrEnum):
+    ROOM_MESSAGES = 'ROOM_MESSAGES'
+    '''
+    Messages were posted to the room, delivered as `messages` of the sync response
+    '''
+
+    ROOM_MEMBER = 'ROOM_MEMBER'
+    '''
+    User joined (`data.joined` true) or left the room
+    '''
+
+    ROOM_UPDATED = 'ROOM_UPDATED'
+    '''
+    Room details (name, description, type) changed
+    '''
+
+    ROOM_DELETED = 'ROOM_DELETED'
+    FRIEND_REQUEST = 'FRIEND_REQUEST'
+    '''
+    Friend request between the user and `user_id` was sent, accepted or declined (`data.state`)
+    '''
+
+    FRIEND_REMOVED = 'FRIEND_REMOVED'
+    PRESENCE = 'PRESENCE'
+    '''
+    Friend changed activity status. Neither staying active nor going offline through inactivity
+    is logged, so the status only holds until `data.expires_at`; past it the client has to fetch
+    the friend's presence again.
+    '''
+
+class SQLChange(Base):
+    '''
+    Append-only log of changes clients catch up on through `/sync`, the row ID is the sync
+    position. A change concerns members of `room_id`, the single user `recipient_id`, or
+    friends of `user_id` (presence). Changes are written as the last statement before commit,
+    `/sync` relies on them becoming visible shortly after `created_at`.
+    '''
+
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        sqlalchemy.Index('ix_change_log_room_id_id', 'room_id', 'id'),
+        sqlalchemy.Index('ix_change_log_recipient_id_id', 'recipient_id', 'id'),
+        sqlalchemy.Index('ix_change_log_created_at', 'created_at'),
+    )
+
+    id: orm.Mapped[int] = orm.mapped_column(
+        sqlalchemy.BigInteger,
+        primary_key=True,
+        autoincrement=True)
+    kind: orm.Mapped[ChangeKind] = orm.mapped_column(
+        sqlalchemy.Enum(ChangeKind),
+        nullable=False)
+    room_id: orm.Mapped[int | None] = orm.mapped_column(
+        sqlalchemy.BigInteger,
+        nullable=True)
+    recipient_id: orm.Mapped[int | None] = orm.mapped_column(
+        sqlalchemy.BigInteger,
+        nullable=True)
+    user_id: orm.Mapped[int | None] = orm.mapped_column(
+        sqlalchemy.BigInteger,
+        nullable=True)
+    '''
+    User the change is about
+    '''
+
+    data: orm.Mapped[dict[str, typing.Any]] = orm.mapped_column(
+        sqlalchemy.JSON,
+        nullable=False,
+        default=dict)
+    created_at: orm.Mapped[datetime.datetime] = orm.mapped_column(
+        sqlalchemy.DateTime,
+        nullable=False,
+        server_default=sql.func.now())
+
+class APIChange(pydantic.BaseModel):
+    model_config = {'from_attributes': True}
+
+    kind: ChangeKind
+    room_id: int | None
+    user_id: int | None
+    data: dict[str, typing.Any]
+
+class APISyncMessage(RoomMessage):
+    room_id: int
+
+class APISync(pydantic.BaseModel):
+    token: int
+    '''
+    Position to pass as `since` on the next sync
+    '''
+
+    reset: bool
+    '''
+    Changes since the given position are no longer kept (or no position was given),
+    the client has to fetch its whole state again and continue syncing from `token`
+    '''
+
+    has_more: bool
+    '''
+    More changes are available, sync again from `token` right away
+    '''
+
+    changes: list[APIChange]
+    messages: list[APISyncMessage]
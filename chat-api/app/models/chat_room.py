@@ -7,7 +7,6 @@ from sqlalchemy import sql, orm
 from app.models.sql import Base
 from app.models.message import RoomMessage
 from app.models.user import UserActivityStatus
-from app.models.last_room_message import SQLLastRoomMessage
 from app.models.chat_room_user import SQLChatRoomUser
 
 _CHAT_ROOM_NAME_MAX_LENGTH = 256
@@ -55,16 +54,18 @@ class SQLChatRoom(Base):
         sqlalchemy.BigInteger,
         sqlalchemy.ForeignKey('users.id', ondelete='CASCADE'),
         nullable=True)
+    member_count: orm.Mapped[int] = orm.mapped_column(
+        sqlalchemy.Integer,
+        nullable=False,
+        server_default='0')
+    '''
+    Denormalized number of `chat_room_users` rows of the room, kept up to date by services
+    adding and removing members so that room lists don't have to count them.
+    '''
     
     users: orm.Mapped[list['SQLChatRoomUser']] = orm.relationship(
         'SQLChatRoomUser',
-        back_populates='room',
-        lazy='selectin')
-    last_message: orm.Mapped['SQLLastRoomMessage'] = orm.relationship(
-        'SQLLastRoomMessage',
-        primaryjoin=orm.foreign(SQLLastRoomMessage.room_id) == id,
-        viewonly=True,
-        uselist=False)
+        back_populates='room')
     
 class APIUserChatRoom(pydantic.BaseModel):
     model_config = {'from_attributes': True}
@@ -72,6 +73,7 @@ class APIUserChatRoom(pydantic.BaseModel):
     id: int
     type: RoomType
     name: str
+    member_count: int
     last_message: RoomMessage | None
 
 class APIChatRoomUser(pydantic.BaseModel):
@@ -82,6 +84,14 @@ class APIChatRoomUser(pydantic.BaseModel):
     activity_status: UserActivityStatus
     last_active: datetime.datetime
     is_owner: bool
+    profile_picture_hash: str | None
+
+class APIChatRoomUserPage(pydantic.BaseModel):
+    users: list[APIChatRoomUser]
+    next_cursor: str | None
+    '''
+    Cursor of the following page, `None` if this is the last one
+    '''
 
 class APIChatRoom(pydantic.BaseModel):
     model_config = {'from_attributes': True}
@@ -91,7 +101,11 @@ class APIChatRoom(pydantic.BaseModel):
     description: str | None
     type: RoomType
     created_at: datetime.datetime
-    users: list[APIChatRoomUser]
+    member_count: int
+    users: APIChatRoomUserPage
+    '''
+    First page of room members, the rest is available through `/room/{room_id}/users`
+    '''
 
 class APIChatRoomInfo(pydantic.BaseModel):
     model_config = {'from_attributes': True}
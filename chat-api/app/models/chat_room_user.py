@@ -13,6 +13,8 @@ class SQLChatRoomUser(Base):
     __tablename__ = 'chat_room_users'
     __table_args__ = (
         sqlalchemy.UniqueConstraint('user_id', 'room_id', name='unique_chat_room_user'),
+        # member listing of a room ordered by join date, also covers member counting
+        sqlalchemy.Index('ix_chat_room_users_room_id_joined_at', 'room_id', 'joined_at', 'user_id'),
     )
     
     user_id: orm.Mapped[int] = orm.mapped_column(
@@ -133,6 +133,12 @@ class ErrorUserJWTInvalid(Error):
     error_code: str = 'jwt_invalid'
     error_message: str = 'User JWT is invalid.'
 
+class ErrorProfilePictureNotFound(Error):
+    user_id: int
+    picture_hash: str
+    error_code: str = 'profile_picture_not_found'
+    error_message: str = 'User has no profile picture with given hash.'
+
 class ErrorRoomAlreadyExists(Error):
     room_name: str
     error_code: str = 'room_already_exists'
@@ -188,6 +194,20 @@ class ErrorRoomDeleteInternal(Error):
     error_code: str = 'room_delete_internal'
     error_message: str = 'Cannot manually delete internal chat room.'
 
+class ErrorRoomUsersCursorInvalid(Error):
+    cursor: str
+    error_code: str = 'room_users_cursor_invalid'
+    error_message: str = 'Cursor is malformed or belongs to a different room users order.'
+
+class ErrorRateLimited(Error):
+    retry_after: float
+    '''
+    Seconds after which the request may be retried
+    '''
+
+    error_code: str = 'rate_limited'
+    error_message: str = 'Too many requests, try again later.'
+
 class ErrorDatabaseFail(Error):
     error_code: str = 'database_fail'
     error_message: str = 'Database operation failed.'
@@ -196,8 +216,18 @@ class ErrorInvalidMessage(Error):
     error_code: str = 'invalid_message'
     error_message: str = 'Either message text or file attachment must be specified.'
 
+class ErrorMessageNotFound(Error):
+    room_id: int
+    message_id: int
+    error_code: str = 'message_not_found'
+    error_message: str = 'Message with given ID was not found in the chat room.'
+
 class ErrorAttachmentNotFound(Error):
     attachment_id: str
     room_id: int
     error_code: str = 'attachment_not_found'
-    error_message: str = 'Attachment with given ID was not found.'
\ No newline at end of file
+    error_message: str = 'Attachment with given ID was not found.'
+
+class ErrorAdminTokenInvalid(Error):
+    error_code: str = 'admin_token_invalid'
+    error_message: str = 'Valid X-Admin-Token header is required to access administrative endpoints.'
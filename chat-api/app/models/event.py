@@ -0,0 +1,29 @@
+import enum
+import typing
+import pydantic
+
+class EventType(enum.StrEnum):
+    ROOM_MESSAGE = 'ROOM_MESSAGE'
+    PRESENCE = 'PRESENCE'
+    TYPING = 'TYPING'
+
+class APIEvent(pydantic.BaseModel):
+    type: EventType
+    '''
+    Kind of the event, determines the contents of `data`
+    '''
+
+    room_id: int | None = None
+    '''
+    Room the event relates to, if any
+    '''
+
+    user_id: int | None = None
+    '''
+    User that caused the event, if any
+    '''
+
+    data: dict[str, typing.Any] = {}
+    '''
+    Event payload
+    '''
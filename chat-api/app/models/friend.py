@@ -48,6 +48,12 @@ class APIFriend(pydantic.BaseModel):
     Current activity status of the friend user
     '''
 
+    profile_picture_hash: str | None
+    '''
+    Hash of the current profile picture, `None` if the user has none. The picture is
+    served (and cacheable forever) at `/user/{id}/profile-picture/{hash}?size=<pixels>`.
+    '''
+
 class APIFriendActivity(pydantic.BaseModel):
     model_config = {'from_attributes': True}
 
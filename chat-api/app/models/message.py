@@ -1,12 +1,13 @@
 from enum import StrEnum
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from sqlalchemy import DateTime, String, sql, orm, BigInteger, ForeignKey, Enum
+from sqlalchemy import DateTime, String, sql, orm, BigInteger, Enum, Index
 
 from app.models.sql import Base
 from app.media_type import MediaType
 
 MAX_MESSAGE_LENGTH = 256
+FUTURE_PARTITION_NAME = 'p_future'
 
 class MessageType(StrEnum):
     TEXT = 'TEXT'
@@ -15,6 +16,16 @@ class MessageType(StrEnum):
 
 class SQLMessage(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_room_id_sent_at', 'room_id', 'sent_at'),
+        Index('ix_messages_sender_id', 'sender_id'),
+        {
+            # Monthly partitions are created ahead of time by `PartitionService`, `p_future`
+            # only catches rows written while maintenance is behind. Partitioned InnoDB tables
+            # can't have foreign keys, deletes of users and rooms remove their messages explicitly.
+            'mysql_partition_by': f'RANGE (TO_DAYS(sent_at)) (PARTITION {FUTURE_PARTITION_NAME} VALUES LESS THAN MAXVALUE)',
+        },
+    )
 
     id: orm.Mapped[int] = orm.mapped_column(
         BigInteger,
@@ -22,11 +33,9 @@ class SQLMessage(Base):
         autoincrement=True)
     sender_id: orm.Mapped[int] = orm.mapped_column(
         BigInteger,
-        ForeignKey('users.id', ondelete='CASCADE'),
         nullable=False)
     room_id: orm.Mapped[int] = orm.mapped_column(
         BigInteger,
-        ForeignKey('chat_rooms.id', ondelete='CASCADE'),
         nullable=False)
     type: orm.Mapped[MessageType] = orm.mapped_column(
         Enum(
@@ -36,8 +45,10 @@ class SQLMessage(Base):
     content: orm.Mapped[str] = orm.mapped_column(
         String(length=MAX_MESSAGE_LENGTH),
         nullable=False)
+    # partitioning column has to be a part of every unique key
     sent_at: orm.Mapped[datetime] = orm.mapped_column(
         DateTime(),
+        primary_key=True,
         nullable=False,
         server_default=sql.func.now())
     
@@ -69,4 +80,32 @@ class RoomMessage(BaseModel):
     content: str
     sent_at: datetime
     sender_id: int
-    sender_username: str
\ No newline at end of file
+    sender_username: str
+
+class ExportedRoomMessage(RoomMessage):
+    attachment_url: str | None
+    '''
+    API path of the attachment for image and file messages
+    '''
+
+class ImportedMessage(BaseModel):
+    sender_id: int
+    room_id: int
+    type: MessageType = MessageType.TEXT
+    content: str = Field(max_length=MAX_MESSAGE_LENGTH)
+    sent_at: datetime
+    '''
+    Original send time, naive values are treated as UTC
+    '''
+
+class ImportRejectedLine(BaseModel):
+    line: int
+    reason: str
+
+class ImportResult(BaseModel):
+    imported: int = 0
+    rejected: int = 0
+    rejected_lines: list[ImportRejectedLine] = []
+    '''
+    First rejected lines with rejection reason
+    '''
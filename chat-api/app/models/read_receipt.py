@@ -0,0 +1,38 @@
+import datetime
+import pydantic
+import sqlalchemy
+from sqlalchemy import sql, orm
+from app.models.sql import Base
+
+class SQLReadReceipt(Base):
+    __tablename__ = 'read_receipts'
+
+    room_id: orm.Mapped[int] = orm.mapped_column(
+        sqlalchemy.BigInteger,
+        sqlalchemy.ForeignKey('chat_rooms.id', ondelete='CASCADE'),
+        primary_key=True)
+    user_id: orm.Mapped[int] = orm.mapped_column(
+        sqlalchemy.BigInteger,
+        sqlalchemy.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True)
+    message_id: orm.Mapped[int] = orm.mapped_column(
+        sqlalchemy.BigInteger,
+        nullable=False)
+    '''
+    Highest message ID the user has read in the room, earlier messages are read as well
+    '''
+
+    updated_at: orm.Mapped[datetime.datetime] = orm.mapped_column(
+        sqlalchemy.DateTime,
+        nullable=False,
+        server_default=sql.func.now(),
+        onupdate=sql.func.now())
+
+class APIReadReceipt(pydantic.BaseModel):
+    model_config = {'from_attributes': True}
+
+    user_id: int
+    message_id: int
+    '''
+    Highest message ID read by the user, every message with lower or equal ID has been seen
+    '''
@@ -10,6 +10,11 @@ from app.models.chat_room_user import SQLChatRoomUser
 if typing.TYPE_CHECKING:
     from app.models.chat_room import SQLChatRoom
 
+INACTIVE_AFTER = datetime.timedelta(minutes=3)
+'''
+Users that weren't active for this long are shown offline, whatever status they set
+'''
+
 class UserActivityStatus(enum.StrEnum):
     ACTIVE = 'ACTIVE'
     OFFLINE = 'OFFLINE'
@@ -57,9 +62,12 @@ class SQLUser(Base):
             native_enum=True),
         nullable=False,
         server_default=UserActivityStatus.OFFLINE.value)
+    profile_picture_hash: orm.Mapped[str | None] = orm.mapped_column(
+        sqlalchemy.String(16),
+        nullable=True)
     activity_status: typing.ClassVar[UserActivityStatus] = orm.column_property(
         sql.func.if_(
-            last_active < sql.func.date_sub(sql.func.now(), sql.text('INTERVAL 3 MINUTE')),
+            last_active < sql.func.date_sub(sql.func.now(), sql.text(f'INTERVAL {int(INACTIVE_AFTER.total_seconds())} SECOND')),
             UserActivityStatus.OFFLINE.value,
             user_activity_status)
         .cast(sqlalchemy.Enum(UserActivityStatus)))
@@ -79,6 +87,11 @@ class APIUserSelf(pydantic.BaseModel):
     created_at: datetime.datetime
     last_active: datetime.datetime
     activity_status: UserActivityStatus
+    profile_picture_hash: str | None
+    '''
+    Hash of the current profile picture, `None` if the user has none. The picture is
+    served (and cacheable forever) at `/user/{id}/profile-picture/{hash}?size=<pixels>`.
+    '''
 
 class APIUserForeign(pydantic.BaseModel):
     model_config = {'from_attributes': True}
@@ -89,3 +102,8 @@ class APIUserForeign(pydantic.BaseModel):
     created_at: datetime.datetime
     last_active: datetime.datetime
     activity_status: UserActivityStatus
+    profile_picture_hash: str | None
+    '''
+    Hash of the current profile picture, `None` if the user has none. The picture is
+    served (and cacheable forever) at `/user/{id}/profile-picture/{hash}?size=<pixels>`.
+    '''
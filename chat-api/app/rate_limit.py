@@ -0,0 +1,103 @@
+import enum
+import hashlib
+import logging
+import typing
+import fastapi
+from dependency_injector.wiring import Provide, inject
+
+from app.models.errors import ErrorRateLimited
+from app.services.auth_service import AuthorizationService
+from app.services.rate_limit_service import RateLimit, RateLimitService
+
+_logger = logging.getLogger(__name__)
+
+class RateLimitKey(enum.StrEnum):
+    IP = 'ip'
+    '''
+    Client address
+    '''
+
+    IP_USERNAME = 'ip_username'
+    '''
+    Client address together with the `username` field of the submitted form, so users sharing
+    an address (NAT, proxies) don't lock each other out
+    '''
+
+    USER = 'user'
+    '''
+    User authenticated by JWT, requests without a valid JWT are not limited by this key
+    '''
+
+    API_KEY = 'api_key'
+
+class RateLimiter:
+    '''
+    Route dependency rejecting requests over `rate` (see `RateLimit.parse`) with
+    `429 Too Many Requests`. Being a dependency, it runs before the endpoint does any
+    expensive work (password hashing, database writes):
+
+        @router.post('/login', dependencies=[fastapi.Depends(RateLimiter('login', '10/minute', RateLimitKey.IP_USERNAME))])
+    '''
+
+    def __init__(self, name: str, rate: str, *keys: RateLimitKey) -> None:
+        assert keys, 'At least one rate limit key is required'
+
+        self._name = name
+        self._limit = RateLimit.parse(rate)
+        self._keys = keys
+
+    @inject
+    async def __call__(self,
+                       request: fastapi.Request,
+                       rate_limit_service: RateLimitService = fastapi.Depends(Provide['rate_limit_service']),
+                       auth_service: AuthorizationService = fastapi.Depends(Provide['auth_service'])) -> None:
+        keys = [
+            f'{self._name}:{key}:{value}'
+            for key in self._keys
+            if (value := await self._get_key_value(key, request, auth_service)) is not None]
+        if not keys:
+            return
+
+        try:
+            retry_after = await rate_limit_service.acquire(keys, self._limit)
+        except Exception:
+            # an unavailable limiter must not take the API down with it
+            _logger.exception('Rate limit check of %s failed', self._name)
+            return
+
+        if retry_after is not None:
+            ErrorRateLimited(retry_after=retry_after) \
+                .raise_(fastapi.status.HTTP_429_TOO_MANY_REQUESTS, {'Retry-After': str(max(1, round(retry_after)))})
+
+    async def _get_key_value(self,
+                             key: RateLimitKey,
+                             request: fastapi.Request,
+                             auth_service: AuthorizationService) -> str | None:
+        match key:
+            case RateLimitKey.IP:
+                return request.client.host if request.client is not None else None
+            case RateLimitKey.IP_USERNAME:
+                if request.client is None:
+                    return None
+
+                # the form is parsed once per request, the endpoint gets the same one
+                username = (await request.form()).get('username')
+                if not isinstance(username, str) or not username:
+                    return None
+
+                # like API keys, user input stays out of keys of shared backends
+                username_hash = hashlib.blake2b(username.lower().encode(), digest_size=12).hexdigest()
+                return f'{request.client.host}:{username_hash}'
+            case RateLimitKey.API_KEY:
+                api_key = request.headers.get('x-api-key')
+                # keys of shared backends shouldn't contain credentials
+                return hashlib.blake2b(api_key.encode(), digest_size=12).hexdigest() if api_key else None
+            case RateLimitKey.USER:
+                (scheme, _, token) = request.headers.get('authorization', '').partition(' ')
+                if scheme.lower() != 'bearer' or not token:
+                    return None
+
+                try:
+                    return str(auth_service.decode_jwt(token))
+                except fastapi.HTTPException:
+                    return None
@@ -0,0 +1,173 @@
+import collections
+import contextvars
+import dataclasses
+import enum
+import functools
+import inspect
+import logging
+import re
+import time
+import typing
+import fastapi.routing
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_logger = logging.getLogger(__name__)
+
+_STATEMENT_WHITESPACE_REGEX = re.compile(r'\s+')
+_STATEMENT_IN_LIST_REGEX = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+
+class Phase(enum.StrEnum):
+    MIDDLEWARE = 'mw'
+    ROUTE = 'ser'
+    ENDPOINT = 'app'
+
+@dataclasses.dataclass
+class RequestTimings:
+    path: str
+    phase: Phase = Phase.MIDDLEWARE
+    route_time: float = 0.0
+    endpoint_time: float = 0.0
+    db_statements: int = 0
+    db_time: float = 0.0
+    db_time_by_phase: dict[Phase, float] = dataclasses.field(default_factory=lambda: collections.defaultdict(float))
+    slowest_statement: str | None = None
+    slowest_statement_time: float = 0.0
+    statement_counts: collections.Counter[str] = dataclasses.field(default_factory=collections.Counter)
+    n_plus_one_reported: bool = False
+
+_current_timings = contextvars.ContextVar[RequestTimings | None]('request_timings', default=None)
+
+def start_request(path: str) -> RequestTimings:
+    '''
+    Creates timings collector for the current request. Must be called by the outermost
+    timing middleware so the collector is shared with everything running downstream.
+    '''
+
+    timings = RequestTimings(path)
+    _current_timings.set(timings)
+
+    return timings
+
+def format_server_timing(timings: RequestTimings, total_time: float) -> str:
+    '''
+    Formats `Server-Timing` header value. Phases are exclusive of database time,
+    which is reported separately:
+    - `mw` - middleware (API key validation, CORS, timing itself)
+    - `ser` - request parsing, dependency resolution and response serialization
+    - `app` - endpoint body
+    - `db` - all SQL statements issued during the request
+    '''
+
+    db_by_phase = timings.db_time_by_phase
+    middleware_time = total_time - timings.route_time - db_by_phase[Phase.MIDDLEWARE]
+    route_time = timings.route_time - timings.endpoint_time - db_by_phase[Phase.ROUTE]
+    endpoint_time = timings.endpoint_time - db_by_phase[Phase.ENDPOINT]
+
+    return ', '.join((
+        f'{Phase.MIDDLEWARE};dur={1000.0 * max(middleware_time, 0.0):.3f}',
+        f'{Phase.ROUTE};dur={1000.0 * max(route_time, 0.0):.3f}',
+        f'{Phase.ENDPOINT};dur={1000.0 * max(endpoint_time, 0.0):.3f}',
+        f'db;dur={1000.0 * timings.db_time:.3f};desc="{timings.db_statements} statements"',
+        f'db-slowest;dur={1000.0 * timings.slowest_statement_time:.3f}',
+        f'total;dur={1000.0 * total_time:.3f}'))
+
+def instrument_engine(engine: Engine, n_plus_one_threshold: int) -> None:
+    '''
+    Registers cursor execution hooks which collect statement statistics for the current
+    request and warn when a single request issues more than `n_plus_one_threshold`
+    statements of the same shape.
+    '''
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statement_time = time.perf_counter() - conn.info['query_start_time'].pop()
+
+        timings = _current_timings.get()
+        if timings is None:
+            return
+
+        timings.db_statements += 1
+        timings.db_time += statement_time
+        timings.db_time_by_phase[timings.phase] += statement_time
+
+        if statement_time > timings.slowest_statement_time:
+            timings.slowest_statement = statement
+            timings.slowest_statement_time = statement_time
+
+        normalized_statement = _normalize_statement(statement)
+        timings.statement_counts[normalized_statement] += 1
+        if not timings.n_plus_one_reported \
+           and timings.statement_counts[normalized_statement] > n_plus_one_threshold:
+            timings.n_plus_one_reported = True
+            _logger.warning(
+                'Possible N+1 query: %s issued the same statement more than %d times: %s',
+                timings.path,
+                n_plus_one_threshold,
+                normalized_statement)
+
+def log_request_summary(timings: RequestTimings, total_time: float) -> None:
+    if timings.db_statements > 0:
+        _logger.debug(
+            '%s took %.3f ms, %d statements in %.3f ms, slowest (%.3f ms): %s',
+            timings.path,
+            1000.0 * total_time,
+            timings.db_statements,
+            1000.0 * timings.db_time,
+            1000.0 * timings.slowest_statement_time,
+            timings.slowest_statement)
+
+class TimedRoute(fastapi.routing.APIRoute):
+    '''
+    API route which records time spent in the whole route handler and in the endpoint
+    function itself, so the remainder can be attributed to parsing and serialization.
+    '''
+
+    def get_route_handler(self) -> typing.Callable:
+        if not getattr(self.dependant.call, '_is_timed', False) \
+           and inspect.iscoroutinefunction(self.dependant.call):
+            self.dependant.call = _timed_endpoint(self.dependant.call)
+
+        route_handler = super().get_route_handler()
+
+        async def timed_route_handler(request: fastapi.Request) -> fastapi.Response:
+            timings = _current_timings.get()
+            if timings is None:
+                return await route_handler(request)
+
+            start_time = time.perf_counter()
+            timings.phase = Phase.ROUTE
+            try:
+                return await route_handler(request)
+            finally:
+                timings.phase = Phase.MIDDLEWARE
+                timings.route_time += time.perf_counter() - start_time
+
+        return timed_route_handler
+
+def _timed_endpoint(endpoint: typing.Callable[..., typing.Awaitable]) -> typing.Callable[..., typing.Awaitable]:
+    @functools.wraps(endpoint)
+    async def timed_endpoint(*args, **kwargs):
+        timings = _current_timings.get()
+        if timings is None:
+            return await endpoint(*args, **kwargs)
+
+        start_time = time.perf_counter()
+        timings.phase = Phase.ENDPOINT
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            timings.phase = Phase.ROUTE
+            timings.endpoint_time += time.perf_counter() - start_time
+
+    timed_endpoint._is_timed = True
+
+    return timed_endpoint
+
+def _normalize_statement(statement: str) -> str:
+    statement = _STATEMENT_WHITESPACE_REGEX.sub(' ', statement).strip()
+    return _STATEMENT_IN_LIST_REGEX.sub('(...)', statement)
@@ -2,9 +2,15 @@ from .auth import router as auth_router
 from .user import router as user_router
 from .room import router as room_router
 from .search import router as search_router
+from .admin import router as admin_router
+from .sync import router as sync_router
+from .events import router as events_router
 
 __all__ = (
     'auth_router',
     'user_router',
     'room_router',
-    'search_router')
\ No newline at end of file
+    'search_router',
+    'admin_router',
+    'sync_router',
+    'events_router')
\ No newline at end of file
@@ -0,0 +1,55 @@
+import secrets
+import typing
+import fastapi
+from dependency_injector.wiring import inject, Provide
+
+from app import request_timing
+from app.media_type import MediaType
+from app.services.import_service import ImportService
+from app.models.message import ImportResult
+from app.models.errors import ErrorAdminTokenInvalid
+
+router = fastapi.APIRouter(
+    prefix='/admin',
+    tags=['admin'],
+    route_class=request_timing.TimedRoute)
+
+@inject
+def verify_admin_token(x_admin_token: str | None = fastapi.Header(None),
+                       admin_token: str = fastapi.Depends(Provide['config.security.admin_token'])):
+    # administrative endpoints are disabled altogether when no token is configured
+    if not admin_token \
+       or x_admin_token is None \
+       or not secrets.compare_digest(x_admin_token.encode(), admin_token.encode()):
+        ErrorAdminTokenInvalid() \
+            .raise_(fastapi.status.HTTP_403_FORBIDDEN)
+
+@router.post(
+    '/import/messages',
+    name='Bulk import messages',
+    response_model=ImportResult,
+    dependencies=[fastapi.Depends(verify_admin_token)],
+    openapi_extra={'requestBody': {'content': {MediaType.APPLICATION_NDJSON: {}}, 'required': True}},
+    responses={
+        fastapi.status.HTTP_403_FORBIDDEN: {'model': ErrorAdminTokenInvalid},
+    })
+@inject
+async def import_messages(request: fastapi.Request,
+                          import_service: ImportService = fastapi.Depends(Provide['import_service'])):
+    '''
+    Imports messages from NDJSON request body, one `{sender_id, room_id, type, content, sent_at}`
+    object per line. The body is consumed as it arrives, so arbitrarily large imports can be sent.
+    '''
+
+    return await import_service.import_messages(_iter_lines(request.stream()))
+
+async def _iter_lines(chunks: typing.AsyncIterator[bytes]) -> typing.AsyncIterator[bytes]:
+    remainder = b''
+    async for chunk in chunks:
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line
+
+    if remainder:
+        yield remainder
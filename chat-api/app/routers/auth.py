@@ -4,11 +4,13 @@ import typing as t
 from dependency_injector.wiring import Provide, inject
 import pydantic
 
+from app import request_timing
+from app.rate_limit import RateLimiter, RateLimitKey
 from app.services import DatetimeService, UserService
 from app.services.email_service import EmailService
 from app.services.auth_service import AuthorizationService
 from app.services.location_service import LocationService
-from app.models.errors import ErrorEmailNotConfirmed, ErrorInvalidPassword, ErrorIPInfoRetrieveFailed, ErrorEmailCodeExpired, ErrorEmailCodeInvalid, ErrorInvalidPasswordEncoding, ErrorInvalidPasswordFormat, ErrorOAuthInvalidClient, ErrorOAuthInvalidRequest, ErrorOAuthUnauthorizedClient, ErrorUserAlreadyExists, ErrorUserNotFoundID, ErrorEmailNotDelivered, ErrorEmailInvalid, ErrorEmailNotFound, ErrorUserNotFoundUsername
+from app.models.errors import ErrorEmailNotConfirmed, ErrorInvalidPassword, ErrorEmailCodeExpired, ErrorEmailCodeInvalid, ErrorInvalidPasswordEncoding, ErrorInvalidPasswordFormat, ErrorOAuthInvalidClient, ErrorOAuthInvalidRequest, ErrorOAuthUnauthorizedClient, ErrorUserAlreadyExists, ErrorUserNotFoundID, ErrorEmailNotDelivered, ErrorEmailInvalid, ErrorEmailNotFound, ErrorRateLimited, ErrorUserNotFoundUsername
 from app.models.oauth import OAuthToken
 
 oauth2_scheme = fastapi.security.oauth2.OAuth2PasswordBearer(tokenUrl='auth/login')
@@ -52,7 +54,8 @@ class PasswordChangedResponse(pydantic.BaseModel):
 
 router = fastapi.APIRouter(
     prefix='/auth',
-    tags=['auth'])
+    tags=['auth'],
+    route_class=request_timing.TimedRoute)
 
 @router.get(
     '/password-validation-rules',
@@ -69,10 +72,12 @@ async def auth_get_password_validation_rules(auth_service: AuthorizationService
     '/register',
     name='Register new user',
     status_code=fastapi.status.HTTP_201_CREATED,
+    dependencies=[fastapi.Depends(RateLimiter('register', '10/hour', RateLimitKey.IP))],
     responses={
+        fastapi.status.HTTP_429_TOO_MANY_REQUESTS: {'model': ErrorRateLimited},
         fastapi.status.HTTP_415_UNSUPPORTED_MEDIA_TYPE: {'model': ErrorInvalidPasswordEncoding},
         fastapi.status.HTTP_400_BAD_REQUEST: {'model': t.Union[ErrorInvalidPasswordFormat, ErrorEmailInvalid, ErrorEmailNotFound]},
-        fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR: {'model': t.Union[ErrorIPInfoRetrieveFailed, ErrorEmailNotDelivered]},
+        fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR: {'model': ErrorEmailNotDelivered},
         fastapi.status.HTTP_409_CONFLICT: {'model': ErrorUserAlreadyExists}
     })
 @inject
@@ -152,7 +157,9 @@ async def auth_verify_email(verification_code: str,
 @router.post(
     '/reset-password/{username}',
     name='Reset password',
+    dependencies=[fastapi.Depends(RateLimiter('reset_password', '5/hour', RateLimitKey.IP))],
     responses={
+        fastapi.status.HTTP_429_TOO_MANY_REQUESTS: {'model': ErrorRateLimited},
         fastapi.status.HTTP_403_FORBIDDEN: {'model': ErrorEmailNotConfirmed},
         fastapi.status.HTTP_404_NOT_FOUND: {'model': ErrorUserNotFoundUsername},
         fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR: {'model': ErrorEmailNotDelivered},
@@ -211,7 +218,11 @@ async def validate_jwt(user_jwt: str = fastapi.Depends(oauth2_scheme),
 
 @router.post(
     path='/login',
+    dependencies=[
+        fastapi.Depends(RateLimiter('login', '10/minute', RateLimitKey.IP_USERNAME)),
+        fastapi.Depends(RateLimiter('login_address', '100/minute', RateLimitKey.IP))],
     responses={
+        fastapi.status.HTTP_429_TOO_MANY_REQUESTS: {'model': ErrorRateLimited},
         fastapi.status.HTTP_200_OK: {'model': OAuthToken},
         fastapi.status.HTTP_401_UNAUTHORIZED: {'model': ErrorOAuthInvalidClient},
         fastapi.status.HTTP_400_BAD_REQUEST: {'model': t.Union[ErrorOAuthInvalidRequest, ErrorOAuthUnauthorizedClient]}})
@@ -0,0 +1,92 @@
+import typing
+import fastapi
+import fastapi.security
+from dependency_injector.wiring import inject, Provide
+from starlette.types import Receive, Scope, Send
+
+from app import metrics, request_timing
+from app.media_type import MediaType
+from app.services.auth_service import AuthorizationService
+from app.services.stream_service import EventStream, StreamService
+from app.models.errors import ErrorUserJWTExpired, ErrorUserJWTInvalid
+
+# comment line sent when there are no events, keeps proxies from closing idle connections
+_HEARTBEAT_INTERVAL = 15.0
+_RECONNECT_DELAY_MS = 3000
+
+oauth2_scheme = fastapi.security.oauth2.OAuth2PasswordBearer(tokenUrl='auth/login')
+router = fastapi.APIRouter(
+    prefix='/events',
+    tags=['events'],
+    route_class=request_timing.TimedRoute)
+
+@inject
+def get_user_id_from_jwt(user_jwt: str = fastapi.Depends(oauth2_scheme),
+                         auth_service: AuthorizationService = fastapi.Depends(Provide['auth_service'])) -> int:
+    return auth_service.decode_jwt(user_jwt)
+
+@router.get(
+    '',
+    name='Stream events',
+    response_class=fastapi.responses.StreamingResponse,
+    responses={
+        fastapi.status.HTTP_200_OK: {'content': {MediaType.TEXT_EVENT_STREAM: {}}},
+        fastapi.status.HTTP_401_UNAUTHORIZED: {'model': typing.Union[ErrorUserJWTExpired, ErrorUserJWTInvalid]},
+    })
+@inject
+async def get_events(last_event_id: str | None = fastapi.Header(None),
+                     user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                     stream_service: StreamService = fastapi.Depends(Provide['stream_service'])):
+    '''
+    Server-Sent Events stream of room and friends' presence events, for clients that can't
+    use websockets. Event names are event types, data is the event JSON. Reconnecting with
+    `Last-Event-ID` replays missed events; when that isn't possible a `reset` event is sent
+    first and the client should catch up through `/sync`. Clients reading too slowly are
+    disconnected.
+    '''
+
+    stream = await stream_service.open_stream(user_id, last_event_id)
+    return _EventStreamResponse(stream)
+
+class _EventStreamResponse(fastapi.responses.StreamingResponse):
+    '''
+    Closes the event stream however the response ends. The body generator can't do that
+    itself: one abandoned by a disconnecting client is only finalized by the garbage
+    collector, one that never started isn't finalized at all.
+    '''
+
+    def __init__(self, stream: EventStream) -> None:
+        super().__init__(
+            _encode_events(stream),
+            media_type=MediaType.TEXT_EVENT_STREAM,
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        self._stream = stream
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        metrics.EVENT_STREAMS_OPEN.inc()
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._stream.close()
+            metrics.EVENT_STREAMS_OPEN.dec()
+
+async def _encode_events(stream: EventStream) -> typing.AsyncIterator[bytes]:
+    yield f'retry: {_RECONNECT_DELAY_MS}\n\n'.encode()
+    if stream.reset:
+        yield f'id: {stream.start_id}\nevent: reset\ndata: {{}}\n\n'.encode()
+
+    while True:
+        try:
+            item = await stream.get(_HEARTBEAT_INTERVAL)
+        except StopAsyncIteration:
+            break
+
+        if item is None:
+            yield b': heartbeat\n\n'
+            continue
+
+        (event_id, event) = item
+        yield f'id: {event_id}\nevent: {event.type}\ndata: {event.model_dump_json()}\n\n'.encode()
+
+    if stream.overflowed:
+        metrics.EVENT_STREAMS_DROPPED.inc()
@@ -1,16 +1,24 @@
+import datetime
 import os
 import typing
+import zlib
 import fastapi
 import fastapi.security
 import pydantic
 from dependency_injector.wiring import inject, Provide
 
+from app import columnar, conditional, request_timing
+from app.rate_limit import RateLimiter, RateLimitKey
+from app.tracing import tracer
 from app.media_type import MediaType
 from app.services.room_service import RoomService, RoomUsersOrder
 from app.services.auth_service import AuthorizationService
 from app.services.message_service import Message, MessageService
+from app.services.typing_service import TypingService
+from app.services.read_receipt_service import ReadReceiptService
 from app.models.chat_room import RoomType
-from app.models.errors import ErrorAttachmentNotFound, ErrorInvalidMessage, ErrorRoomAlreadyExists, ErrorRoomAlreadyJoined, ErrorRoomInternalJoin, ErrorRoomInvalidTypeChange, ErrorRoomNameTooLong, ErrorRoomNotFound, ErrorRoomNotOwner, ErrorRoomPrivateJoin, ErrorRoomUserNotJoined, ErrorUserJWTExpired, ErrorUserJWTInvalid
+from app.models.read_receipt import APIReadReceipt
+from app.models.errors import ErrorAttachmentNotFound, ErrorInvalidMessage, ErrorMessageNotFound, ErrorRoomAlreadyExists, ErrorRoomAlreadyJoined, ErrorRoomInternalJoin, ErrorRoomInvalidTypeChange, ErrorRoomNameTooLong, ErrorRoomNotFound, ErrorRoomNotOwner, ErrorRoomPrivateJoin, ErrorRoomUserNotJoined, ErrorRateLimited, ErrorUserJWTExpired, ErrorUserJWTInvalid
 
 class CreateRoomData(pydantic.BaseModel):
     name: str
@@ -25,10 +33,15 @@ class UpdateRoomData(pydantic.BaseModel):
 class CreateRoomResponse(pydantic.BaseModel):
     room_id: int
 
+_EXPORT_CHUNK_SIZE = 64 * 1024
+_MAX_ROOM_USERS_PAGE_SIZE = 200
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
 oauth2_scheme = fastapi.security.oauth2.OAuth2PasswordBearer(tokenUrl='auth/login')
 router = fastapi.APIRouter(
     prefix='/room',
-    tags=['room'])
+    tags=['room'],
+    route_class=request_timing.TimedRoute)
 
 @inject
 def get_user_id_from_jwt(user_jwt: str = fastapi.Depends(oauth2_scheme),
@@ -40,9 +53,16 @@ def get_user_id_from_jwt(user_jwt: str = fastapi.Depends(oauth2_scheme),
     name='Get chat room')
 @inject
 async def get_room(room_id: int,
+                   request: fastapi.Request,
+                   response: fastapi.Response,
                    users_order: RoomUsersOrder = RoomUsersOrder.USERNAME,
+                   users_limit: int = fastapi.Query(50, ge=1, le=_MAX_ROOM_USERS_PAGE_SIZE),
                    room_service: RoomService = fastapi.Depends(Provide['room_service'])):
-    return await room_service.get_room_by_id(room_id, users_order)
+    etag = await room_service.get_room_etag(room_id)
+    if (not_modified := conditional.evaluate_etag(request, response, etag)) is not None:
+        return not_modified
+
+    return await room_service.get_room_by_id(room_id, users_order, users_limit)
 
 @router.put(
     '/{room_id}',
@@ -74,10 +94,30 @@ async def delete_room(room_id: int,
     name='Get chat room users')
 @inject
 async def get_chat_room_users(room_id: int,
-                              offset: int = 0,
-                              limit: int = 10,
+                              request: fastapi.Request,
+                              response: fastapi.Response,
+                              order: RoomUsersOrder = RoomUsersOrder.USERNAME,
+                              cursor: str | None = None,
+                              offset: int = fastapi.Query(0, ge=0),
+                              limit: int = fastapi.Query(10, ge=1, le=_MAX_ROOM_USERS_PAGE_SIZE),
+                              use_msgpack: bool = fastapi.Depends(columnar.accepts_msgpack),
                               room_service: RoomService = fastapi.Depends(Provide['room_service'])):
-    return await room_service.get_room_users(room_id, offset, limit)
+    '''
+    Lists room members page by page. Pass `next_cursor` of the previous page as `cursor`
+    to get the following one, `offset` is kept for older clients and gets slow in large rooms.
+    '''
+
+    etag = await room_service.get_room_users_etag(room_id)
+    if (not_modified := conditional.evaluate_etag(request, response, etag, 'msgpack' if use_msgpack else '')) is not None:
+        return not_modified
+
+    if use_msgpack:
+        (rows, next_cursor) = await room_service.get_room_user_rows(room_id, order, limit, cursor, offset)
+        return columnar.msgpack_response(
+            columnar.ROOM_USERS.encode(rows) | {'next_cursor': next_cursor},
+            {'ETag': response.headers['ETag']})
+
+    return await room_service.get_room_users(room_id, order, limit, cursor, offset)
 
 # TODO Use websocket
 @router.get(
@@ -87,14 +127,23 @@ async def get_chat_room_users(room_id: int,
 async def get_last_room_messages(room_id: int,
                                  offset: int = 0,
                                  limit: int = 10,
+                                 before: datetime.datetime | None = None,
+                                 before_id: int | None = None,
+                                 use_msgpack: bool = fastapi.Depends(columnar.accepts_msgpack),
                                  room_service: RoomService = fastapi.Depends(Provide['room_service'])):
-    return await room_service.get_last_room_messages(room_id, offset, limit)
+    if use_msgpack:
+        rows = await room_service.get_last_room_message_rows(room_id, offset, limit, before, before_id)
+        return columnar.msgpack_response(columnar.ROOM_MESSAGES.encode(rows))
+
+    return await room_service.get_last_room_messages(room_id, offset, limit, before, before_id)
 
 @router.post(
     '/{room_id}/messages',
     name='Send message to chat room',
     status_code=fastapi.status.HTTP_202_ACCEPTED,
+    dependencies=[fastapi.Depends(RateLimiter('message', '30/minute', RateLimitKey.USER))],
     responses={
+        fastapi.status.HTTP_429_TOO_MANY_REQUESTS: {'model': ErrorRateLimited},
         fastapi.status.HTTP_204_NO_CONTENT: {'model': None},
         fastapi.status.HTTP_404_NOT_FOUND: {'model': ErrorRoomUserNotJoined},
         fastapi.status.HTTP_401_UNAUTHORIZED: {'model': typing.Union[ErrorUserJWTExpired, ErrorUserJWTInvalid]},
@@ -111,25 +160,118 @@ async def put_room_message(room_id: int,
         ErrorInvalidMessage() \
             .raise_(fastapi.status.HTTP_422_UNPROCESSABLE_CONTENT)
 
+    with tracer.start_as_current_span(
+        'room.put_message',
+        attributes={'room.id': room_id, 'user.id': user_id}):
+        await room_service.check_user_belongs_to(user_id, room_id)
+
+        if attachment_file is not None:
+            data = await attachment_file.read()
+            message = Message(
+                user_id,
+                room_id,
+                None,
+                data,
+                attachment_file.filename)
+        else:
+            message = Message(
+                user_id,
+                room_id,
+                text,
+                None,
+                None)
+            
+        await message_service.upload_message(message)
+
+@router.post(
+    '/{room_id}/typing',
+    name='Signal typing in chat room',
+    status_code=fastapi.status.HTTP_204_NO_CONTENT,
+    responses={
+        fastapi.status.HTTP_404_NOT_FOUND: {'model': ErrorRoomUserNotJoined},
+        fastapi.status.HTTP_401_UNAUTHORIZED: {'model': typing.Union[ErrorUserJWTExpired, ErrorUserJWTInvalid]},
+    })
+@inject
+async def put_room_typing(room_id: int,
+                          is_typing: bool = True,
+                          user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                          typing_service: TypingService = fastapi.Depends(Provide['typing_service'])):
+    '''
+    Tells room members the user is typing, `TYPING` events are published to the room
+    channel. May be called on every keystroke, repeated signals are coalesced. Send
+    `is_typing=false` when the user clears the input; otherwise the signal expires
+    after `expires_in` seconds of the event.
+    '''
+
+    await typing_service.set_typing(user_id, room_id, is_typing)
+
+@router.post(
+    '/{room_id}/receipts',
+    name='Mark chat room messages as read',
+    status_code=fastapi.status.HTTP_202_ACCEPTED,
+    responses={
+        fastapi.status.HTTP_404_NOT_FOUND: {'model': typing.Union[ErrorRoomUserNotJoined, ErrorMessageNotFound]},
+        fastapi.status.HTTP_401_UNAUTHORIZED: {'model': typing.Union[ErrorUserJWTExpired, ErrorUserJWTInvalid]},
+    })
+@inject
+async def post_room_receipt(room_id: int,
+                            message_id: int = fastapi.Query(gt=0),
+                            user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                            read_receipt_service: ReadReceiptService = fastapi.Depends(Provide['read_receipt_service'])):
+    '''
+    Marks messages up to `message_id` as read by the user. Reporting lower ID than
+    reported before has no effect, so clients may report whatever they display.
+    '''
+
+    await read_receipt_service.mark_read(user_id, room_id, message_id)
+
+@router.get(
+    '/{room_id}/receipts',
+    name='Get chat room read receipts',
+    responses={
+        fastapi.status.HTTP_404_NOT_FOUND: {'model': ErrorRoomUserNotJoined},
+        fastapi.status.HTTP_401_UNAUTHORIZED: {'model': typing.Union[ErrorUserJWTExpired, ErrorUserJWTInvalid]},
+    })
+@inject
+async def get_room_receipts(room_id: int,
+                            message_id: int = 0,
+                            user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                            room_service: RoomService = fastapi.Depends(Provide['room_service']),
+                            read_receipt_service: ReadReceiptService = fastapi.Depends(Provide['read_receipt_service'])) -> list[APIReadReceipt]:
+    '''
+    Lists highest read message ID of room members, pass `message_id` to list only
+    members who have seen that message.
+    '''
+
+    await room_service.check_user_belongs_to_cached(user_id, room_id)
+    return await read_receipt_service.get_room_receipts(room_id, message_id)
+
+@router.get(
+    '/{room_id}/export',
+    name='Export chat room history',
+    response_class=fastapi.responses.StreamingResponse,
+    responses={
+        fastapi.status.HTTP_200_OK: {'content': {MediaType.APPLICATION_NDJSON: {}, MediaType.APPLICATION_GZIP: {}}},
+        fastapi.status.HTTP_404_NOT_FOUND: {'model': ErrorRoomUserNotJoined},
+        fastapi.status.HTTP_401_UNAUTHORIZED: {'model': typing.Union[ErrorUserJWTExpired, ErrorUserJWTInvalid]},
+    })
+@inject
+async def export_room_messages(room_id: int,
+                               compress: bool = False,
+                               user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                               room_service: RoomService = fastapi.Depends(Provide['room_service'])):
     await room_service.check_user_belongs_to(user_id, room_id)
 
-    if attachment_file is not None:
-        data = await attachment_file.read()
-        message = Message(
-            user_id,
-            room_id,
-            None,
-            data,
-            attachment_file.filename)
-    else:
-        message = Message(
-            user_id,
-            room_id,
-            text,
-            None,
-            None)
-        
-    await message_service.upload_message(message)
+    filename = f'room-{room_id}.ndjson'
+    media_type = MediaType.APPLICATION_NDJSON
+    if compress:
+        filename += '.gz'
+        media_type = MediaType.APPLICATION_GZIP
+
+    return fastapi.responses.StreamingResponse(
+        _encode_ndjson(room_service.export_room_messages(room_id), compress),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @router.get(
     '/{room_id}/image',
@@ -213,3 +355,20 @@ async def create_room(data: CreateRoomData,
     user_id = auth_service.decode_jwt(user_jwt)
     room_id = await room_service.create_room(user_id, data.name, data.description, data.type)
     return CreateRoomResponse(room_id=room_id)
+
+async def _encode_ndjson(items: typing.AsyncIterator[pydantic.BaseModel], compress: bool) -> typing.AsyncIterator[bytes]:
+    # lines are gathered into larger chunks, one write per row would dominate the export time
+    compressor = zlib.compressobj(wbits=_GZIP_WBITS) if compress else None
+    buffer = bytearray()
+
+    async for item in items:
+        buffer += item.model_dump_json().encode()
+        buffer += b'\n'
+        if len(buffer) >= _EXPORT_CHUNK_SIZE:
+            yield compressor.compress(buffer) if compressor is not None else bytes(buffer)
+            buffer.clear()
+
+    if compressor is not None:
+        yield compressor.compress(buffer) + compressor.flush()
+    elif buffer:
+        yield bytes(buffer)
@@ -3,6 +3,8 @@ from fastapi import Depends, APIRouter, status
 from fastapi.security.oauth2 import OAuth2PasswordBearer
 from dependency_injector.wiring import Provide, inject
 
+from app.columnar import ROOMS, USERS, accepts_msgpack, msgpack_response
+from app.request_timing import TimedRoute
 from app.services.auth_service import AuthorizationService
 from app.services.search_service import SearchService
 from app.models.search_result import APIRoomsSearchResult, APIUsersSearchResult
@@ -11,7 +13,8 @@ from app.models.errors import ErrorUserJWTExpired, ErrorUserJWTInvalid
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='auth/login')
 router = APIRouter(
     prefix='/search',
-    tags=['search'])
+    tags=['search'],
+    route_class=TimedRoute)
 
 @inject
 def get_user_id_from_jwt(user_jwt: str = Depends(oauth2_scheme),
@@ -30,7 +33,16 @@ async def get_search_users(query: str,
                            limit: int = 20,
                            offset: int = 0,
                            user_id: int = Depends(get_user_id_from_jwt),
+                           use_msgpack: bool = Depends(accepts_msgpack),
                            search_service: SearchService = Depends(Provide['search_service'])):
+    if use_msgpack:
+        rows = await search_service.search_user_rows(user_id, query, limit, offset)
+        return msgpack_response({
+            'query': query,
+            'offset': offset,
+            'limit': limit,
+            'users': USERS.encode(rows)})
+
     return await search_service.search_users(user_id, query, limit, offset)
 
 @router.get(
@@ -45,5 +57,14 @@ async def get_search_rooms(query: str,
                            limit: int = 20,
                            offset: int = 0,
                            user_id: int = Depends(get_user_id_from_jwt),
+                           use_msgpack: bool = Depends(accepts_msgpack),
                            search_service: SearchService = Depends(Provide['search_service'])):
+    if use_msgpack:
+        rows = await search_service.search_room_rows(user_id, query, limit, offset)
+        return msgpack_response({
+            'query': query,
+            'offset': offset,
+            'limit': limit,
+            'rooms': ROOMS.encode(rows)})
+
     return await search_service.search_rooms(user_id, query, limit, offset)
\ No newline at end of file
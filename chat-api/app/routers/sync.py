@@ -0,0 +1,40 @@
+import typing
+import fastapi
+import fastapi.security
+from dependency_injector.wiring import inject, Provide
+
+from app import request_timing
+from app.services.auth_service import AuthorizationService
+from app.services.sync_service import SyncService
+from app.models.change_log import APISync
+from app.models.errors import ErrorUserJWTExpired, ErrorUserJWTInvalid
+
+oauth2_scheme = fastapi.security.oauth2.OAuth2PasswordBearer(tokenUrl='auth/login')
+router = fastapi.APIRouter(
+    prefix='/sync',
+    tags=['sync'],
+    route_class=request_timing.TimedRoute)
+
+@inject
+def get_user_id_from_jwt(user_jwt: str = fastapi.Depends(oauth2_scheme),
+                         auth_service: AuthorizationService = fastapi.Depends(Provide['auth_service'])) -> int:
+    return auth_service.decode_jwt(user_jwt)
+
+@router.get(
+    '',
+    name='Sync changes',
+    responses={
+        fastapi.status.HTTP_401_UNAUTHORIZED: {'model': typing.Union[ErrorUserJWTExpired, ErrorUserJWTInvalid]},
+    })
+@inject
+async def get_sync(since: int | None = None,
+                   limit: int = 500,
+                   user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                   sync_service: SyncService = fastapi.Depends(Provide['sync_service'])) -> APISync:
+    '''
+    Changes of the user's rooms, friends and friend requests after position `since`
+    (`token` of the previous sync). When `reset` is set the client has to fetch its whole
+    state first, when `has_more` is set it should sync again right away.
+    '''
+
+    return await sync_service.get_changes(user_id, since, limit)
@@ -1,13 +1,14 @@
-import os
 import pydantic
 import datetime
 import fastapi
 import fastapi.security
 from dependency_injector.wiring import Provide, inject
 
+from app import columnar, conditional, request_timing
 from app.services import UserService, AuthorizationService, DatetimeService
+from app.services.avatar_service import AvatarService
 from app.models.user import APIUserForeign, APIUserSelf, SQLUser, UserActivityStatus
-from app.models.errors import ErrorFriendRequestAlreadySent, ErrorSelfFriendRequest, ErrorUserNotFoundID
+from app.models.errors import ErrorFriendRequestAlreadySent, ErrorProfilePictureNotFound, ErrorSelfFriendRequest, ErrorUserNotFoundID
 from app.media_type import MediaType
 
 class ChangeUserActivityStatusResponse(pydantic.BaseModel):
@@ -24,10 +25,14 @@ class AcceptFriendRequestResponse(pydantic.BaseModel):
 class RejectFriendRequestResponse(pydantic.BaseModel):
     message: str = 'Friend request rejected.'
 
+_MAX_BATCH_USERS = 100
+_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
 oauth2_scheme = fastapi.security.oauth2.OAuth2PasswordBearer(tokenUrl='auth/login')
 router = fastapi.APIRouter(
     prefix='/user',
-    tags=['user'])
+    tags=['user'],
+    route_class=request_timing.TimedRoute)
 
 @inject
 async def get_user_from_jwt(user_jwt: str = fastapi.Depends(oauth2_scheme),
@@ -78,38 +83,42 @@ async def refresh_user_activity(user_id: int = fastapi.Depends(get_user_id_from_
 
 @router.get('/profile-picture')
 @inject
-async def get_user_profile_picture(user_id: int = fastapi.Depends(get_user_id_from_jwt),
-                                   data_directory: str = fastapi.Depends(Provide['config.fs.data_directory'])):
-    filepath = os.path.join(data_directory, 'profile_pictures', str(user_id) + '.jpg')
-    if not os.path.exists(filepath):
-        return fastapi.Response(
-            content=None,
-            status_code=fastapi.status.HTTP_204_NO_CONTENT,
-            media_type=MediaType.IMAGE_JPEG)
-    
-    return fastapi.responses.FileResponse(
-        filepath,
-        media_type=MediaType.IMAGE_JPEG)
+async def get_user_profile_picture(request: fastapi.Request,
+                                   size: int | None = None,
+                                   user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                                   user_service: UserService = fastapi.Depends(Provide['user_service'])):
+    return await _current_profile_picture_response(request, user_service, user_id, size)
 
 @router.put('/profile-picture')
 @inject
 async def change_user_profile_picture(image_file: fastapi.UploadFile,
                                       user_id: int = fastapi.Depends(get_user_id_from_jwt),
                                       user_service: UserService = fastapi.Depends(Provide['user_service'])):
-    await user_service.change_user_profile_picture(user_id, image_file)
-    return {'message': 'Successfully changed user profile picture'}
+    picture_hash = await user_service.change_user_profile_picture(user_id, image_file)
+    return {'message': 'Successfully changed user profile picture', 'profile_picture_hash': picture_hash}
 
 @router.delete('/profile-picture')
 @inject
 async def delete_user_profile_picture(user_id: int = fastapi.Depends(get_user_id_from_jwt),
                                       user_service: UserService = fastapi.Depends(Provide['user_service'])):
-    user_service.delete_user_profile_picture(user_id)
+    await user_service.delete_user_profile_picture(user_id)
     return {'message': 'Successfully deleted user profile picture'}
 
 @router.get('/friends')
 @inject
-async def get_user_friends(user_id: int = fastapi.Depends(get_user_id_from_jwt),
+async def get_user_friends(request: fastapi.Request,
+                           response: fastapi.Response,
+                           user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                           use_msgpack: bool = fastapi.Depends(columnar.accepts_msgpack),
                            user_service: UserService = fastapi.Depends(Provide['user_service'])):
+    etag = await user_service.get_user_friends_etag(user_id)
+    if (not_modified := conditional.evaluate_etag(request, response, etag, 'msgpack' if use_msgpack else '')) is not None:
+        return not_modified
+
+    if use_msgpack:
+        rows = await user_service.get_user_friend_rows(user_id)
+        return columnar.msgpack_response(columnar.FRIENDS.encode(rows), {'ETag': response.headers['ETag']})
+
     return await user_service.get_user_friends(user_id)
 
 @router.get('/friend-requests')
@@ -156,28 +165,90 @@ async def reject_friend_request(from_id: int,
 
 @router.get('/rooms')
 @inject
-async def get_user_rooms(user_id: int = fastapi.Depends(get_user_id_from_jwt),
+async def get_user_rooms(request: fastapi.Request,
+                         response: fastapi.Response,
+                         user_id: int = fastapi.Depends(get_user_id_from_jwt),
                          user_service: UserService = fastapi.Depends(Provide['user_service'])):
+    etag = await user_service.get_user_rooms_etag(user_id)
+    if (not_modified := conditional.evaluate_etag(request, response, etag)) is not None:
+        return not_modified
+
     return await user_service.get_user_rooms(user_id)
 
+@router.get(
+    '/batch',
+    name='Get users by IDs')
+@inject
+async def get_users_by_ids(ids: list[int] = fastapi.Query(min_length=1, max_length=_MAX_BATCH_USERS),
+                           use_msgpack: bool = fastapi.Depends(columnar.accepts_msgpack),
+                           user_service: UserService = fastapi.Depends(Provide['user_service'])):
+    '''
+    Retrieves multiple users at once (`?ids=1&ids=2...`), e.g. all message senders
+    of a chat window. Users that don't exist are left out of the response.
+    '''
+
+    rows = await user_service.get_user_rows(set(ids))
+    if use_msgpack:
+        return columnar.msgpack_response(columnar.USERS.encode(rows))
+
+    return [APIUserForeign.model_validate(x) for x in rows]
+
 @router.get('/{user_id}')
 @inject
 async def get_user_by_id(user_id: int,
                          user_service: UserService = fastapi.Depends(Provide['user_service'])):
-    return APIUserForeign.model_validate(user_service.get_user(user_id))
+    return APIUserForeign.model_validate(await user_service.get_user(user_id))
 
 @router.get('/{user_id}/profile-picture')
 @inject
-async def get_user_profile_picture(user_id: int,
-                                   data_directory: str = fastapi.Depends(Provide['config.fs.data_directory'])):
-    filepath = os.path.join(data_directory, 'profile_pictures', str(user_id) + '.jpg')
-    if not os.path.exists(filepath):
+async def get_user_profile_picture_by_id(user_id: int,
+                                         request: fastapi.Request,
+                                         size: int | None = None,
+                                         user_service: UserService = fastapi.Depends(Provide['user_service'])):
+    return await _current_profile_picture_response(request, user_service, user_id, size)
+
+@router.get('/{user_id}/profile-picture/{picture_hash}')
+@inject
+async def get_user_profile_picture_by_hash(user_id: int,
+                                           picture_hash: str,
+                                           size: int | None = None,
+                                           avatar_service: AvatarService = fastapi.Depends(Provide['avatar_service'])):
+    '''
+    Retrieves profile picture by the hash found in user details. Content under the URL
+    never changes, so clients and proxies may cache it indefinitely.
+    '''
+
+    content = await avatar_service.get(user_id, picture_hash, size)
+    if content is None:
+        ErrorProfilePictureNotFound(user_id=user_id, picture_hash=picture_hash) \
+            .raise_(fastapi.status.HTTP_404_NOT_FOUND)
+
+    return fastapi.Response(
+        content=content,
+        media_type=MediaType.IMAGE_JPEG,
+        headers={'Cache-Control': _IMMUTABLE_CACHE_CONTROL})
+
+async def _current_profile_picture_response(request: fastapi.Request,
+                                            user_service: UserService,
+                                            user_id: int,
+                                            size: int | None) -> fastapi.Response:
+    picture = await user_service.get_user_profile_picture(user_id, size)
+    if picture is None:
         return fastapi.Response(
             content=None,
             status_code=fastapi.status.HTTP_204_NO_CONTENT,
             media_type=MediaType.IMAGE_JPEG)
-    
-    return fastapi.responses.FileResponse(
-        filepath,
-        media_type=MediaType.IMAGE_JPEG)
+
+    (picture_hash, content) = picture
+    response = fastapi.Response(
+        content=content,
+        media_type=MediaType.IMAGE_JPEG,
+        headers={'Cache-Control': 'no-cache'})
+    if picture_hash is not None:
+        # picture may change any time, clients revalidate with the tag instead
+        etag = f'"{picture_hash}"'
+        if (not_modified := conditional.evaluate_etag(request, response, etag, str(size or ''))) is not None:
+            return not_modified
+
+    return response
 
@@ -0,0 +1,472 @@
+import asyncio
+import bisect
+import calendar
+import dataclasses
+import datetime
+import functools
+import heapq
+import itertools
+import json
+import logging
+import os
+import pathlib
+import shutil
+import struct
+import typing
+import uuid
+import zlib
+import sqlalchemy
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from app import database, metrics
+from app.directory import Directory
+from app.models.message import MessageType, RoomMessage, SQLMessage
+from app.models.user import SQLUser
+from app.services.version_service import VersionService, room_messages_key
+
+_logger = logging.getLogger(__name__)
+
+_SEGMENT_MAGIC = b'CHATSEG1'
+_SEGMENT_EXTENSION = '.seg'
+_BLOCK_INDEX_ENTRY = struct.Struct('<qQqQQII')
+_SEGMENT_FOOTER = struct.Struct('<QI8s')
+_MESSAGES_PER_BLOCK = 512
+_MESSAGES_PER_SEGMENT = 64 * _MESSAGES_PER_BLOCK
+_BLOCK_CACHE_SIZE = 128
+_SEGMENT_CACHE_SIZE = 4096
+
+_ARCHIVER_LOCK_NAME = 'chat_api_message_archiver'
+_ARCHIVER_INTERVAL = 60 * 60
+
+MessageKey = tuple[int, int]
+'''
+Ordering key of a message, `(sent_at as UNIX seconds, id)`
+'''
+
+@dataclasses.dataclass(frozen=True)
+class ArchivedMessage:
+    id: int
+    sender_id: int
+    type: MessageType
+    content: str
+    sent_at: int
+
+    @property
+    def key(self) -> MessageKey:
+        return (self.sent_at, self.id)
+
+@dataclasses.dataclass(frozen=True)
+class _BlockIndexEntry:
+    first_key: MessageKey
+    last_key: MessageKey
+    offset: int
+    length: int
+    count: int
+
+@dataclasses.dataclass(frozen=True)
+class _SegmentIndex:
+    filepath: pathlib.Path
+    blocks: tuple[_BlockIndexEntry, ...]
+
+class SegmentWriter:
+    '''
+    Writes immutable segment file. Messages are stored in zlib compressed blocks of JSON
+    rows followed by a sparse index holding key range and location of every block, so
+    readers only decompress blocks overlapping the requested range.
+    Messages must be added in ascending `(sent_at, id)` order.
+    '''
+
+    def __init__(self, filepath: pathlib.Path) -> None:
+        self._filepath = filepath
+        self._temp_filepath = filepath.with_suffix(f'.{uuid.uuid4().hex}.tmp')
+        self._file = open(self._temp_filepath, 'wb')
+        self._file.write(_SEGMENT_MAGIC)
+        self._pending = list[ArchivedMessage]()
+        self._index = list[_BlockIndexEntry]()
+
+    def add(self, message: ArchivedMessage) -> None:
+        self._pending.append(message)
+        if len(self._pending) >= _MESSAGES_PER_BLOCK:
+            self._flush_block()
+
+    def close(self) -> None:
+        '''
+        Finishes the segment and atomically moves it in place.
+        '''
+
+        self._flush_block()
+
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._file.write(
+                _BLOCK_INDEX_ENTRY.pack(
+                    *entry.first_key,
+                    *entry.last_key,
+                    entry.offset,
+                    entry.length,
+                    entry.count))
+
+        self._file.write(_SEGMENT_FOOTER.pack(index_offset, len(self._index), _SEGMENT_MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        os.replace(self._temp_filepath, self._filepath)
+
+    def abort(self) -> None:
+        self._file.close()
+        self._temp_filepath.unlink(missing_ok=True)
+
+    def _flush_block(self) -> None:
+        if not self._pending:
+            return
+
+        rows = [[x.id, x.sender_id, x.type, x.content, x.sent_at] for x in self._pending]
+        data = zlib.compress(json.dumps(rows, separators=(',', ':')).encode())
+
+        self._index.append(
+            _BlockIndexEntry(
+                self._pending[0].key,
+                self._pending[-1].key,
+                self._file.tell(),
+                len(data),
+                len(self._pending)))
+        self._file.write(data)
+        self._pending.clear()
+
+def _read_segment_index(filepath: pathlib.Path) -> _SegmentIndex:
+    with open(filepath, 'rb') as f:
+        if f.read(len(_SEGMENT_MAGIC)) != _SEGMENT_MAGIC:
+            raise ValueError(f'{filepath} is not a message segment file')
+
+        f.seek(-_SEGMENT_FOOTER.size, os.SEEK_END)
+        index_offset, block_count, magic = _SEGMENT_FOOTER.unpack(f.read(_SEGMENT_FOOTER.size))
+        if magic != _SEGMENT_MAGIC:
+            raise ValueError(f'{filepath} is truncated')
+
+        f.seek(index_offset)
+        data = f.read(block_count * _BLOCK_INDEX_ENTRY.size)
+
+    blocks = list[_BlockIndexEntry]()
+    for (first_sent_at, first_id, last_sent_at, last_id, offset, length, count) in _BLOCK_INDEX_ENTRY.iter_unpack(data):
+        blocks.append(
+            _BlockIndexEntry(
+                (first_sent_at, first_id),
+                (last_sent_at, last_id),
+                offset,
+                length,
+                count))
+
+    return _SegmentIndex(filepath, tuple(blocks))
+
+@functools.lru_cache(maxsize=_BLOCK_CACHE_SIZE)
+def _read_block(filepath: pathlib.Path, offset: int, length: int) -> tuple[ArchivedMessage, ...]:
+    # segments are immutable, (filepath, offset) identifies block contents
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        data = zlib.decompress(f.read(length))
+
+    return tuple(
+        ArchivedMessage(id, sender_id, MessageType(type), content, sent_at)
+        for (id, sender_id, type, content, sent_at)
+        in json.loads(data))
+
+@functools.lru_cache(maxsize=_SEGMENT_CACHE_SIZE)
+def _read_segment_newest_id(filepath: pathlib.Path) -> int:
+    # segments are immutable and blocks are ordered by key, not ID, so all of them are read once
+    return max(
+        (
+            message.id
+            for block in _read_segment_index(filepath).blocks
+            for message in _read_block.__wrapped__(filepath, block.offset, block.length)),
+        default=0)
+
+def message_key(sent_at: datetime.datetime, id: int) -> MessageKey:
+    return (_to_timestamp(sent_at), id)
+
+def _to_timestamp(value: datetime.datetime) -> int:
+    # DATETIME columns hold naive UTC values
+    return calendar.timegm(value.timetuple())
+
+def _from_timestamp(value: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).replace(tzinfo=None)
+
+class ArchiveService:
+    '''
+    Moves messages older than `archive_after_days` out of the database into per room
+    segment files under `<data directory>/archive/<room ID>` and serves reads of archived
+    history. Archiver runs in every worker, a named database lock makes sure only one of
+    them moves messages at a time.
+    '''
+
+    def __init__(self,
+                 db_sessionmaker: async_sessionmaker[AsyncSession],
+                 data_directory: pathlib.Path,
+                 version_service: VersionService,
+                 archive_after_days: int) -> None:
+        self._db_sessionmaker = db_sessionmaker
+        self._version_service = version_service
+        self._archive_directory = data_directory / Directory.ARCHIVE
+        self._archive_after = datetime.timedelta(days=archive_after_days)
+        self._archiver_task: asyncio.Task | None = None
+        self._segment_indices = dict[int, tuple[int, tuple[_SegmentIndex, ...]]]()
+
+    def start_archiver_task(self) -> None:
+        assert self._archiver_task is None, 'Archiver task already running'
+
+        if self._archive_after <= datetime.timedelta():
+            return
+
+        self._archiver_task = asyncio.create_task(self._archiver_loop())
+
+    async def shutdown_archiver_task(self) -> None:
+        if self._archiver_task is not None:
+            self._archiver_task.cancel()
+            try:
+                await self._archiver_task
+            except asyncio.CancelledError:
+                pass
+
+            self._archiver_task = None
+
+    def has_archive(self, room_id: int) -> bool:
+        return self._get_room_directory(room_id).exists()
+
+    async def get_room_messages(self,
+                                room_id: int,
+                                offset: int,
+                                limit: int,
+                                before: MessageKey | None = None) -> list[RoomMessage]:
+        '''
+        Retrieves archived room messages older than `before` key, newest first.
+        Messages of users that no longer exist are skipped.
+        '''
+
+        if limit <= 0 or not self.has_archive(room_id):
+            return []
+
+        archived = await metrics.to_thread(
+            'archive',
+            self._read_messages,
+            room_id,
+            offset + limit,
+            before)
+        return await self._to_room_messages(archived[offset:])
+
+    async def iter_room_messages(self, room_id: int) -> typing.AsyncIterator[list[RoomMessage]]:
+        '''
+        Yields all archived room messages, oldest first, in chunks of at most one block.
+        Only blocks overlapping the current position are kept in memory.
+        '''
+
+        blocks = sorted(
+            (
+                (block.first_key, segment.filepath, block)
+                for segment in await metrics.to_thread('archive', self._get_segment_indices, room_id)
+                for block in segment.blocks),
+            key=lambda x: x[0])
+
+        # overlapping segments are merged through the heap, duplicates end up next to each other
+        pending = list[tuple[MessageKey, int, ArchivedMessage]]()
+        sequence = itertools.count()
+        last_id = None
+        for (i, (_, filepath, block)) in enumerate(blocks):
+            # bypass block cache, a full scan would only evict blocks used by history reads
+            for message in await metrics.to_thread('archive', _read_block.__wrapped__, filepath, block.offset, block.length):
+                heapq.heappush(pending, (message.key, next(sequence), message))
+
+            next_first_key = blocks[i + 1][0] if i + 1 < len(blocks) else None
+
+            chunk = list[ArchivedMessage]()
+            while pending and (next_first_key is None or pending[0][0] < next_first_key):
+                (_, _, message) = heapq.heappop(pending)
+                if message.id != last_id:
+                    chunk.append(message)
+                    last_id = message.id
+
+            if chunk:
+                yield await self._to_room_messages(chunk)
+
+    async def get_newest_message_id(self, room_id: int) -> int:
+        '''
+        Retrieves the highest archived message ID of the room, 0 if it has no archive.
+        '''
+
+        if not self.has_archive(room_id):
+            return 0
+
+        return await metrics.to_thread('archive', self._get_newest_message_id, room_id)
+
+    async def delete_room_archive(self, room_id: int) -> None:
+        directory = self._get_room_directory(room_id)
+        self._segment_indices.pop(room_id, None)
+        if directory.exists():
+            await metrics.to_thread('archive', shutil.rmtree, directory, ignore_errors=True)
+
+    async def _to_room_messages(self, archived: list[ArchivedMessage]) -> list[RoomMessage]:
+        if not archived:
+            return []
+
+        async with self._db_sessionmaker() as session:
+            query = sqlalchemy.select(SQLUser.id, SQLUser.username) \
+                .where(SQLUser.id.in_({x.sender_id for x in archived}))
+            usernames = dict((await session.execute(query)).tuples().all())
+
+        return [
+            RoomMessage(
+                id=x.id,
+                type=x.type,
+                content=x.content,
+                sent_at=_from_timestamp(x.sent_at),
+                sender_id=x.sender_id,
+                sender_username=usernames[x.sender_id])
+            for x in archived
+            if x.sender_id in usernames]
+
+    async def run_archiver(self, now: datetime.datetime | None = None) -> None:
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+        cutoff = now - self._archive_after
+
+        async with database.named_lock_session(self._db_sessionmaker, _ARCHIVER_LOCK_NAME) as session:
+            if session is None:
+                _logger.debug('Message archiver is already running in another worker')
+                return
+
+            query = sqlalchemy.select(SQLMessage.room_id) \
+                .where(SQLMessage.sent_at < cutoff) \
+                .distinct()
+            room_ids = (await session.scalars(query)).all()
+
+            for room_id in room_ids:
+                archived_count = await self._archive_room(session, room_id, cutoff)
+                _logger.info('Archived %d messages of room %d', archived_count, room_id)
+
+            # rooms without recent messages just lost their last message
+            await self._version_service.bump(room_messages_key(x) for x in room_ids)
+
+    async def _archiver_loop(self) -> None:
+        while True:
+            try:
+                await self.run_archiver()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _logger.exception('Message archiver failed')
+
+            await asyncio.sleep(_ARCHIVER_INTERVAL)
+
+    async def _archive_room(self, session: AsyncSession, room_id: int, cutoff: datetime.datetime) -> int:
+        room_directory = self._get_room_directory(room_id)
+        room_directory.mkdir(parents=True, exist_ok=True)
+
+        archived_count = 0
+        while True:
+            query = sqlalchemy.select(
+                SQLMessage.id,
+                SQLMessage.sender_id,
+                SQLMessage.type,
+                SQLMessage.content,
+                SQLMessage.sent_at) \
+                .where(
+                    SQLMessage.room_id == room_id,
+                    SQLMessage.sent_at < cutoff) \
+                .order_by(SQLMessage.sent_at, SQLMessage.id) \
+                .limit(_MESSAGES_PER_SEGMENT)
+            messages = [
+                ArchivedMessage(id, sender_id, type, content, _to_timestamp(sent_at))
+                for (id, sender_id, type, content, sent_at)
+                in await session.execute(query)]
+            await session.commit()
+
+            if not messages:
+                return archived_count
+
+            await metrics.to_thread('archive', self._write_segment, room_directory, messages)
+
+            # a crash before this commits leaves the messages in both places, readers drop duplicates
+            last_sent_at = _from_timestamp(messages[-1].sent_at)
+            query = sqlalchemy.delete(SQLMessage) \
+                .where(
+                    SQLMessage.room_id == room_id,
+                    SQLMessage.sent_at <= last_sent_at,
+                    sqlalchemy.tuple_(SQLMessage.sent_at, SQLMessage.id) <= (last_sent_at, messages[-1].id))
+            await session.execute(query)
+            await session.commit()
+
+            archived_count += len(messages)
+
+    def _write_segment(self, room_directory: pathlib.Path, messages: list[ArchivedMessage]) -> None:
+        first_key = messages[0].key
+        last_key = messages[-1].key
+        filepath = room_directory / f'{first_key[0]:012d}-{first_key[1]:020d}-{last_key[0]:012d}-{last_key[1]:020d}{_SEGMENT_EXTENSION}'
+
+        writer = SegmentWriter(filepath)
+        try:
+            for message in messages:
+                writer.add(message)
+        except Exception:
+            writer.abort()
+            raise
+
+        writer.close()
+
+    def _read_messages(self, room_id: int, count: int, before: MessageKey | None) -> list[ArchivedMessage]:
+        # segments may overlap (e.g. messages imported with old timestamps were archived later),
+        # blocks are merged newest first until no unread block can hold a newer message
+        candidates = list[tuple[pathlib.Path, _BlockIndexEntry]]()
+        for segment in self._get_segment_indices(room_id):
+            for block in segment.blocks:
+                if before is None or block.first_key < before:
+                    candidates.append((segment.filepath, block))
+
+        candidates.sort(key=lambda x: x[1].last_key, reverse=True)
+
+        messages = dict[int, ArchivedMessage]()
+        keys = list[MessageKey]()
+        for (filepath, block) in candidates:
+            if len(keys) >= count and block.last_key < keys[-count]:
+                break
+
+            for message in _read_block(filepath, block.offset, block.length):
+                if before is not None and message.key >= before:
+                    continue
+
+                if message.id in messages:
+                    continue
+
+                messages[message.id] = message
+                bisect.insort(keys, message.key)
+
+        newest_keys = set(keys[-count:])
+        return sorted(
+            (x for x in messages.values() if x.key in newest_keys),
+            key=lambda x: x.key,
+            reverse=True)
+
+    def _get_newest_message_id(self, room_id: int) -> int:
+        return max(
+            (_read_segment_newest_id(x.filepath) for x in self._get_segment_indices(room_id)),
+            default=0)
+
+    def _get_segment_indices(self, room_id: int) -> tuple[_SegmentIndex, ...]:
+        room_directory = self._get_room_directory(room_id)
+        try:
+            modified_at = room_directory.stat().st_mtime_ns
+        except FileNotFoundError:
+            return ()
+
+        cached = self._segment_indices.get(room_id)
+        if cached is not None and cached[0] == modified_at:
+            return cached[1]
+
+        indices = tuple(
+            _read_segment_index(x)
+            for x in sorted(room_directory.glob(f'*{_SEGMENT_EXTENSION}')))
+        self._segment_indices[room_id] = (modified_at, indices)
+
+        return indices
+
+    def _get_room_directory(self, room_id: int) -> pathlib.Path:
+        return self._archive_directory / str(room_id)
@@ -1,5 +1,4 @@
 import typing as t
-import ipinfo
 import sqlalchemy
 import secrets
 import re
@@ -12,23 +11,29 @@ import itsdangerous
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from sqlalchemy.exc import IntegrityError
 
-from app import error
+from app import error, metrics
 from app.models.errors import ErrorAPIKeyInactive, ErrorAPIKeyInvalid, ErrorAPIKeyMalformed, ErrorEmailCodeExpired, ErrorEmailCodeInvalid, ErrorEmailNotConfirmed, ErrorInvalidPassword, ErrorInvalidPasswordEncoding, ErrorInvalidPasswordFormat, ErrorOAuthInvalidClient, ErrorOAuthInvalidRequest, ErrorOAuthUnauthorizedClient, ErrorUserAlreadyExists, ErrorUserJWTExpired, ErrorUserJWTInvalid, ErrorUserNotFoundID, ErrorUserNotFoundUsername
 from app.models.api_key import SQLAPIKey
 from app.models.user import SQLUser
+from app.models.chat_room import SQLChatRoom
+from app.models.message import SQLMessage
+from app.models.chat_room_user import SQLChatRoomUser
+from app.models.friend import SQLFriend
+from app.models.change_log import ChangeKind, SQLChange
+from app.services.version_service import VersionService, friends_key, room_members_key, room_messages_key, user_rooms_key
 
 class AuthorizationService:
     def __init__(self,
-                 ipinfo_handler: ipinfo.Handler,
                  db_sessionmaker: async_sessionmaker[AsyncSession],
                  min_password_length: int,
                  password_salt_rounds: int,
                  jwt_secret: bytes,
                  jwt_expire_time: datetime.timedelta,
                  email_verification_key: bytes,
-                 email_confirm_code_max_age: int) -> None:
-        self._ipinfo_handler = ipinfo_handler
+                 email_confirm_code_max_age: int,
+                 version_service: VersionService) -> None:
         self._db_sessionmaker = db_sessionmaker
+        self._version_service = version_service
         self._min_password_length = min_password_length
         self._password_validation_regex = re.compile(fr'^(?=.{{{min_password_length},}})(?=.*\d)(?=.*[A-Z])(?=.*[^A-Za-z0-9]).*$')
         self._password_salt_rounds = password_salt_rounds
@@ -81,9 +86,56 @@ class AuthorizationService:
             if user is None:
                 self._raise_user_not_found(user_id)
 
+            # messages aren't covered by foreign key cascades (partitioned table), this includes
+            # messages of other users in rooms owned by the deleted user
+            owned_rooms = sqlalchemy.select(SQLChatRoom.id) \
+                .where(SQLChatRoom.owner_id == user_id)
+
+            query = sqlalchemy.select(SQLChatRoomUser.room_id) \
+                .where(SQLChatRoomUser.user_id == user_id)
+            room_ids = (await session.scalars(query)).all()
+            query = sqlalchemy.select(SQLChatRoomUser.room_id, SQLChatRoomUser.user_id) \
+                .where(SQLChatRoomUser.room_id.in_(owned_rooms))
+            owned_room_members = (await session.execute(query)).tuples().all()
+            owned_room_member_ids = {x for (_, x) in owned_room_members}
+            owned_room_ids = {x for (x, _) in owned_room_members}
+            query = sqlalchemy.select(SQLFriend.user_id) \
+                .where(SQLFriend.friend_id == user_id)
+            friend_ids = (await session.scalars(query)).all()
+
+            query = sqlalchemy.delete(SQLMessage) \
+                .where(
+                    sqlalchemy.or_(
+                        SQLMessage.sender_id == user_id,
+                        SQLMessage.room_id.in_(owned_rooms)))
+            await session.execute(query)
+
+            # memberships themselves are removed by the foreign key cascade
+            query = sqlalchemy.update(SQLChatRoom) \
+                .where(SQLChatRoom.id.in_(room_ids)) \
+                .values(member_count=SQLChatRoom.member_count - 1)
+            await session.execute(query)
+
+            session.add_all([
+                *(
+                    SQLChange(kind=ChangeKind.ROOM_MEMBER, room_id=x, user_id=user_id, data={'joined': False})
+                    for x in room_ids if x not in owned_room_ids),
+                *(
+                    SQLChange(kind=ChangeKind.ROOM_DELETED, recipient_id=x, data={'room_id': room_id})
+                    for (room_id, x) in owned_room_members if x != user_id),
+                *(
+                    SQLChange(kind=ChangeKind.FRIEND_REMOVED, recipient_id=x, user_id=user_id)
+                    for x in friend_ids)])
+
             await session.delete(user)
             await session.commit()
 
+        await self._version_service.bump([
+            *(room_members_key(x) for x in room_ids),
+            *(room_messages_key(x) for x in room_ids),
+            *(user_rooms_key(x) for x in owned_room_member_ids),
+            *(friends_key(x) for x in friend_ids)])
+
     def decode_jwt(self, token: str) -> int:
         '''
         Retrieves user ID from encoded timed JWT. Function uses HS256
@@ -112,7 +164,6 @@ class AuthorizationService:
                          username: str,
                          password: str,
                          utc_now: datetime.datetime) -> tuple[int, str]:
-        # TODO Add rate limitter to prevent brute force attacks
 
         try:
             password_encoded = password.encode('utf-8')
@@ -129,7 +180,7 @@ class AuthorizationService:
             ErrorOAuthInvalidClient() \
                 .raise_(fastapi.status.HTTP_401_UNAUTHORIZED)
         
-        if not bcrypt.checkpw(password_encoded, result.password_hash):
+        if not await metrics.to_thread('bcrypt', bcrypt.checkpw, password_encoded, result.password_hash):
             ErrorOAuthInvalidClient() \
                 .raise_(fastapi.status.HTTP_401_UNAUTHORIZED)
             
@@ -183,11 +234,11 @@ class AuthorizationService:
             
             # double check password here to protect from scenario when
             # user has valid JWT stolen and someone tries to change the password
-            if not bcrypt.checkpw(current_password_encoded, user.password_hash):
+            if not await metrics.to_thread('bcrypt', bcrypt.checkpw, current_password_encoded, user.password_hash):
                 ErrorInvalidPassword(password=current_password) \
                     .raise_(fastapi.status.HTTP_401_UNAUTHORIZED)
             
-            user.password_hash = self._hash_password(new_password_encoded)
+            user.password_hash = await self._hash_password(new_password_encoded)
 
             await session.commit()
 
@@ -240,7 +291,7 @@ class AuthorizationService:
             new_password = secrets.token_hex(8)
 
             # No need to check password encoding here as it is generated by us
-            user.password_hash = self._hash_password(new_password)
+            user.password_hash = await self._hash_password(new_password.encode('utf-8'))
 
             await session.commit()
 
@@ -254,7 +305,7 @@ class AuthorizationService:
                 .raise_(fastapi.status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 
         self._validate_password(password)
-        password_hash = self._hash_password(password_encoded)
+        password_hash = await self._hash_password(password_encoded)
         
         async with self._db_sessionmaker() as session:
             user = SQLUser(
@@ -276,9 +327,10 @@ class AuthorizationService:
 
             return user.id
     
-    def _hash_password(self, password: bytes):
-        # TODO Possibly move password hashing to coroutine
-        return bcrypt.hashpw(
+    async def _hash_password(self, password: bytes) -> bytes:
+        return await metrics.to_thread(
+            'bcrypt',
+            bcrypt.hashpw,
             password,
             bcrypt.gensalt(rounds=self._password_salt_rounds))
     
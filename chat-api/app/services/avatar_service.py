@@ -0,0 +1,192 @@
+import asyncio
+import bisect
+import collections
+import hashlib
+import os
+import pathlib
+import re
+import typing
+
+from app import imaging, metrics
+from app.directory import Directory
+
+_HASH_PATTERN = re.compile(r'[0-9a-f]{16}')
+_FILE_PATTERN = re.compile(r'(?P<hash>[0-9a-f]{16})-(?P<size>\d+)\.jpg')
+_JPEG_QUALITY = 85
+
+class AvatarService:
+    '''
+    Stores profile pictures pre-rendered in several sizes under content-hashed names
+    (`profile_pictures/<user ID>/<hash>-<size>.jpg`). A file never changes once written,
+    so its bytes can be cached in memory (and by clients) without invalidation; recently
+    served pictures are kept in an LRU cache bounded by `cache_size` bytes.
+    '''
+
+    def __init__(self,
+                 data_directory: pathlib.Path,
+                 default_size: int,
+                 sizes: typing.Iterable[int],
+                 cache_size: int) -> None:
+        self._directory = data_directory / Directory.PROFILE_PICTURES
+        self._default_size = default_size
+        self._sizes = sorted({default_size, *sizes})
+        self._cache = collections.OrderedDict[tuple[int, str, int], bytes]()
+        self._cache_bytes = 0
+        self._cache_size = cache_size
+
+        if not self._directory.exists():
+            os.makedirs(self._directory)
+
+    def get_size(self, size: int | None) -> int:
+        '''
+        Picks the smallest pre-rendered size not smaller than `size` (the largest one
+        if there is no such size), `None` selects the default size.
+        '''
+
+        if size is None:
+            return self._default_size
+
+        i = bisect.bisect_left(self._sizes, size)
+        return self._sizes[min(i, len(self._sizes) - 1)]
+
+    async def get(self, user_id: int, picture_hash: str, size: int | None = None) -> bytes | None:
+        '''
+        Retrieves picture with the given hash, `None` if the user has a different
+        picture (or none at all) by now.
+        '''
+
+        if not _HASH_PATTERN.fullmatch(picture_hash):
+            return None
+
+        key = (user_id, picture_hash, self.get_size(size))
+        content = self._cache.get(key)
+        if content is not None:
+            self._cache.move_to_end(key)
+            return content
+
+        try:
+            content = await asyncio.to_thread(self._get_path(*key).read_bytes)
+        except FileNotFoundError:
+            return None
+
+        self._cache_put(key, content)
+        return content
+
+    async def get_current(self, user_id: int, size: int | None = None) -> tuple[str | None, bytes] | None:
+        '''
+        Retrieves hash and content of the current picture of the user, `None` if the user
+        has no picture. Hash is `None` for pictures uploaded before pictures were hashed.
+        '''
+
+        picture_hash = await asyncio.to_thread(self._find_hash, user_id, self.get_size(size))
+        if picture_hash is not None:
+            content = await self.get(user_id, picture_hash, size)
+            if content is not None:
+                return (picture_hash, content)
+
+        try:
+            return (None, await asyncio.to_thread(self._get_legacy_path(user_id).read_bytes))
+        except FileNotFoundError:
+            return None
+
+    async def save(self, user_id: int, file: typing.BinaryIO) -> str:
+        '''
+        Renders the picture in all sizes, replaces previous picture of the user and
+        returns hash of the new one.
+
+        :raises imaging.InvalidImageError: If the file is not a valid image.
+        '''
+
+        renders = await metrics.to_thread('image', self._render, file)
+        picture_hash = hashlib.blake2b(renders[self._sizes[-1]], digest_size=8).hexdigest()
+
+        await asyncio.to_thread(self._write, user_id, picture_hash, renders)
+        self._cache_discard(user_id)
+
+        return picture_hash
+
+    async def delete(self, user_id: int) -> None:
+        await asyncio.to_thread(self._remove_except, user_id, None)
+        self._cache_discard(user_id)
+
+    def _render(self, file: typing.BinaryIO) -> dict[int, bytes]:
+        renders = imaging.render_jpegs(file, ((x, x) for x in self._sizes), _JPEG_QUALITY)
+        return dict(zip(self._sizes, renders))
+
+    def _write(self, user_id: int, picture_hash: str, renders: dict[int, bytes]) -> None:
+        user_directory = self._directory / str(user_id)
+        user_directory.mkdir(exist_ok=True)
+
+        for (size, content) in renders.items():
+            path = self._get_path(user_id, picture_hash, size)
+            # readers must never see a partially written file under its final name
+            temporary_path = path.with_suffix('.tmp')
+            temporary_path.write_bytes(content)
+            os.replace(temporary_path, path)
+
+        self._remove_except(user_id, picture_hash)
+
+    def _remove_except(self, user_id: int, picture_hash: str | None) -> None:
+        self._get_legacy_path(user_id).unlink(missing_ok=True)
+
+        try:
+            entries = list(os.scandir(self._directory / str(user_id)))
+        except FileNotFoundError:
+            return
+
+        for entry in entries:
+            match = _FILE_PATTERN.fullmatch(entry.name)
+            if match is None or match['hash'] != picture_hash:
+                pathlib.Path(entry.path).unlink(missing_ok=True)
+
+    def _find_hash(self, user_id: int, size: int) -> str | None:
+        try:
+            entries = os.scandir(self._directory / str(user_id))
+        except FileNotFoundError:
+            return None
+
+        # while a new picture is written both are present, the newest one that
+        # already has the size is current
+        newest = None
+        with entries:
+            for entry in entries:
+                match = _FILE_PATTERN.fullmatch(entry.name)
+                if match is None or int(match['size']) != size:
+                    continue
+
+                try:
+                    modified_at = entry.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+
+                if newest is None or modified_at > newest[0]:
+                    newest = (modified_at, match['hash'])
+
+        return newest[1] if newest is not None else None
+
+    def _cache_put(self, key: tuple[int, str, int], content: bytes) -> None:
+        if len(content) > self._cache_size:
+            return
+
+        # concurrent misses of the same key all read the file and put it
+        previous = self._cache.pop(key, None)
+        if previous is not None:
+            self._cache_bytes -= len(previous)
+
+        self._cache[key] = content
+        self._cache_bytes += len(content)
+        while self._cache_bytes > self._cache_size:
+            (_, evicted) = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
+
+    def _cache_discard(self, user_id: int) -> None:
+        # other workers keep serving the old picture under its old hash until evicted,
+        # which is fine since clients only ask for the hash they were given
+        for key in [x for x in self._cache if x[0] == user_id]:
+            self._cache_bytes -= len(self._cache.pop(key))
+
+    def _get_path(self, user_id: int, picture_hash: str, size: int) -> pathlib.Path:
+        return self._directory / str(user_id) / f'{picture_hash}-{size}.jpg'
+
+    def _get_legacy_path(self, user_id: int) -> pathlib.Path:
+        return self._directory / f'{user_id}.jpg'
@@ -1,11 +1,9 @@
-import aiosmtplib
 import asyncio
 import pathlib
-import email_validator
 import fastapi
 from email.mime.text import MIMEText
 
-from app import error
+from app import error, metrics
 from app.models.errors import ErrorEmailNotDelivered, ErrorEmailInvalid, ErrorEmailNotFound
 
 class _MessageTemplate:
@@ -32,17 +30,14 @@ class EmailService:
                  smtp_password: str,
                  data_directory: pathlib.Path) -> None:
         self._smtp_user = smtp_user
-        self._smtp_host = smtp_host
-        self._smtp_port = smtp_port
-        self._smtp_user = smtp_user
-        self._smtp_password = smtp_password
-        self._smtp_client = aiosmtplib.SMTP(
-            hostname=smtp_host,
-            port=smtp_port,
-            username=smtp_user,
-            password=smtp_password,
-            use_tls=True,
-            validate_certs=False)
+        self._smtp_options = {
+            'hostname': smtp_host,
+            'port': smtp_port,
+            'username': smtp_user,
+            'password': smtp_password,
+            'use_tls': True,
+            'validate_certs': False,
+        }
         self._verification_template = _MessageTemplate(
             data_directory / 'email_templates' / 'account_verification.html',
             smtp_user,
@@ -53,6 +48,9 @@ class EmailService:
             'Chatter - Password reset')
     
     async def validate_email(self, email_address: str) -> None:
+        # email_validator and aiosmtplib are imported on first use, startup doesn't need them
+        import email_validator
+
         try:
             await asyncio.to_thread(email_validator.validate_email, email_address)
         except email_validator.EmailSyntaxError:
@@ -65,6 +63,8 @@ class EmailService:
                 fastapi.status.HTTP_400_BAD_REQUEST)
     
     async def send_password_reset_email(self, new_password: str, email_address: str) -> None:
+        import aiosmtplib
+
         try:
             await self._send_email(
                 self._password_reset_template.build(
@@ -79,6 +79,8 @@ class EmailService:
                                               verification_url: str,
                                               resend_url: str,
                                               email_address: str) -> None:
+        import aiosmtplib
+
         try:
             await self._send_email(
                 self._verification_template.build(
@@ -90,8 +92,13 @@ class EmailService:
             error.raise_error_obj(ErrorEmailNotDelivered(email=email_address))
             
     async def _send_email(self, message: MIMEText, email_address: str) -> None:
-        async with self._smtp_client:
-            await self._smtp_client.sendmail(
-                self._smtp_user,
-                (email_address,),
-                message.as_bytes())
\ No newline at end of file
+        with metrics.EMAIL_OUTBOX_DEPTH.track_inprogress():
+            import aiosmtplib
+
+            # client holds a single connection, a new one is needed for concurrent sends
+            smtp_client = aiosmtplib.SMTP(**self._smtp_options)
+            async with smtp_client:
+                await smtp_client.sendmail(
+                    self._smtp_user,
+                    (email_address,),
+                    message.as_bytes())
\ No newline at end of file
@@ -0,0 +1,285 @@
+import abc
+import asyncio
+import collections
+import logging
+import typing
+
+from app.models.event import APIEvent
+
+_logger = logging.getLogger(__name__)
+
+_CHANNEL_PREFIX = 'chat:'
+_DEFAULT_MAX_PENDING_EVENTS = 256
+_REDIS_RECONNECT_DELAY = 1.0
+
+def room_channel(room_id: int) -> str:
+    return f'{_CHANNEL_PREFIX}room:{room_id}'
+
+def presence_channel(user_id: int) -> str:
+    return f'{_CHANNEL_PREFIX}presence:{user_id}'
+
+class Subscription:
+    '''
+    Stream of events published to a set of channels. Events are buffered up to
+    `max_pending`; a subscriber that falls further behind is dropped and its
+    iteration ends with `overflowed` set, so one slow consumer can't hold memory
+    or stall delivery to others.
+    '''
+
+    def __init__(self, bus: 'EventBus', channels: tuple[str, ...], max_pending: int) -> None:
+        self._bus = bus
+        self._channels = channels
+        self._queue = asyncio.Queue[tuple[str, APIEvent] | None](maxsize=max_pending)
+        self._closed = False
+        self.overflowed = False
+
+    @property
+    def channels(self) -> tuple[str, ...]:
+        return self._channels
+
+    def __aiter__(self) -> 'Subscription':
+        return self
+
+    async def __anext__(self) -> tuple[str, APIEvent]:
+        item = await self._queue.get()
+        if item is None:
+            raise StopAsyncIteration
+
+        return item
+
+    async def get(self, timeout: float | None = None) -> tuple[str, APIEvent] | None:
+        '''
+        Waits for the next event. Returns `None` on timeout.
+
+        :raises StopAsyncIteration: If the subscription was closed or dropped.
+        '''
+
+        try:
+            item = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        if item is None:
+            raise StopAsyncIteration
+
+        return item
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+
+        self._closed = True
+        await self._bus._unsubscribe(self)
+        self._wake()
+
+    def _deliver(self, channel: str, event: APIEvent) -> None:
+        if self._closed:
+            return
+
+        try:
+            self._queue.put_nowait((channel, event))
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self._closed = True
+            self._bus._drop(self)
+            self._wake()
+
+    def _wake(self) -> None:
+        # make room for the end-of-stream marker, pending events are useless once closed
+        while self._queue.full():
+            self._queue.get_nowait()
+
+        self._queue.put_nowait(None)
+
+class EventBus(abc.ABC):
+    '''
+    Publish/subscribe bus for real-time events (room messages, presence, typing).
+    Subscriptions are fanned out locally, subclasses only decide how published
+    events reach the local fan-out of every worker.
+    '''
+
+    def __init__(self) -> None:
+        self._subscribers = collections.defaultdict[str, set[Subscription]](set)
+        self._active_channels = set[str]()
+        self._channels_lock = asyncio.Lock()
+        # the loop only keeps weak references to tasks
+        self._background_tasks = set[asyncio.Task]()
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def publish(self, channel: str, event: APIEvent) -> None:
+        ...
+
+    async def subscribe(self,
+                        channels: typing.Iterable[str],
+                        max_pending: int = _DEFAULT_MAX_PENDING_EVENTS) -> Subscription:
+        subscription = Subscription(self, tuple(channels), max_pending)
+
+        new_channels = list[str]()
+        for channel in subscription.channels:
+            if not self._subscribers[channel]:
+                new_channels.append(channel)
+
+            self._subscribers[channel].add(subscription)
+
+        if new_channels:
+            await self._update_channels(new_channels)
+
+        return subscription
+
+    def subscriber_count(self, channel: str) -> int:
+        return len(self._subscribers.get(channel, ()))
+
+    async def _unsubscribe(self, subscription: Subscription) -> None:
+        removed_channels = self._remove_subscription(subscription)
+        if removed_channels:
+            await self._update_channels(removed_channels)
+
+    def _drop(self, subscription: Subscription) -> None:
+        removed_channels = self._remove_subscription(subscription)
+        if removed_channels:
+            task = asyncio.create_task(self._drop_channels(removed_channels))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def _drop_channels(self, channels: list[str]) -> None:
+        try:
+            await self._update_channels(channels)
+        except Exception:
+            _logger.exception('Failed to unsubscribe from channels of a dropped subscriber')
+
+    def _remove_subscription(self, subscription: Subscription) -> list[str]:
+        removed_channels = list[str]()
+        for channel in subscription.channels:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is None:
+                continue
+
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[channel]
+                removed_channels.append(channel)
+
+        return removed_channels
+
+    async def _update_channels(self, channels: list[str]) -> None:
+        # serialized and checked against current subscribers, so a delayed unsubscribe
+        # of a dropped subscriber can't undo a newer subscribe to the same channel
+        async with self._channels_lock:
+            removed_channels = [
+                x for x in channels
+                if x in self._active_channels and not self._subscribers.get(x)]
+            if removed_channels:
+                await self._on_channels_removed(removed_channels)
+                self._active_channels.difference_update(removed_channels)
+
+            added_channels = [
+                x for x in channels
+                if x not in self._active_channels and self._subscribers.get(x)]
+            if added_channels:
+                await self._on_channels_added(added_channels)
+                self._active_channels.update(added_channels)
+
+    def _dispatch(self, channel: str, event: APIEvent) -> None:
+        # copy as delivery may drop overflowing subscribers
+        for subscription in tuple(self._subscribers.get(channel, ())):
+            subscription._deliver(channel, event)
+
+    async def _on_channels_added(self, channels: list[str]) -> None:
+        pass
+
+    async def _on_channels_removed(self, channels: list[str]) -> None:
+        pass
+
+class LocalEventBus(EventBus):
+    '''
+    In-process bus. Only reaches subscribers connected to the same worker process.
+    '''
+
+    async def publish(self, channel: str, event: APIEvent) -> None:
+        self._dispatch(channel, event)
+
+class RedisEventBus(EventBus):
+    '''
+    Bus backed by Redis pub/sub (TCP or `unix://` socket URL), shared by all worker
+    processes. Each worker keeps a single pub/sub connection subscribed only to the
+    channels its local subscribers are interested in.
+    '''
+
+    def __init__(self, url: str) -> None:
+        super().__init__()
+        self._url = url
+        self._client = None
+        self._pubsub = None
+        self._listener_task: asyncio.Task | None = None
+        # pub/sub connection is only established by the first subscribe
+        self._subscribed = asyncio.Event()
+
+    async def start(self) -> None:
+        import redis.asyncio
+
+        self._client = redis.asyncio.from_url(self._url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+
+            self._listener_task = None
+
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def publish(self, channel: str, event: APIEvent) -> None:
+        await self._client.publish(channel, event.model_dump_json())
+
+    async def _on_channels_added(self, channels: list[str]) -> None:
+        await self._pubsub.subscribe(*channels)
+        self._subscribed.set()
+
+    async def _on_channels_removed(self, channels: list[str]) -> None:
+        await self._pubsub.unsubscribe(*channels)
+
+    async def _listen(self) -> None:
+        await self._subscribed.wait()
+
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _logger.exception('Event bus connection failed, reconnecting')
+                await asyncio.sleep(_REDIS_RECONNECT_DELAY)
+                continue
+
+            if message is None or message['type'] != 'message':
+                continue
+
+            channel = message['channel'].decode()
+            try:
+                event = APIEvent.model_validate_json(message['data'])
+            except ValueError:
+                _logger.warning('Dropping malformed event on channel %s', channel)
+                continue
+
+            self._dispatch(channel, event)
+
+def create_event_bus(url: str | None) -> EventBus:
+    if url:
+        return RedisEventBus(url)
+
+    return LocalEventBus()
@@ -0,0 +1,140 @@
+import datetime
+import logging
+import typing
+import pydantic
+import sqlalchemy
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from app.models.chat_room import SQLChatRoom
+from app.models.message import ImportedMessage, ImportRejectedLine, ImportResult, SQLMessage
+from app.models.user import SQLUser
+from app.services.version_service import VersionService, room_messages_key
+
+_logger = logging.getLogger(__name__)
+
+_MAX_REPORTED_REJECTIONS = 100
+
+class ImportService:
+    '''
+    Bulk imports messages with their original timestamps, e.g. when migrating rooms
+    from another chat system. Input is validated and inserted in large batches: senders
+    and rooms of a whole batch are checked with one query each and rows are written
+    with multi-row inserts, bypassing the real-time message queue.
+    '''
+
+    def __init__(self,
+                 db_sessionmaker: async_sessionmaker[AsyncSession],
+                 version_service: VersionService,
+                 batch_size: int,
+                 rows_per_statement: int) -> None:
+        self._db_sessionmaker = db_sessionmaker
+        self._version_service = version_service
+        self._batch_size = batch_size
+        self._rows_per_statement = rows_per_statement
+
+    async def import_messages(self, lines: typing.AsyncIterable[bytes | str]) -> ImportResult:
+        '''
+        Imports messages from NDJSON lines, each one holding a single `ImportedMessage`.
+        Invalid lines and messages referencing missing users or rooms are skipped and
+        reported in the result, every batch is committed separately.
+        '''
+
+        result = ImportResult()
+        known_user_ids = set[int]()
+        known_room_ids = set[int]()
+        imported_room_ids = set[int]()
+        batch = list[tuple[int, ImportedMessage]]()
+
+        async with self._db_sessionmaker() as session:
+            line_number = 0
+            async for line in lines:
+                line_number += 1
+                if not line.strip():
+                    continue
+
+                try:
+                    batch.append((line_number, ImportedMessage.model_validate_json(line)))
+                except pydantic.ValidationError as e:
+                    self._reject(result, line_number, str(e.errors(include_url=False, include_input=False)))
+
+                if len(batch) >= self._batch_size:
+                    await self._import_batch(session, batch, known_user_ids, known_room_ids, result)
+                    imported_room_ids.update(x.room_id for (_, x) in batch)
+                    batch.clear()
+
+            if batch:
+                await self._import_batch(session, batch, known_user_ids, known_room_ids, result)
+                imported_room_ids.update(x.room_id for (_, x) in batch)
+
+        # last message of every touched room is refreshed once, not after every batch
+        await self._version_service.bump(room_messages_key(x) for x in imported_room_ids)
+
+        _logger.info(
+            'Imported %d messages, rejected %d',
+            result.imported,
+            result.rejected)
+
+        return result
+
+    async def _import_batch(self,
+                            session: AsyncSession,
+                            batch: list[tuple[int, ImportedMessage]],
+                            known_user_ids: set[int],
+                            known_room_ids: set[int],
+                            result: ImportResult) -> None:
+        # ids seen in earlier batches were already validated, only new ones are looked up
+        known_user_ids |= await self._find_existing(
+            session,
+            SQLUser.id,
+            {x.sender_id for (_, x) in batch} - known_user_ids)
+        known_room_ids |= await self._find_existing(
+            session,
+            SQLChatRoom.id,
+            {x.room_id for (_, x) in batch} - known_room_ids)
+
+        rows = list[dict[str, typing.Any]]()
+        for (line_number, message) in batch:
+            if message.sender_id not in known_user_ids:
+                self._reject(result, line_number, f'User {message.sender_id} does not exist')
+                continue
+
+            if message.room_id not in known_room_ids:
+                self._reject(result, line_number, f'Room {message.room_id} does not exist')
+                continue
+
+            rows.append({
+                'sender_id': message.sender_id,
+                'room_id': message.room_id,
+                'type': message.type,
+                'content': message.content,
+                'sent_at': _to_database_datetime(message.sent_at)})
+
+        for i in range(0, len(rows), self._rows_per_statement):
+            query = sqlalchemy.insert(SQLMessage) \
+                .values(rows[i:i + self._rows_per_statement])
+            await session.execute(query)
+
+        await session.commit()
+
+        result.imported += len(rows)
+
+    async def _find_existing(self,
+                             session: AsyncSession,
+                             column: sqlalchemy.ColumnElement[int],
+                             ids: set[int]) -> set[int]:
+        if not ids:
+            return set()
+
+        query = sqlalchemy.select(column).where(column.in_(ids))
+        return set((await session.scalars(query)).all())
+
+    def _reject(self, result: ImportResult, line_number: int, reason: str) -> None:
+        result.rejected += 1
+        if len(result.rejected_lines) < _MAX_REPORTED_REJECTIONS:
+            result.rejected_lines.append(ImportRejectedLine(line=line_number, reason=reason))
+
+def _to_database_datetime(value: datetime.datetime) -> datetime.datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return value.replace(microsecond=0)
@@ -1,23 +1,179 @@
-import ipinfo
-import fastapi
+import bisect
+import csv
+import functools
+import ipaddress
+import logging
+import mmap
+import os
+import pathlib
+import typing
 
-from app import error
-from app.models.errors import ErrorIPInfoRetrieveFailed
+if typing.TYPE_CHECKING:
+    import ipinfo
+
+_logger = logging.getLogger(__name__)
 
 _DEFAULT_COUNTRY_CODE = 'PL'
+_LOOKUP_CACHE_SIZE = 8192
+
+# record layout: 16 bytes range start, 16 bytes range end (both big-endian IPv6,
+# IPv4 addresses are stored as IPv4-mapped IPv6), 2 bytes ASCII country code
+_ADDRESS_SIZE = 16
+_RECORD_SIZE = 2 * _ADDRESS_SIZE + 2
+
+def _address_key(address: ipaddress.IPv4Address | ipaddress.IPv6Address) -> bytes:
+    if address.version == 4:
+        address = ipaddress.IPv6Address(f'::ffff:{address}')
+
+    return address.packed
+
+class _RecordStarts(typing.Sequence[bytes]):
+    '''
+    Exposes range starts of the memory-mapped records as a sequence, so it can be
+    searched with `bisect` without copying the whole table into memory.
+    '''
+
+    def __init__(self, buffer: mmap.mmap) -> None:
+        self._buffer = buffer
+        self._length = len(buffer) // _RECORD_SIZE
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> bytes:
+        offset = index * _RECORD_SIZE
+        return self._buffer[offset:offset + _ADDRESS_SIZE]
+
+class IPRangeDatabase:
+    '''
+    Country lookup table of sorted, non-overlapping IP ranges stored in a compact
+    binary file which is memory-mapped and searched with binary search.
+    '''
+
+    def __init__(self, filepath: pathlib.Path) -> None:
+        with open(filepath, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._starts = _RecordStarts(self._buffer)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    @classmethod
+    def compile_csv(cls, csv_filepath: pathlib.Path, output_filepath: pathlib.Path) -> None:
+        '''
+        Converts CSV file with `start_ip,end_ip,country_code` rows (DB-IP/ipinfo country
+        lite format, additional columns are ignored) into the binary format used by the database.
+        '''
+
+        records = list[tuple[bytes, bytes, bytes]]()
+        with open(csv_filepath, newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 3:
+                    continue
+
+                try:
+                    start = ipaddress.ip_address(row[0].strip())
+                    end = ipaddress.ip_address(row[1].strip())
+                except ValueError:
+                    # header or malformed row
+                    continue
+
+                country_code = row[2].strip().upper()
+                if len(country_code) != 2:
+                    continue
+
+                records.append((_address_key(start), _address_key(end), country_code.encode('ascii')))
+
+        records.sort()
+
+        tmp_filepath = output_filepath.with_suffix('.tmp')
+        with open(tmp_filepath, 'wb') as f:
+            for record in records:
+                f.write(b''.join(record))
+
+        os.replace(tmp_filepath, output_filepath)
+
+    def close(self) -> None:
+        self._buffer.close()
+
+    def lookup(self, address: ipaddress.IPv4Address | ipaddress.IPv6Address) -> str | None:
+        key = _address_key(address)
+
+        index = bisect.bisect_right(self._starts, key) - 1
+        if index < 0:
+            return None
+
+        offset = index * _RECORD_SIZE
+        end = self._buffer[offset + _ADDRESS_SIZE:offset + 2 * _ADDRESS_SIZE]
+        if key > end:
+            return None
+
+        return self._buffer[offset + 2 * _ADDRESS_SIZE:offset + _RECORD_SIZE].decode('ascii')
 
 class LocationService:
-    def __init__(self, ipinfo_handler: ipinfo.AsyncHandler) -> None:
+    def __init__(self,
+                 ipinfo_handler: 'ipinfo.AsyncHandler | None',
+                 database_filepath: pathlib.Path) -> None:
         self._ipinfo_handler = ipinfo_handler
+        self._database_filepath = database_filepath
+        self._database: IPRangeDatabase | None = None
+        self._lookup_cached = functools.lru_cache(maxsize=_LOOKUP_CACHE_SIZE)(self._lookup)
+
+    def load_database(self) -> None:
+        '''
+        Loads local IP ranges database, compiling it from the CSV source first if the binary
+        file is missing or older than the source. Does nothing if no database file is present
+        or it holds no ranges, in which case lookups rely only on ipinfo fallback.
+        '''
+
+        binary_filepath = self._database_filepath.with_suffix('.bin')
+        if self._database_filepath.exists():
+            if not binary_filepath.exists() \
+               or binary_filepath.stat().st_mtime < self._database_filepath.stat().st_mtime:
+                IPRangeDatabase.compile_csv(self._database_filepath, binary_filepath)
+
+        if not binary_filepath.exists():
+            return
+
+        if self._database is not None:
+            self._database.close()
+            self._database = None
+
+        # empty files can't be memory-mapped
+        if binary_filepath.stat().st_size == 0:
+            _logger.warning('IP ranges database %s has no valid rows, using ipinfo only', self._database_filepath)
+        else:
+            self._database = IPRangeDatabase(binary_filepath)
+
+        self._lookup_cached.cache_clear()
 
     async def get_country_code_from_ip(self, ip_address: str) -> str:
+        country_code = self._lookup_cached(ip_address)
+        if country_code is not None:
+            return country_code
+
+        if self._ipinfo_handler is not None:
+            try:
+                ip_info = await self._ipinfo_handler.getDetails(ip_address)
+                if not ip_info.all.get('bogon'):
+                    return ip_info.all['country']
+            except Exception:
+                # fallback is best-effort only, registration must not depend on external API
+                pass
+
+        return _DEFAULT_COUNTRY_CODE
+
+    def _lookup(self, ip_address: str) -> str | None:
         try:
-            ip_info = await self._ipinfo_handler.getDetails(ip_address)
-            if ip_info.all['bogon']:
-                return _DEFAULT_COUNTRY_CODE
-
-            return ip_info.all['country']
-        except Exception:
-            error.raise_error_obj(
-                ErrorIPInfoRetrieveFailed(ip_address=ip_address),
-                fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return _DEFAULT_COUNTRY_CODE
+
+        if not address.is_global:
+            return _DEFAULT_COUNTRY_CODE
+
+        if self._database is None:
+            return None
+
+        return self._database.lookup(address)
@@ -5,9 +5,21 @@ import hashlib
 import pathlib
 import sqlalchemy
 import dataclasses
+import datetime
+import logging
+import time
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from sqlalchemy.exc import IntegrityError
+from opentelemetry import trace
+from app import metrics
+from app.tracing import tracer
+from app.models.change_log import ChangeKind, SQLChange
+from app.models.event import APIEvent, EventType
 from app.models.message import MessageType, SQLMessage
+from app.services.event_bus import EventBus, room_channel
+from app.services.version_service import VersionService, room_messages_key
+
+_logger = logging.getLogger(__name__)
 
 @dataclasses.dataclass
 class Message:
@@ -16,22 +28,71 @@ class Message:
     text: str | None
     attachment_data: bytes | None
     attachment_filename: str | None
+    trace_context: trace.SpanContext | None = None
+    '''
+    Context of the span which enqueued the message, linked from the batch span that writes it.
+    '''
+    enqueued_at: float = 0.0
+
+class _AdaptiveBatchSize:
+    '''
+    Upper bound of the next message batch size. Doubles while the writer falls behind
+    (a full batch leaves messages in the queue), but only up to the size that can be written
+    within `target_latency`, since every message of a batch waits until the whole batch is.
+    '''
+
+    # weight of the latest batch in the average write time
+    _SMOOTHING = 0.3
+
+    def __init__(self, min_size: int, max_size: int, target_latency: float) -> None:
+        assert 1 <= min_size <= max_size, 'Invalid message batch size bounds'
+
+        self.size = min_size
+        self._min_size = min_size
+        self._max_size = max_size
+        self._target_latency = target_latency
+        self._message_write_time: float | None = None
+
+    def record_batch(self, batch_size: int, write_time: float, queue_depth: int) -> None:
+        # per message, overhead of a batch makes it an overestimate for small batches
+        message_write_time = write_time / batch_size
+        if self._message_write_time is None:
+            self._message_write_time = message_write_time
+        else:
+            self._message_write_time += self._SMOOTHING * (message_write_time - self._message_write_time)
+
+        size = self.size
+        if batch_size >= size and queue_depth > 0:
+            size *= 2
+
+        latency_bound = int(self._target_latency / self._message_write_time) if self._message_write_time > 0 else self._max_size
+        self.size = max(self._min_size, min(size, latency_bound, self._max_size))
 
 class MessageService:
     def __init__(self,
                  db_sessionmaker: async_sessionmaker[AsyncSession],
                  db_writer_tasks: int,
                  message_queue_size: int,
-                 message_upload_batch_size: int,
-                 message_upload_batch_timeout: float,
-                 data_directory: pathlib.Path) -> None:
+                 message_batch_min_size: int,
+                 message_batch_max_size: int,
+                 message_batch_target_latency: float,
+                 data_directory: pathlib.Path,
+                 event_bus: EventBus,
+                 version_service: VersionService) -> None:
         self._db_sessionmaker = db_sessionmaker
-        self._message_upload_batch_size = message_upload_batch_size
-        self._message_upload_batch_timeout = message_upload_batch_timeout
+        self._event_bus = event_bus
+        self._version_service = version_service
+        self._batch_size = _AdaptiveBatchSize(
+            message_batch_min_size,
+            message_batch_max_size,
+            message_batch_target_latency)
         self._message_queue = asyncio.Queue[Message](maxsize=message_queue_size)
         self._db_writer_task: asyncio.Task | None = None
         self._attachments_directory = data_directory / 'attachments'
 
+        metrics.MESSAGE_QUEUE_DEPTH.set_function(self._message_queue.qsize)
+        metrics.MESSAGE_BATCH_SIZE_LIMIT.set_function(lambda: self._batch_size.size)
+
     def start_db_writer_task(self) -> None:
         assert self._db_writer_task is None, 'Writer task already running'
         self._db_writer_task = asyncio.create_task(self._db_writer())
@@ -39,35 +100,44 @@ class MessageService:
     async def shutdown_db_writer_task(self) -> None:
         if self._db_writer_task is not None:
             self._db_writer_task.cancel()
-            await self._db_writer_task
+            try:
+                await self._db_writer_task
+            except asyncio.CancelledError:
+                pass
 
             self._db_writer_task = None
     
     async def upload_message(self, message: Message) -> None:
-        await self._message_queue.put(message)
+        with tracer.start_as_current_span('message.enqueue') as span:
+            message.trace_context = span.get_span_context()
+            message.enqueued_at = time.perf_counter()
+
+            await self._message_queue.put(message)
 
     async def _db_writer(self):
         try:
             while True:
-                batch = list[Message]()
+                batch = [await self._message_queue.get()]
 
-                item = await self._message_queue.get()
-                batch.append(item)
+                # Messages queued while the previous batch was written make up the next one.
+                # Nothing waits for a batch to fill up, an idle queue is flushed right away.
+                while len(batch) < self._batch_size.size and not self._message_queue.empty():
+                    batch.append(self._message_queue.get_nowait())
 
-                deadline = asyncio.get_event_loop().time() + self._message_upload_batch_timeout
+                start_time = time.perf_counter()
+                try:
+                    await asyncio.shield(self._upload_message_batch(batch))
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # the writer has to outlive a failed batch, otherwise posting stalls for good
+                    _logger.exception('Writing batch of %d messages failed', len(batch))
+                    continue
 
-                while len(batch) < self._message_upload_batch_size:
-                    timeout = deadline - asyncio.get_event_loop().time()
-                    if timeout <= 0.0:
-                        break
-
-                    try:
-                        item = await asyncio.wait_for(self._message_queue.get(), timeout)
-                        batch.append(item)
-                    except asyncio.TimeoutError:
-                        break
-                
-                await asyncio.shield(self._upload_message_batch(batch))
+                self._batch_size.record_batch(
+                    len(batch),
+                    time.perf_counter() - start_time,
+                    self._message_queue.qsize())
         except asyncio.CancelledError:
             await self._flush_remaining_messages()
             raise
@@ -92,7 +162,7 @@ class MessageService:
             ext = os.path.splitext(attachment_filename)[1].lower()
         
         filepath = self._attachments_directory / str(room_id) / f'{data_hash}{ext}'
-        await asyncio.to_thread(self._write_attachment_file, filepath, attachment_data)
+        await metrics.to_thread('attachment', self._write_attachment_file, filepath, attachment_data)
 
         # TODO Strenghten attachment type resolution
         message_type = MessageType.FILE
@@ -102,35 +172,107 @@ class MessageService:
         return (message_type, data_hash)
 
     async def _upload_message_batch(self, batch: list[Message]) -> None:
+        metrics.MESSAGE_BATCH_SIZE.observe(len(batch))
+
+        dequeued_at = time.perf_counter()
+        links = [
+            trace.Link(
+                message.trace_context,
+                {'message.queue_wait_ms': 1000.0 * (dequeued_at - message.enqueued_at)})
+            for message in batch
+            if message.trace_context is not None and message.trace_context.is_valid]
+
+        # batch span starts a new trace, requests it contains are reachable through links
+        with tracer.start_as_current_span(
+            'message.batch',
+            context=trace.set_span_in_context(trace.INVALID_SPAN),
+            links=links,
+            attributes={'message.batch_size': len(batch)}):
+            await self._upload_message_batch_impl(batch)
+
+    async def _upload_message_batch_impl(self, batch: list[Message]) -> None:
+        # DATETIME column has second precision, truncate so published events match stored rows
+        sent_at = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
         messages_processed = list[dict[str, typing.Any]]()
 
         for message in batch:
             if message.attachment_data is not None:
-                message_type, attachment_hash = await self._upload_message_attachment(
-                    message.room_id,
-                    message.attachment_filename,
-                    message.attachment_data)
+                with tracer.start_as_current_span(
+                    'message.attachment_write',
+                    attributes={'room.id': message.room_id, 'attachment.size': len(message.attachment_data)}):
+                    message_type, attachment_hash = await self._upload_message_attachment(
+                        message.room_id,
+                        message.attachment_filename,
+                        message.attachment_data)
                 messages_processed.append({
                     'sender_id': message.sender_id,
                     'room_id': message.room_id,
                     'content': attachment_hash,
-                    'type': message_type})
+                    'type': message_type,
+                    'sent_at': sent_at})
             else:
                 messages_processed.append({
                     'sender_id': message.sender_id,
                     'room_id': message.room_id,
                     'content': message.text,
-                    'type': MessageType.TEXT})
+                    'type': MessageType.TEXT,
+                    'sent_at': sent_at})
+
+        commit_start_time = time.perf_counter()
+        with tracer.start_as_current_span('message.commit') as span:
+            async with self._db_sessionmaker() as session:
+                query = sqlalchemy.insert(SQLMessage).values(messages_processed)
+                result = await session.execute(query)
+                query = sqlalchemy.insert(SQLChange).values(_message_changes(result.lastrowid, messages_processed))
+                await session.execute(query)
+
+                try:
+                    await session.commit()
+                except IntegrityError as e:
+                    await session.rollback()
 
-        async with self._db_sessionmaker() as session:
-            query = sqlalchemy.insert(SQLMessage).values(messages_processed)
-            await session.execute(query)
+                    span.record_exception(e)
+                    print(e)
+                    # TODO Check which message caused error, remove it and send info to the client that posted it
+                    return
 
+        metrics.MESSAGE_BATCH_COMMIT_SECONDS.observe(time.perf_counter() - commit_start_time)
+
+        await self._version_service.bump({room_messages_key(x['room_id']) for x in messages_processed})
+
+        # A multi-row VALUES insert is a "simple insert" for InnoDB, which allocates
+        # consecutive auto-increment values for it in every lock mode.
+        await self._publish_messages(result.lastrowid, messages_processed)
+
+    async def _publish_messages(self, first_id: int, messages: list[dict[str, typing.Any]]) -> None:
+        for (offset, message) in enumerate(messages):
+            event = APIEvent(
+                type=EventType.ROOM_MESSAGE,
+                room_id=message['room_id'],
+                user_id=message['sender_id'],
+                data={
+                    'id': first_id + offset,
+                    'type': message['type'],
+                    'content': message['content'],
+                    'sent_at': message['sent_at'],
+                    'sender_id': message['sender_id']})
             try:
-                await session.commit()
-            except IntegrityError as e:
-                await session.rollback()
+                await self._event_bus.publish(room_channel(message['room_id']), event)
+            except Exception:
+                # messages are already stored, clients will catch up on next fetch
+                _logger.exception('Failed to publish message event for room %d', message['room_id'])
 
-                print(e)
-                # TODO Check which message caused error, remove it and send info to the client that posted it
-                pass
+def _message_changes(first_id: int, messages: list[dict[str, typing.Any]]) -> list[dict[str, typing.Any]]:
+    # one change per room of the batch, IDs of a room's messages lie within [first_id, last_id]
+    changes = dict[int, dict[str, typing.Any]]()
+    for (offset, message) in enumerate(messages):
+        change = changes.get(message['room_id'])
+        if change is None:
+            changes[message['room_id']] = {
+                'kind': ChangeKind.ROOM_MESSAGES,
+                'room_id': message['room_id'],
+                'data': {'first_id': first_id + offset, 'last_id': first_id + offset, 'sent_at': message['sent_at'].isoformat()}}
+        else:
+            change['data']['last_id'] = first_id + offset
+
+    return list(changes.values())
@@ -0,0 +1,180 @@
+import asyncio
+import dataclasses
+import datetime
+import logging
+import sqlalchemy
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from app import database
+from app.models.message import FUTURE_PARTITION_NAME, SQLMessage
+
+_logger = logging.getLogger(__name__)
+
+_MAINTENANCE_LOCK_NAME = 'chat_api_message_partitions'
+_MAINTENANCE_INTERVAL = 6 * 60 * 60
+
+@dataclasses.dataclass(frozen=True)
+class MessagePartition:
+    name: str
+    upper_bound: datetime.date | None
+    '''
+    First day not stored in the partition, `None` for the catch-all `MAXVALUE` partition
+    '''
+
+    rows: int
+    '''
+    Estimated number of rows (from table statistics)
+    '''
+
+class PartitionService:
+    '''
+    Maintains monthly RANGE partitions of the messages table. Partitions are created
+    `months_ahead` months in advance by splitting the empty `p_future` partition, which is
+    practically free, and whole months older than `retention_months` are dropped instead of
+    being deleted row by row. Runs in every worker, a named database lock makes sure only
+    one of them alters the table at a time.
+    '''
+
+    def __init__(self,
+                 db_sessionmaker: async_sessionmaker[AsyncSession],
+                 months_ahead: int,
+                 retention_months: int) -> None:
+        self._db_sessionmaker = db_sessionmaker
+        self._months_ahead = months_ahead
+        self._retention_months = retention_months
+        self._maintenance_task: asyncio.Task | None = None
+
+    def start_maintenance_task(self) -> None:
+        assert self._maintenance_task is None, 'Maintenance task already running'
+        self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    async def shutdown_maintenance_task(self) -> None:
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+
+            self._maintenance_task = None
+
+    async def get_partitions(self) -> list[MessagePartition]:
+        '''
+        Lists partitions of the messages table ordered by their upper bound.
+        Returns empty list if the table is not partitioned.
+        '''
+
+        async with self._db_sessionmaker() as session:
+            return await self._get_partitions_session(session)
+
+    async def run_maintenance(self, today: datetime.date | None = None) -> None:
+        if today is None:
+            today = datetime.datetime.now(datetime.timezone.utc).date()
+
+        async with database.named_lock_session(self._db_sessionmaker, _MAINTENANCE_LOCK_NAME) as session:
+            if session is None:
+                _logger.debug('Partition maintenance is already running in another worker')
+                return
+
+            partitions = await self._get_partitions_session(session)
+            if not partitions:
+                _logger.warning(
+                    'Table %s is not partitioned, skipping partition maintenance',
+                    SQLMessage.__tablename__)
+                return
+
+            await self._create_future_partitions(session, partitions, today)
+            await self._drop_expired_partitions(session, partitions, today)
+
+    async def _maintenance_loop(self) -> None:
+        while True:
+            try:
+                await self.run_maintenance()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _logger.exception('Partition maintenance failed')
+
+            await asyncio.sleep(_MAINTENANCE_INTERVAL)
+
+    async def _create_future_partitions(self,
+                                        session: AsyncSession,
+                                        partitions: list[MessagePartition],
+                                        today: datetime.date) -> None:
+        last_bound = max(
+            (x.upper_bound for x in partitions if x.upper_bound is not None),
+            default=None)
+
+        new_bounds = list[datetime.date]()
+        month_start = today.replace(day=1)
+        for _ in range(self._months_ahead + 1):
+            month_start = _add_months(month_start, 1)
+            if last_bound is None or month_start > last_bound:
+                new_bounds.append(month_start)
+
+        if not new_bounds:
+            return
+
+        definitions = [
+            f'PARTITION {_partition_name(_add_months(x, -1))} VALUES LESS THAN (TO_DAYS(\'{x.isoformat()}\'))'
+            for x in new_bounds]
+        definitions.append(f'PARTITION {FUTURE_PARTITION_NAME} VALUES LESS THAN MAXVALUE')
+
+        await session.execute(
+            sqlalchemy.text(
+                f'ALTER TABLE {SQLMessage.__tablename__} '
+                f'REORGANIZE PARTITION {FUTURE_PARTITION_NAME} INTO ({", ".join(definitions)})'))
+
+        _logger.info(
+            'Created %d message partitions, last one ends at %s',
+            len(new_bounds),
+            new_bounds[-1].isoformat())
+
+    async def _drop_expired_partitions(self,
+                                       session: AsyncSession,
+                                       partitions: list[MessagePartition],
+                                       today: datetime.date) -> None:
+        if self._retention_months <= 0:
+            return
+
+        cutoff = _add_months(today.replace(day=1), -self._retention_months)
+        expired = [
+            x.name
+            for x in partitions
+            if x.upper_bound is not None and x.upper_bound <= cutoff]
+
+        if not expired:
+            return
+
+        await session.execute(
+            sqlalchemy.text(
+                f'ALTER TABLE {SQLMessage.__tablename__} DROP PARTITION {", ".join(expired)}'))
+
+        _logger.info('Dropped expired message partitions: %s', ', '.join(expired))
+
+    async def _get_partitions_session(self, session: AsyncSession) -> list[MessagePartition]:
+        query = sqlalchemy.text(
+            'SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS '
+            'FROM information_schema.PARTITIONS '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name AND PARTITION_NAME IS NOT NULL '
+            'ORDER BY PARTITION_ORDINAL_POSITION')
+        rows = await session.execute(query, {'table_name': SQLMessage.__tablename__})
+
+        return [
+            MessagePartition(
+                name,
+                None if description == 'MAXVALUE' else _from_days(int(description)),
+                table_rows or 0)
+            for (name, description, table_rows)
+            in rows]
+
+def _add_months(date: datetime.date, months: int) -> datetime.date:
+    month_index = date.year * 12 + date.month - 1 + months
+    return date.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+def _partition_name(month_start: datetime.date) -> str:
+    return f'p{month_start.year:04d}{month_start.month:02d}'
+
+def _from_days(days: int) -> datetime.date:
+    # MySQL TO_DAYS counts from year 0, which is 365 days before Python's first ordinal
+    return datetime.date.fromordinal(days - 365)
@@ -0,0 +1,167 @@
+import abc
+import collections
+import dataclasses
+import math
+import re
+import time
+import typing
+
+_KEY_PREFIX = 'chat:rate:'
+_MAX_LOCAL_BUCKETS = 100000
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 60 * 60, 'day': 24 * 60 * 60}
+_RATE_PATTERN = re.compile(r'(?P<count>\d+)\s*/\s*(?P<period>second|minute|hour|day)')
+
+# checks all buckets first and only then takes a token from each, so a request
+# rejected by one bucket doesn't drain the others; time comes from the Redis server
+# so workers with skewed clocks agree
+_TOKEN_BUCKET_SCRIPT = '''
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local state = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local available = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or now
+    available = math.min(capacity, available + math.max(0, now - updated_at) * rate)
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+    tokens[i] = available
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tostring(tokens[i] - 1), 'updated_at', tostring(now))
+    redis.call('EXPIRE', key, ttl)
+end
+return '0'
+'''
+
+@dataclasses.dataclass(frozen=True)
+class RateLimit:
+    capacity: int
+    '''
+    Maximum burst of requests
+    '''
+
+    refill_rate: float
+    '''
+    Tokens added to the bucket per second
+    '''
+
+    @classmethod
+    def parse(cls, rate: str) -> 'RateLimit':
+        '''
+        Parses limits like `10/minute`, allowing a burst of 10 requests refilled
+        evenly over a minute.
+        '''
+
+        match = _RATE_PATTERN.fullmatch(rate.strip())
+        if match is None:
+            raise ValueError(f'Invalid rate limit: {rate}')
+
+        count = int(match['count'])
+        return cls(count, count / _PERIODS[match['period']])
+
+    @property
+    def refill_time(self) -> float:
+        '''
+        Seconds it takes to refill an empty bucket
+        '''
+
+        return self.capacity / self.refill_rate
+
+class RateLimitService(abc.ABC):
+    '''
+    Token bucket rate limiter. Every key (client IP, user, API key...) has its own
+    bucket per limit, a request takes one token from each bucket it's keyed by.
+    '''
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def acquire(self, keys: typing.Sequence[str], limit: RateLimit) -> float | None:
+        '''
+        Takes a token from buckets of all `keys`. Returns `None` on success, otherwise
+        number of seconds after which the request may be retried; no token is taken then.
+        '''
+
+class UnlimitedRateLimitService(RateLimitService):
+    async def acquire(self, keys: typing.Sequence[str], limit: RateLimit) -> float | None:
+        return None
+
+class LocalRateLimitService(RateLimitService):
+    '''
+    In-process buckets. With multiple worker processes every worker limits on its own.
+    '''
+
+    def __init__(self) -> None:
+        self._buckets = collections.OrderedDict[str, tuple[float, float]]()
+
+    async def acquire(self, keys: typing.Sequence[str], limit: RateLimit) -> float | None:
+        now = time.monotonic()
+
+        tokens = list[float]()
+        for key in keys:
+            (available, updated_at) = self._buckets.get(key, (limit.capacity, now))
+            tokens.append(min(limit.capacity, available + (now - updated_at) * limit.refill_rate))
+
+        wait = max(((1 - x) / limit.refill_rate for x in tokens if x < 1), default=0.0)
+        if wait > 0:
+            return wait
+
+        for (key, available) in zip(keys, tokens):
+            self._buckets[key] = (available - 1, now)
+            self._buckets.move_to_end(key)
+
+        # dropping the least recently used bucket only forgets a (nearly) refilled one
+        while len(self._buckets) > _MAX_LOCAL_BUCKETS:
+            self._buckets.popitem(last=False)
+
+        return None
+
+class RedisRateLimitService(RateLimitService):
+    '''
+    Buckets shared by all worker processes, stored in Redis (TCP or `unix://` socket URL).
+    '''
+
+    def __init__(self, url: str) -> None:
+        self._url = url
+        self._client = None
+        self._script = None
+
+    async def start(self) -> None:
+        import redis.asyncio
+
+        self._client = redis.asyncio.from_url(self._url)
+        self._script = self._client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def acquire(self, keys: typing.Sequence[str], limit: RateLimit) -> float | None:
+        wait = float(
+            await self._script(
+                keys=[_KEY_PREFIX + x for x in keys],
+                args=[limit.capacity, limit.refill_rate, math.ceil(limit.refill_time) + 1]))
+
+        return wait if wait > 0 else None
+
+def create_rate_limit_service(url: str | None, enabled: bool) -> RateLimitService:
+    if not enabled:
+        return UnlimitedRateLimitService()
+
+    if url:
+        return RedisRateLimitService(url)
+
+    return LocalRateLimitService()
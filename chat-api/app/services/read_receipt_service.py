@@ -0,0 +1,198 @@
+import asyncio
+import collections
+import logging
+import fastapi
+import sqlalchemy
+from sqlalchemy.dialects import mysql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from app.models.chat_room_user import SQLChatRoomUser
+from app.models.errors import ErrorMessageNotFound
+from app.models.read_receipt import APIReadReceipt, SQLReadReceipt
+from app.services.room_service import RoomService
+from app.services.version_service import VersionService, room_messages_key, room_receipts_key
+
+_logger = logging.getLogger(__name__)
+
+_ROOMS_CACHE_SIZE = 1000
+_ROWS_PER_STATEMENT = 1000
+
+class ReadReceiptService:
+    '''
+    Read receipts ("seen by"). Only the highest message ID a user has read in a room is
+    kept, reports are merged in memory and upserted every `flush_interval` in a few
+    multi-row statements, no matter how often clients report reading. A stored receipt
+    never moves back. Receipts of a room are served from its cached stored receipts
+    merged with receipts not yet written, so reads don't hit the database either until
+    some worker writes new receipts of the room.
+    '''
+
+    def __init__(self,
+                 db_sessionmaker: async_sessionmaker[AsyncSession],
+                 room_service: RoomService,
+                 version_service: VersionService,
+                 flush_interval: float) -> None:
+        self._db_sessionmaker = db_sessionmaker
+        self._room_service = room_service
+        self._version_service = version_service
+        self._flush_interval = flush_interval
+        # room ID -> user ID -> message ID, receipts not written yet and the ones being written
+        self._pending = collections.defaultdict[int, dict[int, int]](dict)
+        self._flushing = dict[int, dict[int, int]]()
+        # room ID -> (receipts version, user ID -> message ID)
+        self._stored = collections.OrderedDict[int, tuple[int, dict[int, int]]]()
+        # room ID -> (messages version, ID of the newest message)
+        self._newest = collections.OrderedDict[int, tuple[int, int]]()
+        self._flush_task: asyncio.Task | None = None
+
+    def start_flush_task(self) -> None:
+        assert self._flush_task is None, 'Flush task already running'
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def shutdown_flush_task(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+
+            self._flush_task = None
+
+        try:
+            await self.flush()
+        except Exception:
+            _logger.exception('Writing remaining read receipts failed')
+
+    async def mark_read(self, user_id: int, room_id: int, message_id: int) -> None:
+        '''
+        Records that the user has read messages of the room up to `message_id`.
+
+        :raises ErrorRoomUserNotJoined: If user doesn't belong to the room.
+        :raises ErrorMessageNotFound: If `message_id` is past the newest message of the room.
+        '''
+
+        await self._room_service.check_user_belongs_to_cached(user_id, room_id)
+
+        # a receipt never moves back, one past the newest message would hide all later ones
+        if message_id <= 0 or message_id > await self._get_newest_message_id(room_id):
+            ErrorMessageNotFound(room_id=room_id, message_id=message_id) \
+                .raise_(fastapi.status.HTTP_404_NOT_FOUND)
+
+        receipts = self._pending[room_id]
+        if message_id > receipts.get(user_id, 0):
+            receipts[user_id] = message_id
+
+    async def get_room_receipts(self, room_id: int, min_message_id: int = 0) -> list[APIReadReceipt]:
+        '''
+        Retrieves receipts of room members, optionally only of those who have read
+        the message with `min_message_id` ("seen by").
+        '''
+
+        receipts = dict(await self._get_stored_receipts(room_id))
+        for pending in (self._flushing.get(room_id), self._pending.get(room_id)):
+            for (user_id, message_id) in (pending or {}).items():
+                if message_id > receipts.get(user_id, 0):
+                    receipts[user_id] = message_id
+
+        return [
+            APIReadReceipt(user_id=user_id, message_id=message_id)
+            for (user_id, message_id) in receipts.items()
+            if message_id >= min_message_id]
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+
+        (self._flushing, self._pending) = (self._pending, collections.defaultdict[int, dict[int, int]](dict))
+        try:
+            rows = [
+                {'room_id': room_id, 'user_id': user_id, 'message_id': message_id}
+                for (room_id, receipts) in self._flushing.items()
+                for (user_id, message_id) in receipts.items()]
+
+            async with self._db_sessionmaker() as session:
+                try:
+                    await self._upsert_session(rows, session)
+                except IntegrityError:
+                    # some users left or rooms were deleted since reading, skip their receipts
+                    await session.rollback()
+                    await self._upsert_session(await self._filter_members_session(rows, session), session)
+
+            await self._version_service.bump([room_receipts_key(x) for x in self._flushing])
+        except BaseException:
+            # keep receipts for the next attempt, newer ones reported meanwhile win; cancelled
+            # flushes included, shutdown cancels the flush loop and writes them right after
+            for (room_id, receipts) in self._flushing.items():
+                pending = self._pending[room_id]
+                for (user_id, message_id) in receipts.items():
+                    if message_id > pending.get(user_id, 0):
+                        pending[user_id] = message_id
+
+            raise
+        finally:
+            self._flushing = {}
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+
+            try:
+                await self.flush()
+            except Exception:
+                _logger.exception('Writing read receipts failed')
+
+    async def _upsert_session(self, rows: list[dict[str, int]], session: AsyncSession) -> None:
+        for i in range(0, len(rows), _ROWS_PER_STATEMENT):
+            query = mysql.insert(SQLReadReceipt).values(rows[i:i + _ROWS_PER_STATEMENT])
+            query = query.on_duplicate_key_update(
+                message_id=sqlalchemy.func.greatest(SQLReadReceipt.message_id, query.inserted.message_id))
+            await session.execute(query)
+
+        await session.commit()
+
+    async def _filter_members_session(self, rows: list[dict[str, int]], session: AsyncSession) -> list[dict[str, int]]:
+        query = sqlalchemy.select(SQLChatRoomUser.room_id, SQLChatRoomUser.user_id) \
+            .where(sqlalchemy.tuple_(SQLChatRoomUser.room_id, SQLChatRoomUser.user_id).in_(
+                [(x['room_id'], x['user_id']) for x in rows]))
+        members = set((await session.execute(query)).tuples())
+
+        return [x for x in rows if (x['room_id'], x['user_id']) in members]
+
+    async def _get_stored_receipts(self, room_id: int) -> dict[int, int]:
+        (_, [receipts_version]) = await self._version_service.get_versions([room_receipts_key(room_id)])
+
+        cached = self._stored.get(room_id)
+        if cached is not None and cached[0] == receipts_version:
+            self._stored.move_to_end(room_id)
+            return cached[1]
+
+        async with self._db_sessionmaker() as session:
+            query = sqlalchemy.select(SQLReadReceipt.user_id, SQLReadReceipt.message_id) \
+                .where(SQLReadReceipt.room_id == room_id)
+            receipts = dict((await session.execute(query)).tuples().all())
+
+        self._stored[room_id] = (receipts_version, receipts)
+        self._stored.move_to_end(room_id)
+        if len(self._stored) > _ROOMS_CACHE_SIZE:
+            self._stored.popitem(last=False)
+
+        return receipts
+
+    async def _get_newest_message_id(self, room_id: int) -> int:
+        (_, [messages_version]) = await self._version_service.get_versions([room_messages_key(room_id)])
+
+        cached = self._newest.get(room_id)
+        if cached is not None and cached[0] == messages_version:
+            self._newest.move_to_end(room_id)
+            return cached[1]
+
+        newest_id = await self._room_service.get_newest_message_id(room_id)
+
+        self._newest[room_id] = (messages_version, newest_id)
+        self._newest.move_to_end(room_id)
+        if len(self._newest) > _ROOMS_CACHE_SIZE:
+            self._newest.popitem(last=False)
+
+        return newest_id
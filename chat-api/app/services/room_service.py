@@ -1,34 +1,58 @@
-import asyncio
+import base64
+import binascii
+import collections
+import datetime
 import enum
 import io
+import json
 import os
 import pathlib
+import typing
 import sqlalchemy
 import sqlalchemy.exc
 import sqlalchemy.orm
 import fastapi
-from PIL import Image
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
-from app.models.chat_room import APIChatRoom, APIChatRoomUser, RoomType, SQLChatRoom
+from app import imaging, metrics
+from app.tracing import tracer
+from app.models.chat_room import APIChatRoom, APIChatRoomUser, APIChatRoomUserPage, RoomType, SQLChatRoom
 from app.models.chat_room_user import SQLChatRoomUser
+from app.models.change_log import ChangeKind, SQLChange
 from app.models.user import SQLUser, APIUserForeign
-from app.models.errors import ErrorFileSaveFailed, ErrorImageInvalidType, ErrorRoomAlreadyExists, ErrorRoomAlreadyJoined, ErrorRoomDeleteInternal, ErrorRoomInternalJoin, ErrorRoomNameTooLong, ErrorRoomNotFound, ErrorRoomNotOwner, ErrorRoomPrivateJoin, ErrorRoomInvalidTypeChange, ErrorRoomUserNotJoined
-from app.models.message import RoomMessage, SQLMessage
+from app.models.errors import ErrorFileSaveFailed, ErrorImageInvalidType, ErrorRoomAlreadyExists, ErrorRoomAlreadyJoined, ErrorRoomDeleteInternal, ErrorRoomInternalJoin, ErrorRoomNameTooLong, ErrorRoomNotFound, ErrorRoomNotOwner, ErrorRoomPrivateJoin, ErrorRoomInvalidTypeChange, ErrorRoomUserNotJoined, ErrorRoomUsersCursorInvalid
+from app.models.message import ExportedRoomMessage, MessageType, RoomMessage, SQLMessage
+from app.services.archive_service import ArchiveService, message_key
+from app.services.version_service import VersionService, room_key, room_members_key, user_rooms_key
+
+_EXPORT_FETCH_SIZE = 1000
+_ROOM_IMAGE_QUALITY = 75
+_MEMBERSHIPS_CACHE_SIZE = 10000
 
 class RoomUsersOrder(enum.StrEnum):
     USERNAME = 'username'
     OWNERSHIP = 'ownership'
     JOIN_DATE = 'join_date'
 
+_SortKey = list[tuple[str, sqlalchemy.ColumnElement, bool]]
+'''
+Columns ordering room members as `(name, column, descending)`, last one must be unique.
+'''
+
 class RoomService:
     def __init__(self,
                  db_sessionmaker: async_sessionmaker[AsyncSession],
                  data_directory: pathlib.Path,
-                 room_image_size: int) -> None:
+                 room_image_size: int,
+                 archive_service: ArchiveService,
+                 version_service: VersionService) -> None:
         self._db_sessionmaker = db_sessionmaker
+        self._archive_service = archive_service
+        self._version_service = version_service
         self._room_images_directory = data_directory / 'room_images'
         self._attachments_directory = data_directory / 'attachments'
         self._room_image_size = (room_image_size, room_image_size)
+        # (user ID, room ID) -> version of the user's room set when membership was checked
+        self._memberships = collections.OrderedDict[tuple[int, int], int]()
 
     async def delete_room(self, room_id: int, user_id: int):
         async with self._db_sessionmaker() as session:
@@ -37,7 +61,8 @@ class RoomService:
                 sqlalchemy.func.if_(
                     SQLChatRoom.owner_id == user_id,
                     True,
-                    False))
+                    False)) \
+                .where(SQLChatRoom.id == room_id)
             room_type, is_owner = (await session.execute(query)).one()
 
             if room_type == RoomType.INTERNAL:
@@ -48,34 +73,167 @@ class RoomService:
                 ErrorRoomNotOwner(room_id=room_id, user_id=user_id) \
                     .raise_(fastapi.status.HTTP_401_UNAUTHORIZED)
             
+            query = sqlalchemy.select(SQLChatRoomUser.user_id) \
+                .where(SQLChatRoomUser.room_id == room_id)
+            member_ids = (await session.scalars(query)).all()
+
+            query = sqlalchemy.delete(SQLMessage) \
+                .where(SQLMessage.room_id == room_id)
+            await session.execute(query)
+
             query = sqlalchemy.delete(SQLChatRoom) \
                 .where(SQLChatRoom.id == room_id)
             await session.execute(query)
 
+            # members can't be found through the room once it's gone
+            session.add_all(
+                SQLChange(kind=ChangeKind.ROOM_DELETED, room_id=None, recipient_id=x, data={'room_id': room_id})
+                for x in member_ids)
+
             await session.commit()
+
+        await self._version_service.bump([
+            room_key(room_id),
+            room_members_key(room_id),
+            *(user_rooms_key(x) for x in member_ids)])
+        await self._archive_service.delete_room_archive(room_id)
     
-    async def get_room_users(self, room_id: int, offset: int, limit: int):
+    async def get_room_etag(self, room_id: int) -> str:
+        return await self._version_service.get_etag(
+            [room_key(room_id), room_members_key(room_id)],
+            presence=True)
+
+    async def get_room_users_etag(self, room_id: int) -> str:
+        return await self._version_service.get_etag(
+            [room_members_key(room_id)],
+            presence=True)
+
+    async def get_room_users(self,
+                             room_id: int,
+                             order: RoomUsersOrder,
+                             limit: int,
+                             cursor: str | None = None,
+                             offset: int = 0) -> APIChatRoomUserPage:
+        (rows, next_cursor) = await self.get_room_user_rows(room_id, order, limit, cursor, offset)
+        return APIChatRoomUserPage(
+            users=[APIChatRoomUser.model_validate(x) for x in rows],
+            next_cursor=next_cursor)
+
+    async def get_room_user_rows(self,
+                                 room_id: int,
+                                 order: RoomUsersOrder,
+                                 limit: int,
+                                 cursor: str | None = None,
+                                 offset: int = 0) -> tuple[typing.Sequence[sqlalchemy.Row], str | None]:
+        '''
+        Retrieves a page of room members and cursor of the next page (`None` on the last page).
+        The cursor holds sort key of the last returned member, so following pages are
+        read straight from an index instead of skipping `offset` rows.
+        '''
+
         async with self._db_sessionmaker() as session:
+            return await self._get_room_user_rows_session(session, room_id, order, limit, cursor, offset)
+    
+    async def get_last_room_messages(self,
+                                     room_id: int,
+                                     offset: int,
+                                     limit: int,
+                                     before: datetime.datetime | None = None,
+                                     before_id: int | None = None) -> list[RoomMessage]:
+        return [
+            RoomMessage.model_validate(x)
+            for x
+            in await self.get_last_room_message_rows(room_id, offset, limit, before, before_id)]
+
+    async def get_last_room_message_rows(self,
+                                         room_id: int,
+                                         offset: int,
+                                         limit: int,
+                                         before: datetime.datetime | None = None,
+                                         before_id: int | None = None) -> list[sqlalchemy.Row | RoomMessage]:
+        '''
+        Retrieves room messages, newest first. `before` and `before_id` are the `sent_at`
+        and ID of the oldest message already fetched; using them instead of `offset` lets
+        the database skip partitions holding newer messages. Once the database runs out
+        of messages the rest is read from the room archive.
+        '''
+
+        async with self._db_sessionmaker() as session:
+            conditions = [SQLMessage.room_id == room_id]
+            if before is not None:
+                # plain range on the partitioning column is what allows pruning,
+                # the row comparison only breaks ties within the same second
+                conditions.append(SQLMessage.sent_at <= before)
+                if before_id is not None:
+                    conditions.append(
+                        sqlalchemy.tuple_(SQLMessage.sent_at, SQLMessage.id) < (before, before_id))
+                else:
+                    conditions.append(SQLMessage.sent_at < before)
+
             query = sqlalchemy.select(
-                SQLChatRoomUser.user_id,
-                SQLUser.username,
-                SQLUser.activity_status,
-                SQLUser.last_active,
-                sqlalchemy.func.if_(
-                    SQLChatRoomUser.user_id == SQLChatRoom.owner_id,
-                    True,
-                    False).label('is_owner')) \
-                .join(SQLChatRoom, SQLChatRoom.id == SQLChatRoomUser.room_id) \
-                .join(SQLUser, SQLUser.id == SQLChatRoomUser.user_id) \
-                .where(SQLChatRoomUser.room_id == room_id) \
+                SQLMessage.id,
+                SQLMessage.type,
+                SQLMessage.content,
+                SQLMessage.sent_at,
+                SQLUser.id.label('sender_id'),
+                SQLUser.username.label('sender_username')) \
+                .join(SQLUser, SQLUser.id == SQLMessage.sender_id) \
+                .where(*conditions) \
+                .order_by(SQLMessage.sent_at.desc(), SQLMessage.id.desc()) \
                 .offset(offset) \
                 .limit(limit)
-            return [
-                APIChatRoomUser.model_validate(x)
-                for x
-                in await session.execute(query)]
-    
-    async def get_last_room_messages(self, room_id: int, offset: int, limit: int):
+            messages = list[sqlalchemy.Row | RoomMessage]((await session.execute(query)).all())
+
+            if len(messages) == limit or not self._archive_service.has_archive(room_id):
+                return messages
+
+            if messages:
+                archive_offset = 0
+                archive_before = message_key(messages[-1].sent_at, messages[-1].id)
+            else:
+                archive_offset = offset
+                if offset > 0:
+                    query = sqlalchemy.select(sqlalchemy.func.count()) \
+                        .select_from(SQLMessage) \
+                        .where(*conditions)
+                    archive_offset -= await session.scalar(query)
+                
+                archive_before = None
+                if before is not None:
+                    archive_before = message_key(before, before_id or 0)
+
+        messages.extend(
+            await self._archive_service.get_room_messages(
+                room_id,
+                archive_offset,
+                limit - len(messages),
+                archive_before))
+        
+        return messages
+
+    async def get_newest_message_id(self, room_id: int) -> int:
+        '''
+        Retrieves the highest message ID of the room, archived messages included, or 0
+        if it has no messages. Imported messages keep their old `sent_at`, so the newest
+        message by ID isn't necessarily the last one sent.
+        '''
+
+        async with self._db_sessionmaker() as session:
+            query = sqlalchemy.select(sqlalchemy.func.max(SQLMessage.id)) \
+                .where(SQLMessage.room_id == room_id)
+            newest_id = await session.scalar(query) or 0
+
+        return max(newest_id, await self._archive_service.get_newest_message_id(room_id))
+
+    async def export_room_messages(self, room_id: int) -> typing.AsyncIterator[ExportedRoomMessage]:
+        '''
+        Yields whole room history, oldest first, merged from the room archive and messages
+        still stored in the database, which are read through a server-side cursor. Messages
+        found in both (archiver stopped before deleting rows it had archived) are yielded once.
+        '''
+
+        archived = self._iter_archived_messages(room_id)
+
         async with self._db_sessionmaker() as session:
             query = sqlalchemy.select(
                 SQLMessage.id,
@@ -86,13 +244,25 @@ class RoomService:
                 SQLUser.username.label('sender_username')) \
                 .join(SQLUser, SQLUser.id == SQLMessage.sender_id) \
                 .where(SQLMessage.room_id == room_id) \
-                .order_by(SQLMessage.sent_at.desc()) \
-                .offset(offset) \
-                .limit(limit)
-            return [
-                RoomMessage.model_validate(x)
-                for x
-                in (await session.execute(query)).all()]
+                .order_by(SQLMessage.sent_at, SQLMessage.id) \
+                .execution_options(yield_per=_EXPORT_FETCH_SIZE)
+            rows = aiter(await session.stream(query))
+
+            archived_message = await anext(archived, None)
+            row = await anext(rows, None)
+            last_id = None
+            while archived_message is not None or row is not None:
+                if row is None or (
+                        archived_message is not None
+                        and (archived_message.sent_at, archived_message.id) <= (row.sent_at, row.id)):
+                    (message, archived_message) = (archived_message, await anext(archived, None))
+                else:
+                    (message, row) = (row, await anext(rows, None))
+
+                # both sources are ordered by the same key, so duplicates end up next to each other
+                if message.id != last_id:
+                    last_id = message.id
+                    yield self._to_exported_message(room_id, message)
 
     async def check_user_belongs_to(self, user_id: int, room_id: int):
         '''
@@ -101,16 +271,41 @@ class RoomService:
         :raises ErrorRoomUserNotJoined: If user doesn't belong to the specified room.
         '''
         
-        async with self._db_sessionmaker() as session:
-            query = sqlalchemy.select(
-                sqlalchemy.exists()
-                    .where(
-                        SQLChatRoomUser.room_id == room_id,
-                        SQLChatRoomUser.user_id == user_id))
-            row_exists = (await session.execute(query)).scalar_one()
-            if not row_exists:
-                ErrorRoomUserNotJoined(user_id=user_id, room_id=room_id) \
-                    .raise_(fastapi.status.HTTP_404_NOT_FOUND)
+        with tracer.start_as_current_span('room.check_user_belongs_to'):
+            async with self._db_sessionmaker() as session:
+                query = sqlalchemy.select(
+                    sqlalchemy.exists()
+                        .where(
+                            SQLChatRoomUser.room_id == room_id,
+                            SQLChatRoomUser.user_id == user_id))
+                row_exists = (await session.execute(query)).scalar_one()
+
+        if not row_exists:
+            ErrorRoomUserNotJoined(user_id=user_id, room_id=room_id) \
+                .raise_(fastapi.status.HTTP_404_NOT_FOUND)
+
+    async def check_user_belongs_to_cached(self, user_id: int, room_id: int) -> None:
+        '''
+        Same as `check_user_belongs_to`, for frequent calls (typing, read receipts).
+        Confirmed memberships are cached until the version of the user's room set changes,
+        which only costs a version lookup in memory or Redis.
+
+        :raises ErrorRoomUserNotJoined: If user doesn't belong to the specified room.
+        '''
+
+        (_, [rooms_version]) = await self._version_service.get_versions([user_rooms_key(user_id)])
+
+        key = (user_id, room_id)
+        if self._memberships.get(key) == rooms_version:
+            self._memberships.move_to_end(key)
+            return
+
+        await self.check_user_belongs_to(user_id, room_id)
+
+        self._memberships[key] = rooms_version
+        self._memberships.move_to_end(key)
+        if len(self._memberships) > _MEMBERSHIPS_CACHE_SIZE:
+            self._memberships.popitem(last=False)
 
     async def update_room(self,
                           room_id: int,
@@ -141,6 +336,8 @@ class RoomService:
                         .raise_(fastapi.status.HTTP_400_BAD_REQUEST)
 
                 room.type = type
+
+            session.add(SQLChange(kind=ChangeKind.ROOM_UPDATED, room_id=room_id, user_id=user_id))
             
             try:
                 await session.commit()
@@ -148,29 +345,43 @@ class RoomService:
                 ErrorRoomAlreadyExists(room_name=name) \
                     .raise_(fastapi.status.HTTP_409_CONFLICT)
 
-    async def get_room_by_id(self, room_id: int, users_order: RoomUsersOrder) -> APIChatRoom:
-        # TODO Implement room users ordering
+        await self._version_service.bump([room_key(room_id)])
+
+    async def get_room_by_id(self, room_id: int, users_order: RoomUsersOrder, users_limit: int) -> APIChatRoom:
+        '''
+        Retrieves room details with member count and the first `users_limit` members.
+        '''
+
         async with self._db_sessionmaker() as session:
-            query = (
-                sqlalchemy.select(SQLChatRoom)
+            query = sqlalchemy.select(
+                SQLChatRoom.id,
+                SQLChatRoom.name,
+                SQLChatRoom.description,
+                SQLChatRoom.type,
+                SQLChatRoom.created_at,
+                SQLChatRoom.member_count) \
                 .where(SQLChatRoom.id == room_id)
-                .options(
-                    sqlalchemy.orm.selectinload(SQLChatRoom.users)
-                        .selectinload(SQLChatRoomUser.user))
-            )
-
-            room = await session.scalar(query)
+            room = (await session.execute(query)).one_or_none()
 
             if room is None:
                 self._raise_room_not_found(room_id)
-            
+
+            (rows, next_cursor) = await self._get_room_user_rows_session(
+                session,
+                room_id,
+                users_order,
+                users_limit)
+
             return APIChatRoom(
                 id=room.id,
                 name=room.name,
                 description=room.description,
                 type=room.type,
                 created_at=room.created_at,
-                users=room.users)
+                member_count=room.member_count,
+                users=APIChatRoomUserPage(
+                    users=[APIChatRoomUser.model_validate(x) for x in rows],
+                    next_cursor=next_cursor))
         
     async def change_room_image(self, room_id: int, user_id: int, image_file: fastapi.UploadFile) -> None:
         async with self._db_sessionmaker() as session:
@@ -192,7 +403,7 @@ class RoomService:
         
         try:
             await self._process_and_save_image(image_file.file, image_path)
-        except Image.UnidentifiedImageError:
+        except imaging.InvalidImageError:
             ErrorImageInvalidType(image_file.content_type) \
                 .raise_(fastapi.status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
         except Exception:
@@ -200,15 +411,11 @@ class RoomService:
                 .raise_(fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     def _process_and_save_image(self, file: io.BytesIO, filepath: pathlib.Path):
-        return asyncio.to_thread(self._process_and_save_image_impl, file, filepath)
+        return metrics.to_thread('image', self._process_and_save_image_impl, file, filepath)
 
     def _process_and_save_image_impl(self, file: io.BytesIO, filepath: pathlib.Path) -> None:
-        with Image.open(file) as img:
-            img = img.resize(self._room_image_size, Image.Resampling.LANCZOS)
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            
-            img.save(filepath)
+        (content,) = imaging.render_jpegs(file, (self._room_image_size,), _ROOM_IMAGE_QUALITY)
+        filepath.write_bytes(content)
     
     async def create_room(self, owner_id: int, name: str, description: str | None, type: RoomType):
         async with self._db_sessionmaker(expire_on_commit=False) as session:
@@ -216,7 +423,8 @@ class RoomService:
                 name=name,
                 description=description,
                 type=type,
-                owner_id=owner_id)
+                owner_id=owner_id,
+                member_count=1)
             session.add(room)
 
             try:
@@ -239,6 +447,7 @@ class RoomService:
                 user_id=owner_id,
                 room_id=room.id)
             session.add(room_user)
+            session.add(SQLChange(kind=ChangeKind.ROOM_MEMBER, room_id=room.id, user_id=owner_id, data={'joined': True}))
 
             # NOTE No need to check integrity here because potential conflict already happens at previous insert.
             # NOTE If an error happens here the database is in invalid state already.
@@ -248,7 +457,9 @@ class RoomService:
             if not room_attachments_dir.exists():
                 os.mkdir(room_attachments_dir)
 
-            return room.id
+        await self._version_service.bump([user_rooms_key(owner_id)])
+
+        return room.id
     
     async def join_room(self, room_id: int, user_id: int):
         async with self._db_sessionmaker() as session:
@@ -272,7 +483,7 @@ class RoomService:
             session.add(room_user)
 
             try:
-                await session.commit()
+                await session.flush()
             except sqlalchemy.exc.IntegrityError:
                 await session.rollback()
 
@@ -280,7 +491,76 @@ class RoomService:
 
                 ErrorRoomAlreadyJoined(room_id=room_id, user_id=user_id) \
                     .raise_(fastapi.status.HTTP_409_CONFLICT)
-                
+
+            query = sqlalchemy.update(SQLChatRoom) \
+                .where(SQLChatRoom.id == room_id) \
+                .values(member_count=SQLChatRoom.member_count + 1)
+            await session.execute(query)
+            session.add(SQLChange(kind=ChangeKind.ROOM_MEMBER, room_id=room_id, user_id=user_id, data={'joined': True}))
+            await session.commit()
+
+        await self._version_service.bump([
+            room_members_key(room_id),
+            user_rooms_key(user_id)])
+
+    async def _get_room_user_rows_session(self,
+                                          session: AsyncSession,
+                                          room_id: int,
+                                          order: RoomUsersOrder,
+                                          limit: int,
+                                          cursor: str | None = None,
+                                          offset: int = 0) -> tuple[typing.Sequence[sqlalchemy.Row], str | None]:
+        is_owner = sqlalchemy.func.if_(
+            SQLChatRoomUser.user_id == SQLChatRoom.owner_id,
+            True,
+            False)
+        sort_key = _get_room_users_sort_key(order, is_owner)
+
+        query = sqlalchemy.select(
+            SQLChatRoomUser.user_id,
+            SQLChatRoomUser.joined_at,
+            SQLUser.username,
+            SQLUser.activity_status,
+            SQLUser.last_active,
+            SQLUser.profile_picture_hash,
+            is_owner.label('is_owner')) \
+            .join(SQLChatRoom, SQLChatRoom.id == SQLChatRoomUser.room_id) \
+            .join(SQLUser, SQLUser.id == SQLChatRoomUser.user_id) \
+            .where(SQLChatRoomUser.room_id == room_id) \
+            .order_by(*(column.desc() if descending else column for (_, column, descending) in sort_key)) \
+            .offset(offset) \
+            .limit(limit + 1)
+
+        if cursor is not None:
+            query = query.where(_after_cursor(sort_key, _decode_cursor(cursor, order, sort_key)))
+
+        # one extra row tells whether there is a next page
+        rows = (await session.execute(query)).all()
+        if len(rows) <= limit:
+            return (rows, None)
+
+        rows = rows[:limit]
+        return (rows, _encode_cursor(order, [getattr(rows[-1], name) for (name, _, _) in sort_key]))
+
+    async def _iter_archived_messages(self, room_id: int) -> typing.AsyncIterator[RoomMessage]:
+        async for chunk in self._archive_service.iter_room_messages(room_id):
+            for message in chunk:
+                yield message
+
+    def _to_exported_message(self, room_id: int, message: RoomMessage | sqlalchemy.Row) -> ExportedRoomMessage:
+        attachment_url = None
+        if message.type != MessageType.TEXT:
+            attachment_url = f'/room/{room_id}/attachments/{message.content}'
+
+        return ExportedRoomMessage(
+            id=message.id,
+            type=message.type,
+            content=message.content,
+            sent_at=message.sent_at,
+            sender_id=message.sender_id,
+            sender_username=message.sender_username,
+            attachment_url=attachment_url)
+
     def _get_room_image_path(self, room_id: int) -> pathlib.Path:
         return self._room_images_directory / f'{room_id}.jpg'
     
@@ -306,4 +586,47 @@ class RoomService:
             .select_from(SQLChatRoomUser) \
             .where(SQLChatRoomUser.room_id == room_id) \
             .join(SQLUser, SQLUser.id == SQLChatRoomUser.user_id)
-        return [APIUserForeign.model_validate(x) for x in await session.scalars(query)]
\ No newline at end of file
+        return [APIUserForeign.model_validate(x) for x in await session.scalars(query)]
+
+def _get_room_users_sort_key(order: RoomUsersOrder, is_owner: sqlalchemy.ColumnElement) -> _SortKey:
+    # usernames are unique, so the username index alone orders members deterministically
+    match order:
+        case RoomUsersOrder.USERNAME:
+            return [('username', SQLUser.username, False)]
+        case RoomUsersOrder.OWNERSHIP:
+            return [
+                ('is_owner', is_owner, True),
+                ('username', SQLUser.username, False)]
+        case RoomUsersOrder.JOIN_DATE:
+            return [
+                ('joined_at', SQLChatRoomUser.joined_at, False),
+                ('user_id', SQLChatRoomUser.user_id, False)]
+
+def _after_cursor(sort_key: _SortKey, values: list[typing.Any]) -> sqlalchemy.ColumnElement[bool]:
+    # (a, b) > (x, y) expanded by hand, since columns may be sorted in different directions
+    conditions = list[sqlalchemy.ColumnElement[bool]]()
+    for (i, (_, column, descending)) in enumerate(sort_key):
+        conditions.append(
+            sqlalchemy.and_(
+                *(sort_key[j][1] == values[j] for j in range(i)),
+                column < values[i] if descending else column > values[i]))
+
+    return sqlalchemy.or_(*conditions)
+
+def _encode_cursor(order: RoomUsersOrder, values: list[typing.Any]) -> str:
+    values = [x.isoformat() if isinstance(x, datetime.datetime) else x for x in values]
+    data = json.dumps([order.value, *values], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def _decode_cursor(cursor: str, order: RoomUsersOrder, sort_key: _SortKey) -> list[typing.Any]:
+    try:
+        (cursor_order, *values) = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if cursor_order != order.value or len(values) != len(sort_key):
+            raise ValueError(cursor)
+
+        return [
+            datetime.datetime.fromisoformat(value) if isinstance(column.type, sqlalchemy.DateTime) else value
+            for (value, (_, column, _)) in zip(values, sort_key)]
+    except (binascii.Error, TypeError, ValueError):
+        ErrorRoomUsersCursorInvalid(cursor=cursor) \
+            .raise_(fastapi.status.HTTP_400_BAD_REQUEST)
@@ -1,3 +1,4 @@
+import typing
 import sqlalchemy
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 
@@ -15,6 +16,20 @@ class SearchService:
                            phrase: str,
                            limit: int,
                            offset: int):
+        return APIUsersSearchResult(
+            query=phrase,
+            offset=offset,
+            limit=limit,
+            users=[
+                APIUserForeign.model_validate(x)
+                for x
+                in await self.search_user_rows(user_id, phrase, limit, offset)])
+
+    async def search_user_rows(self,
+                               user_id: int | None,
+                               phrase: str,
+                               limit: int,
+                               offset: int) -> typing.Sequence[sqlalchemy.Row]:
         async with self._db_sessionmaker() as session:
             query = (
                 sqlalchemy.select(
@@ -23,7 +38,8 @@ class SearchService:
                     SQLUser.accepts_friend_requests,
                     SQLUser.created_at,
                     SQLUser.last_active,
-                    SQLUser.activity_status)
+                    SQLUser.activity_status,
+                    SQLUser.profile_picture_hash)
                 .where(
                     SQLUser.username.ilike(f'%{phrase}%'),
                     SQLUser.id != user_id,
@@ -32,19 +48,27 @@ class SearchService:
                 .limit(limit)
                 .offset(offset)
             )
-            results = await session.execute(query)
-            results = results.all()
-            return APIUsersSearchResult(
-                query=phrase,
-                offset=offset,
-                limit=limit,
-                users=[APIUserForeign.model_validate(x) for x in results])
+            return (await session.execute(query)).all()
     
     async def search_rooms(self,
                            user_id: int | None,
                            phrase: str,
                            limit: int,
                            offset: int):
+        return APIRoomsSearchResult(
+            query=phrase,
+            offset=offset,
+            limit=limit,
+            rooms=[
+                APIChatRoomInfo.model_validate(x)
+                for x
+                in await self.search_room_rows(user_id, phrase, limit, offset)])
+
+    async def search_room_rows(self,
+                               user_id: int | None,
+                               phrase: str,
+                               limit: int,
+                               offset: int) -> typing.Sequence[sqlalchemy.Row]:
         async with self._db_sessionmaker() as session:
             query = (
                 sqlalchemy.select(
@@ -63,10 +87,4 @@ class SearchService:
                 .offset(offset)
                 .params(term=phrase)
             )
-            results = await session.execute(query)
-            results = results.all()
-            return APIRoomsSearchResult(
-                query=phrase,
-                offset=offset,
-                limit=limit,
-                rooms=[APIChatRoomInfo.model_validate(x) for x in results])
\ No newline at end of file
+            return (await session.execute(query)).all()
\ No newline at end of file
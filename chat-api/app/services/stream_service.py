@@ -0,0 +1,300 @@
+import asyncio
+import collections
+import heapq
+import logging
+import uuid
+import sqlalchemy
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from app.models.chat_room_user import SQLChatRoomUser
+from app.models.event import APIEvent
+from app.models.friend import SQLFriend
+from app.services.event_bus import EventBus, Subscription, presence_channel, room_channel
+
+_logger = logging.getLogger(__name__)
+
+# feeds only pass events on, their own subscription should never fall behind
+_FEED_MAX_PENDING = 4096
+
+StreamItem = tuple[str, APIEvent]
+'''
+Event ID (resume position) and the event
+'''
+
+class EventStream:
+    '''
+    Live events of one client connection. Up to `max_pending` events are buffered; a client
+    reading slower than events arrive is dropped and the stream ends with `overflowed` set.
+    '''
+
+    def __init__(self, service: 'StreamService', channels: tuple[str, ...], max_pending: int) -> None:
+        self._service = service
+        self._channels = channels
+        self._queue = asyncio.Queue[StreamItem | None](maxsize=max_pending)
+        self._closed = False
+        self.overflowed = False
+        self.start_id: str | None = None
+        '''
+        ID of the position the stream started at, sent with a reset
+        '''
+
+        self.reset = False
+        '''
+        Events after the resume position are not buffered anymore (or are from another worker),
+        the client has to catch up through `/sync`
+        '''
+
+    @property
+    def channels(self) -> tuple[str, ...]:
+        return self._channels
+
+    async def get(self, timeout: float | None = None) -> StreamItem | None:
+        '''
+        Waits for the next event. Returns `None` on timeout.
+
+        :raises StopAsyncIteration: If the stream was closed or dropped.
+        '''
+
+        try:
+            item = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        if item is None:
+            raise StopAsyncIteration
+
+        return item
+
+    def close(self) -> None:
+        if self._closed:
+            return
+
+        self._closed = True
+        self._service._detach(self)
+        self._wake()
+
+    def _deliver(self, item: StreamItem) -> None:
+        if self._closed:
+            return
+
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.close()
+
+    def _wake(self) -> None:
+        # make room for the end-of-stream marker, pending events are useless once closed
+        while self._queue.full():
+            self._queue.get_nowait()
+
+        self._queue.put_nowait(None)
+
+class _ChannelFeed:
+    def __init__(self, subscription: Subscription, start_seq: int, replay_size: int) -> None:
+        self.subscription = subscription
+        self.events = collections.deque[tuple[int, APIEvent]](maxlen=replay_size)
+        self.complete_after = start_seq
+        '''
+        Every event with a higher sequence number is still buffered
+        '''
+
+        self.streams = set[EventStream]()
+        self.pump_task: asyncio.Task | None = None
+        self.release_handle: asyncio.TimerHandle | None = None
+
+class StreamService:
+    '''
+    Room and presence events for clients that can't use websockets (Server-Sent Events).
+    The worker subscribes to each channel once, no matter how many connections watch it,
+    and keeps the last `replay_size` events of the channel so a client reconnecting with
+    its last event ID misses nothing. A channel stays subscribed for `linger` seconds after
+    its last connection closes to cover the reconnect. Event IDs are only known to the worker
+    that assigned them, resuming elsewhere (or past the buffer) resets the stream instead.
+    '''
+
+    def __init__(self,
+                 db_sessionmaker: async_sessionmaker[AsyncSession],
+                 event_bus: EventBus,
+                 replay_size: int,
+                 max_pending: int,
+                 linger: float) -> None:
+        self._db_sessionmaker = db_sessionmaker
+        self._event_bus = event_bus
+        self._replay_size = replay_size
+        self._max_pending = max_pending
+        self._linger = linger
+        self._instance_id = uuid.uuid4().hex[:12]
+        self._seq = 0
+        self._feeds = dict[str, _ChannelFeed]()
+
+    async def open_stream(self, user_id: int, last_event_id: str | None = None) -> EventStream:
+        '''
+        Opens stream of events from the user's rooms and friends' presence, starting after
+        `last_event_id` when given. Room and friend changes made afterwards are picked up
+        by reconnecting.
+        '''
+
+        channels = await self._get_user_channels(user_id)
+        stream = EventStream(self, channels, self._max_pending)
+        acquired_channels = list[str]()
+        try:
+            for channel in channels:
+                await self._acquire_feed(channel)
+                acquired_channels.append(channel)
+        except BaseException:
+            # no stream holds them yet, they would stay subscribed forever
+            for channel in acquired_channels:
+                self._schedule_release(channel)
+
+            raise
+
+        # no awaits from here on, so no event is both replayed and delivered live
+        stream.start_id = self._event_id(self._seq)
+        if last_event_id is not None:
+            replay = self._get_replay(channels, last_event_id)
+            if replay is None or len(replay) > self._max_pending:
+                stream.reset = True
+            else:
+                for item in replay:
+                    stream._deliver(item)
+
+        for channel in channels:
+            self._attach(channel, stream)
+
+        return stream
+
+    async def close(self) -> None:
+        (feeds, self._feeds) = (list(self._feeds.values()), {})
+        for feed in feeds:
+            for stream in tuple(feed.streams):
+                stream.close()
+
+            await self._shutdown_feed(feed)
+
+    async def _get_user_channels(self, user_id: int) -> tuple[str, ...]:
+        async with self._db_sessionmaker() as session:
+            query = sqlalchemy.select(SQLChatRoomUser.room_id) \
+                .where(SQLChatRoomUser.user_id == user_id)
+            room_ids = (await session.scalars(query)).all()
+            query = sqlalchemy.select(SQLFriend.friend_id) \
+                .where(SQLFriend.user_id == user_id)
+            friend_ids = (await session.scalars(query)).all()
+
+        return (*(room_channel(x) for x in room_ids), *(presence_channel(x) for x in friend_ids))
+
+    def _get_replay(self, channels: tuple[str, ...], last_event_id: str) -> list[StreamItem] | None:
+        (instance_id, _, last_seq) = last_event_id.partition(':')
+        if instance_id != self._instance_id or not last_seq.isdigit():
+            return None
+
+        last_seq = int(last_seq)
+        replays = list[list[tuple[int, APIEvent]]]()
+        for channel in channels:
+            feed = self._feeds.get(channel)
+            if feed is None or feed.complete_after > last_seq:
+                return None
+
+            replays.append([x for x in feed.events if x[0] > last_seq])
+
+        return [(self._event_id(seq), event) for (seq, event) in heapq.merge(*replays, key=lambda x: x[0])]
+
+    async def _acquire_feed(self, channel: str) -> None:
+        feed = self._feeds.get(channel)
+        if feed is not None:
+            self._cancel_release(feed)
+            return
+
+        subscription = await self._event_bus.subscribe([channel], _FEED_MAX_PENDING)
+        if channel in self._feeds:
+            # another connection subscribed meanwhile
+            self._cancel_release(self._feeds[channel])
+            await subscription.close()
+            return
+
+        feed = _ChannelFeed(subscription, self._seq, self._replay_size)
+        feed.pump_task = asyncio.create_task(self._pump(channel, feed))
+        self._feeds[channel] = feed
+
+    def _attach(self, channel: str, stream: EventStream) -> None:
+        feed = self._feeds.get(channel)
+        if feed is None:
+            # feed fell behind while the stream was being opened
+            stream.overflowed = True
+            stream.close()
+            return
+
+        self._cancel_release(feed)
+        feed.streams.add(stream)
+
+    def _detach(self, stream: EventStream) -> None:
+        for channel in stream.channels:
+            feed = self._feeds.get(channel)
+            if feed is None or stream not in feed.streams:
+                continue
+
+            feed.streams.discard(stream)
+            self._schedule_release(channel)
+
+    def _schedule_release(self, channel: str) -> None:
+        feed = self._feeds.get(channel)
+        if feed is None or feed.streams:
+            return
+
+        self._cancel_release(feed)
+        feed.release_handle = asyncio.get_running_loop().call_later(
+            self._linger,
+            self._release_feed,
+            channel,
+            feed)
+
+    def _cancel_release(self, feed: _ChannelFeed) -> None:
+        if feed.release_handle is not None:
+            feed.release_handle.cancel()
+            feed.release_handle = None
+
+    def _release_feed(self, channel: str, feed: _ChannelFeed) -> None:
+        # runs synchronously, so a connection being opened either finds the feed or subscribes anew
+        feed.release_handle = None
+        if self._feeds.get(channel) is not feed or feed.streams:
+            return
+
+        del self._feeds[channel]
+        asyncio.create_task(self._shutdown_feed(feed))
+
+    async def _shutdown_feed(self, feed: _ChannelFeed) -> None:
+        self._cancel_release(feed)
+        if feed.pump_task is not None:
+            feed.pump_task.cancel()
+            try:
+                await feed.pump_task
+            except asyncio.CancelledError:
+                pass
+
+        await feed.subscription.close()
+
+    async def _pump(self, channel: str, feed: _ChannelFeed) -> None:
+        async for (_, event) in feed.subscription:
+            self._seq += 1
+            if len(feed.events) == feed.events.maxlen:
+                feed.complete_after = feed.events[0][0]
+
+            feed.events.append((self._seq, event))
+
+            item = (self._event_id(self._seq), event)
+            # copy as delivery may drop overflowing streams
+            for stream in tuple(feed.streams):
+                stream._deliver(item)
+
+        # dropped by the bus, events are missing from here on
+        _logger.warning('Event feed of channel %s fell behind, dropping its streams', channel)
+        self._cancel_release(feed)
+        if self._feeds.get(channel) is feed:
+            del self._feeds[channel]
+
+        for stream in tuple(feed.streams):
+            stream.overflowed = True
+            stream.close()
+
+    def _event_id(self, seq: int) -> str:
+        return f'{self._instance_id}:{seq}'
@@ -0,0 +1,182 @@
+import asyncio
+import datetime
+import logging
+import sqlalchemy
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from app import database
+from app.models.change_log import APIChange, APISync, APISyncMessage, ChangeKind, SQLChange
+from app.models.chat_room_user import SQLChatRoomUser
+from app.models.friend import SQLFriend
+from app.models.message import SQLMessage
+from app.models.user import SQLUser
+
+_logger = logging.getLogger(__name__)
+
+_MAX_LIMIT = 1000
+# changes are only handed out once transactions that got lower IDs had time to commit,
+# otherwise a client could move past a change that becomes visible later. `created_at` is
+# the time of the insert, not of the commit; changes are inserted right before commit, so
+# this only has to cover commit latency and is far above it.
+_SETTLE_INTERVAL = sqlalchemy.text('INTERVAL 5 SECOND')
+_PRUNE_LOCK_NAME = 'chat_api_change_log_pruning'
+_PRUNE_INTERVAL = 60 * 60
+_PRUNE_BATCH_SIZE = 10000
+
+class SyncService:
+    '''
+    Delta sync for reconnecting clients. Changes are appended to the change log in the same
+    transaction as the change itself and a client asks for everything after the last position
+    it has seen, so catching up costs a single range scan instead of refetching every room.
+    New messages are logged once per room and writer batch and fetched by ID range.
+    Changes older than `retention_days` are pruned, clients that were away longer are told
+    to reset and fetch their whole state again. Commit order isn't observable, so changes are
+    held back for a few seconds instead; a transaction committing later than that after logging
+    a change can still be skipped by clients already past it.
+    '''
+
+    def __init__(self,
+                 db_sessionmaker: async_sessionmaker[AsyncSession],
+                 retention_days: int) -> None:
+        self._db_sessionmaker = db_sessionmaker
+        self._retention_days = retention_days
+        self._prune_task: asyncio.Task | None = None
+
+    def start_prune_task(self) -> None:
+        assert self._prune_task is None, 'Prune task already running'
+        self._prune_task = asyncio.create_task(self._prune_loop())
+
+    async def shutdown_prune_task(self) -> None:
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+            try:
+                await self._prune_task
+            except asyncio.CancelledError:
+                pass
+
+            self._prune_task = None
+
+    async def get_changes(self, user_id: int, since: int | None, limit: int) -> APISync:
+        '''
+        Retrieves up to `limit` changes visible to the user after position `since`, along
+        with messages they announce. Without `since`, or when changes after it were already
+        pruned, only the current position is returned with `reset` set.
+        '''
+
+        limit = max(1, min(limit, _MAX_LIMIT))
+        settled = SQLChange.created_at <= sqlalchemy.func.date_sub(sqlalchemy.func.now(), _SETTLE_INTERVAL)
+
+        async with self._db_sessionmaker() as session:
+            if since is None or await self._is_pruned_session(since, session):
+                query = sqlalchemy.select(sqlalchemy.func.max(SQLChange.id)).where(settled)
+                token = await session.scalar(query) or 0
+
+                return APISync(token=token, reset=True, has_more=False, changes=[], messages=[])
+
+            joined_rooms = sqlalchemy.select(SQLChatRoomUser.room_id) \
+                .where(SQLChatRoomUser.user_id == user_id)
+            friends = sqlalchemy.select(SQLFriend.friend_id) \
+                .where(SQLFriend.user_id == user_id)
+
+            query = sqlalchemy.select(SQLChange) \
+                .where(
+                    SQLChange.id > since,
+                    settled,
+                    sqlalchemy.or_(
+                        SQLChange.room_id.in_(joined_rooms),
+                        SQLChange.recipient_id == user_id,
+                        sqlalchemy.and_(
+                            SQLChange.kind == ChangeKind.PRESENCE,
+                            SQLChange.user_id.in_(friends)))) \
+                .order_by(SQLChange.id) \
+                .limit(limit + 1)
+            changes = list((await session.scalars(query)).all())
+
+            has_more = len(changes) > limit
+            changes = changes[:limit]
+            messages = await self._get_messages_session(
+                [x for x in changes if x.kind == ChangeKind.ROOM_MESSAGES],
+                session)
+
+        return APISync(
+            token=changes[-1].id if changes else since,
+            reset=False,
+            has_more=has_more,
+            changes=[APIChange.model_validate(x) for x in changes],
+            messages=messages)
+
+    async def prune(self) -> int:
+        '''
+        Deletes changes older than the retention period, always keeping the newest one so
+        positions stay comparable. Returns number of deleted changes.
+        '''
+
+        async with database.named_lock_session(self._db_sessionmaker, _PRUNE_LOCK_NAME) as session:
+            if session is None:
+                _logger.debug('Change log pruning is already running in another worker')
+                return 0
+
+            last_id = await session.scalar(sqlalchemy.select(sqlalchemy.func.max(SQLChange.id)))
+            if last_id is None:
+                return 0
+
+            cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) \
+                - datetime.timedelta(days=self._retention_days)
+            # small batches keep row locks short, writers append to the log all the time
+            query = sqlalchemy.delete(SQLChange) \
+                .where(SQLChange.created_at < cutoff, SQLChange.id < last_id) \
+                .with_dialect_options(mysql_limit=_PRUNE_BATCH_SIZE)
+
+            deleted = 0
+            while True:
+                result = await session.execute(query)
+                await session.commit()
+
+                deleted += result.rowcount
+                if result.rowcount < _PRUNE_BATCH_SIZE:
+                    return deleted
+
+    async def _prune_loop(self) -> None:
+        while True:
+            try:
+                deleted = await self.prune()
+                if deleted:
+                    _logger.info('Pruned %d changes from change log', deleted)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _logger.exception('Change log pruning failed')
+
+            await asyncio.sleep(_PRUNE_INTERVAL)
+
+    async def _is_pruned_session(self, since: int, session: AsyncSession) -> bool:
+        # IDs of rolled back transactions leave gaps too, those only cause needless resets
+        first_id = await session.scalar(sqlalchemy.select(sqlalchemy.func.min(SQLChange.id)))
+        return first_id is not None and since < first_id - 1
+
+    async def _get_messages_session(self,
+                                    changes: list[SQLChange],
+                                    session: AsyncSession) -> list[APISyncMessage]:
+        if not changes:
+            return []
+
+        # `sent_at` is the same for the whole batch, it lets MySQL prune partitions
+        query = sqlalchemy.select(
+            SQLMessage.id,
+            SQLMessage.room_id,
+            SQLMessage.type,
+            SQLMessage.content,
+            SQLMessage.sent_at,
+            SQLUser.id.label('sender_id'),
+            SQLUser.username.label('sender_username')) \
+            .join(SQLUser, SQLUser.id == SQLMessage.sender_id) \
+            .where(
+                sqlalchemy.or_(*(
+                    sqlalchemy.and_(
+                        SQLMessage.room_id == x.room_id,
+                        SQLMessage.sent_at == datetime.datetime.fromisoformat(x.data['sent_at']),
+                        SQLMessage.id.between(x.data['first_id'], x.data['last_id']))
+                    for x in changes))) \
+            .order_by(SQLMessage.id)
+
+        return [APISyncMessage.model_validate(x) for x in (await session.execute(query)).all()]
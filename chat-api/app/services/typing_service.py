@@ -0,0 +1,73 @@
+import collections
+import logging
+import time
+
+from app.models.event import APIEvent, EventType
+from app.services.event_bus import EventBus, room_channel
+from app.services.room_service import RoomService
+
+_logger = logging.getLogger(__name__)
+
+class TypingService:
+    '''
+    Ephemeral "user is typing" signals, never stored. While a user keeps typing, a signal is
+    broadcast to the room channel at most once per `broadcast_interval`, signals in between
+    only hit memory of the worker. Clients consider the user done typing once `expire_time`
+    (sent with the event) passes without another signal, so nothing has to be cleaned up
+    when a client just goes away.
+    '''
+
+    def __init__(self,
+                 room_service: RoomService,
+                 event_bus: EventBus,
+                 broadcast_interval: float,
+                 expire_time: float) -> None:
+        assert broadcast_interval < expire_time, 'Typing signal would expire before it is repeated'
+
+        self._room_service = room_service
+        self._event_bus = event_bus
+        self._broadcast_interval = broadcast_interval
+        self._expire_time = expire_time
+        # (room ID, user ID) -> time of the last broadcast, oldest first
+        self._broadcasts = collections.OrderedDict[tuple[int, int], float]()
+
+    async def set_typing(self, user_id: int, room_id: int, is_typing: bool) -> None:
+        '''
+        Signals that the user is (or stopped) typing in the room.
+
+        :raises ErrorRoomUserNotJoined: If user doesn't belong to the room.
+        '''
+
+        key = (room_id, user_id)
+        now = time.monotonic()
+        self._expire_broadcasts(now)
+
+        if is_typing and key in self._broadcasts:
+            return
+
+        await self._room_service.check_user_belongs_to_cached(user_id, room_id)
+
+        if is_typing:
+            self._broadcasts[key] = now
+        else:
+            # sent even when this worker didn't broadcast the start, another one might have
+            self._broadcasts.pop(key, None)
+
+        event = APIEvent(
+            type=EventType.TYPING,
+            room_id=room_id,
+            user_id=user_id,
+            data={'typing': is_typing, 'expires_in': self._expire_time if is_typing else 0})
+        try:
+            await self._event_bus.publish(room_channel(room_id), event)
+        except Exception:
+            _logger.exception('Failed to publish typing event for room %d', room_id)
+
+    def _expire_broadcasts(self, now: float) -> None:
+        # broadcasts are kept in order they were made, only the oldest ones can expire
+        while self._broadcasts:
+            (key, broadcast_at) = next(iter(self._broadcasts.items()))
+            if now - broadcast_at < self._broadcast_interval:
+                break
+
+            del self._broadcasts[key]
@@ -1,35 +1,64 @@
+import collections
 import datetime
-import asyncio
-import os
-import pathlib
+import logging
 import fastapi
 import typing as t
 import sqlalchemy
 import sqlalchemy.orm
-from PIL import Image
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+from app import imaging
 from app.models.errors import ErrorFriendRequestNotFound, ErrorImageInvalidType, ErrorFileSaveFailed, ErrorSelfFriendRequest, ErrorUserNotFoundID
-from app.models.user import SQLUser, UserActivityStatus
+from app.models.user import INACTIVE_AFTER, SQLUser, UserActivityStatus
 from app.models.friend_request import APIFriendRequest, SQLFriendRequest
 from app.models.friend import APIFriend, SQLFriend, APIFriendActivity
 from app.models.chat_room import APIUserChatRoom, SQLChatRoom
 from app.models.chat_room_user import SQLChatRoomUser
+from app.models.change_log import ChangeKind, SQLChange
+from app.models.message import RoomMessage, SQLMessage
+from app.models.event import APIEvent, EventType
+from app.services.avatar_service import AvatarService
+from app.services.event_bus import EventBus, presence_channel
+from app.services.version_service import VersionService, friends_key, room_key, room_members_key, room_messages_key, user_rooms_key
+
+_logger = logging.getLogger(__name__)
+
+_USER_ROOM_IDS_CACHE_SIZE = 10000
 
 class UserService:
     def __init__(self,
                  db_session_factory: async_sessionmaker[AsyncSession],
-                 data_directory: pathlib.Path,
-                 profile_picture_size: int) -> None:
+                 avatar_service: AvatarService,
+                 event_bus: EventBus,
+                 version_service: VersionService) -> None:
         self._db_session_factory = db_session_factory
-        self._profile_pictures_directory = data_directory / 'profile_pictures'
-        self._profile_picture_size = profile_picture_size
-
-        if not self._profile_pictures_directory.exists():
-            os.makedirs(self._profile_pictures_directory)
+        self._avatar_service = avatar_service
+        self._event_bus = event_bus
+        self._version_service = version_service
+        self._user_room_ids = collections.OrderedDict[int, tuple[int, tuple[int, ...]]]()
 
     async def get_user(self, user_id: int) -> SQLUser:
         return await self._get_user_by_id(user_id)
     
+    async def get_user_rows(self, user_ids: t.Collection[int]) -> t.Sequence[sqlalchemy.Row]:
+        '''
+        Retrieves public information of multiple users in one query, missing users are skipped.
+        '''
+
+        if not user_ids:
+            return []
+
+        async with self._db_session_factory() as session:
+            query = sqlalchemy.select(
+                SQLUser.id,
+                SQLUser.username,
+                SQLUser.accepts_friend_requests,
+                SQLUser.created_at,
+                SQLUser.last_active,
+                SQLUser.activity_status,
+                SQLUser.profile_picture_hash) \
+                .where(SQLUser.id.in_(user_ids))
+            return (await session.execute(query)).all()
+
     async def get_user_email_info(self, user_id: int) -> tuple[str, bool]:
         async with self._db_session_factory() as session:
             query = sqlalchemy.select(SQLUser.email, SQLUser.is_email_verified) \
@@ -49,6 +78,7 @@ class UserService:
         async with self._db_session_factory() as session:
             request = SQLFriendRequest(sender_id=id_from, receiver_id=id_to)
             session.add(request)
+            session.add_all(_friend_request_changes(id_from, id_to, 'SENT'))
 
             # TODO Check integrity error (user does not exist, request already sent)
             await session.commit()
@@ -70,25 +100,108 @@ class UserService:
                 session.add(SQLFriend(user_id=from_id, friend_id=user_id))
                 
             await session.delete(friend_request)
+            session.add_all(_friend_request_changes(from_id, user_id, 'ACCEPTED' if accept else 'DECLINED'))
 
             await session.commit()
+
+        if accept:
+            await self._version_service.bump([friends_key(user_id), friends_key(from_id)])
     
+    async def get_user_rooms_etag(self, user_id: int) -> str:
+        '''
+        Creates ETag of the user room list. Room set of the user is cached, so unless
+        the user joined or left a room no database query is needed.
+        '''
+
+        (_, (rooms_version,)) = await self._version_service.get_versions([user_rooms_key(user_id)])
+
+        cached = self._user_room_ids.get(user_id)
+        if cached is not None and cached[0] == rooms_version:
+            room_ids = cached[1]
+            self._user_room_ids.move_to_end(user_id)
+        else:
+            async with self._db_session_factory() as session:
+                query = sqlalchemy.select(SQLChatRoomUser.room_id) \
+                    .where(SQLChatRoomUser.user_id == user_id) \
+                    .order_by(SQLChatRoomUser.room_id)
+                room_ids = tuple((await session.scalars(query)).all())
+
+            self._user_room_ids[user_id] = (rooms_version, room_ids)
+            if len(self._user_room_ids) > _USER_ROOM_IDS_CACHE_SIZE:
+                self._user_room_ids.popitem(last=False)
+
+        keys = [user_rooms_key(user_id)]
+        for room_id in room_ids:
+            keys.append(room_key(room_id))
+            keys.append(room_members_key(room_id))
+            keys.append(room_messages_key(room_id))
+
+        return await self._version_service.get_etag(keys)
+
+    async def get_user_friends_etag(self, user_id: int) -> str:
+        return await self._version_service.get_etag([friends_key(user_id)], presence=True)
+
     async def get_user_rooms(self, user_id: int) -> list[APIUserChatRoom]:
+        '''
+        Retrieves rooms of the user with their last message in a single query. Cost grows
+        with the number of rooms only: last message of every room is a single lookup in
+        the `(room_id, sent_at)` index and member count is stored with the room.
+        '''
+
         async with self._db_session_factory() as session:
-            await self._ensure_user_exists_session(user_id, session)
+            sender = sqlalchemy.orm.aliased(SQLUser)
+            last_message = sqlalchemy.select(
+                SQLMessage.id,
+                SQLMessage.type,
+                SQLMessage.content,
+                SQLMessage.sent_at,
+                SQLMessage.sender_id,
+                sender.username.label('sender_username')) \
+                .join(sender, sender.id == SQLMessage.sender_id) \
+                .where(SQLMessage.room_id == SQLChatRoom.id) \
+                .order_by(SQLMessage.sent_at.desc(), SQLMessage.id.desc()) \
+                .limit(1) \
+                .correlate(SQLChatRoom) \
+                .lateral('last_message')
+
+            # starting from the user row tells a user without rooms from a missing user
+            query = sqlalchemy.select(
+                SQLChatRoom.id,
+                SQLChatRoom.type,
+                SQLChatRoom.name,
+                SQLChatRoom.member_count,
+                last_message.c.id.label('last_message_id'),
+                last_message.c.type.label('last_message_type'),
+                last_message.c.content.label('last_message_content'),
+                last_message.c.sent_at.label('last_message_sent_at'),
+                last_message.c.sender_id.label('last_message_sender_id'),
+                last_message.c.sender_username.label('last_message_sender_username')) \
+                .select_from(SQLUser) \
+                .outerjoin(SQLChatRoomUser, SQLChatRoomUser.user_id == SQLUser.id) \
+                .outerjoin(SQLChatRoom, SQLChatRoom.id == SQLChatRoomUser.room_id) \
+                .outerjoin(last_message, sqlalchemy.true()) \
+                .where(SQLUser.id == user_id)
+
+            rows = (await session.execute(query)).all()
+            if not rows:
+                self._raise_user_not_found(user_id)
 
-            query = (
-                sqlalchemy.select(SQLChatRoom)
-                    .select_from(SQLChatRoomUser)
-                    .join(SQLChatRoom, SQLChatRoom.id == SQLChatRoomUser.room_id)
-                    .where(SQLChatRoomUser.user_id == user_id)
-                    .options(sqlalchemy.orm.selectinload(SQLChatRoom.last_message))
-            )
-            
             return [
-                APIUserChatRoom.model_validate(x)
+                APIUserChatRoom(
+                    id=x.id,
+                    type=x.type,
+                    name=x.name,
+                    member_count=x.member_count,
+                    last_message=None if x.last_message_id is None else RoomMessage(
+                        id=x.last_message_id,
+                        type=x.last_message_type,
+                        content=x.last_message_content,
+                        sent_at=x.last_message_sent_at,
+                        sender_id=x.last_message_sender_id,
+                        sender_username=x.last_message_sender_username))
                 for x
-                in await session.scalars(query)]
+                in rows
+                if x.id is not None]
     
     async def get_user_friends_activity(self, user_id: int) -> list[APIFriendActivity]:
         async with self._db_session_factory() as session:
@@ -108,33 +221,41 @@ class UserService:
             return [APIFriendActivity.model_validate(x) for x in rows]
         
     async def get_user_friends(self, user_id: int) -> list[APIFriend]:
+        return [APIFriend.model_validate(x) for x in await self.get_user_friend_rows(user_id)]
+
+    async def get_user_friend_rows(self, user_id: int) -> t.Sequence[sqlalchemy.Row]:
         async with self._db_session_factory() as session:
-            self._ensure_user_exists_session(user_id, session)
+            await self._ensure_user_exists_session(user_id, session)
 
             query = sqlalchemy.select(
                 SQLUser.id.label('user_id'),
                 SQLUser.username,
                 SQLUser.last_active,
-                SQLUser.activity_status) \
+                SQLUser.activity_status,
+                SQLUser.profile_picture_hash) \
                 .join(SQLFriend, SQLFriend.friend_id == SQLUser.id) \
                 .where(SQLFriend.user_id == user_id) \
                 .order_by(SQLUser.activity_status)
-            results = (await session.execute(query)).all()
-
-            return [APIFriend.model_validate(x) for x in results]
+            return (await session.execute(query)).all()
     
-    async def get_user_profile_picture(self, user_id: int) -> bytes | None:
-        await self._ensure_user_exists(user_id)
+    async def get_user_profile_picture(self,
+                                       user_id: int,
+                                       size: int | None = None) -> tuple[str | None, bytes] | None:
+        '''
+        Retrieves hash and content of the current profile picture. Existence of the user
+        is only checked when there is no picture.
+        '''
 
-        profile_picture_path = self._get_profile_picture_path(user_id)
-        if profile_picture_path.exists():
-            return await self._read_profile_picture(profile_picture_path)
-        
-        return None
-    
-    def delete_user_profile_picture(self, user_id: int) -> None:
-        self._ensure_user_exists(user_id)
-        self._delete_user_profile_picture(user_id)
+        picture = await self._avatar_service.get_current(user_id, size)
+        if picture is None:
+            await self._ensure_user_exists(user_id)
+
+        return picture
+
+    async def delete_user_profile_picture(self, user_id: int) -> None:
+        await self._ensure_user_exists(user_id)
+        await self._avatar_service.delete(user_id)
+        await self._set_profile_picture_hash(user_id, None)
     
     async def change_user_activity_status(self,
                                           user_id: int,
@@ -148,9 +269,28 @@ class UserService:
             await session.flush()
             await session.refresh(user)
 
+            session.add(SQLChange(
+                kind=ChangeKind.PRESENCE,
+                user_id=user_id,
+                data={
+                    'activity_status': user.activity_status,
+                    'last_active': user.last_active.isoformat(),
+                    'expires_at': (user.last_active + INACTIVE_AFTER).isoformat()}))
+
             await session.commit()
+
+            await self._bump_user_lists_session(user_id, session)
+
+        event = APIEvent(
+            type=EventType.PRESENCE,
+            user_id=user_id,
+            data={'activity_status': user.activity_status, 'last_active': user.last_active})
+        try:
+            await self._event_bus.publish(presence_channel(user_id), event)
+        except Exception:
+            _logger.exception('Failed to publish presence event for user %d', user_id)
             
-            return (user.activity_status, user.last_active)
+        return (user.activity_status, user.last_active)
         
     async def refresh_user_activity(self, user_id: int, now: datetime.datetime) -> None:
         async with self._db_session_factory() as session:
@@ -159,29 +299,43 @@ class UserService:
 
             await session.commit()
         
-    async def change_user_profile_picture(self, user_id: int, image_file: fastapi.UploadFile) -> None:
+    async def change_user_profile_picture(self, user_id: int, image_file: fastapi.UploadFile) -> str:
         await self._ensure_user_exists(user_id)
 
-        profile_picture_path = self._get_profile_picture_path(user_id)
-        if profile_picture_path.exists():
-            os.remove(profile_picture_path)
-
         try:
-            with Image.open(image_file.file) as img:
-                img = img.resize(
-                    size=(self._profile_picture_size, self._profile_picture_size),
-                    resample=Image.Resampling.LANCZOS)
-                
-                if img.mode in ('RGBA', 'P'):
-                    img = img.convert('RGB')
-                
-                img.save(profile_picture_path)
-        except Image.UnidentifiedImageError:
+            picture_hash = await self._avatar_service.save(user_id, image_file.file)
+        except imaging.InvalidImageError:
             ErrorImageInvalidType(image_file.content_type) \
                 .raise_(fastapi.status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
         except Exception:
             ErrorFileSaveFailed() \
                 .raise_(fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        await self._set_profile_picture_hash(user_id, picture_hash)
+        return picture_hash
+
+    async def _set_profile_picture_hash(self, user_id: int, picture_hash: str | None) -> None:
+        async with self._db_session_factory() as session:
+            query = sqlalchemy.update(SQLUser) \
+                .where(SQLUser.id == user_id) \
+                .values(profile_picture_hash=picture_hash)
+            await session.execute(query)
+            await session.commit()
+
+            await self._bump_user_lists_session(user_id, session)
+
+    async def _bump_user_lists_session(self, user_id: int, session: AsyncSession) -> None:
+        # friend lists and room member lists showing the user have to be fetched again
+        query = sqlalchemy.select(SQLFriend.user_id) \
+            .where(SQLFriend.friend_id == user_id)
+        friend_ids = (await session.scalars(query)).all()
+        query = sqlalchemy.select(SQLChatRoomUser.room_id) \
+            .where(SQLChatRoomUser.user_id == user_id)
+        room_ids = (await session.scalars(query)).all()
+
+        await self._version_service.bump([
+            *(friends_key(x) for x in friend_ids),
+            *(room_members_key(x) for x in room_ids)])
     
     async def get_user_friend_requests(self, user_id: int) -> list[APIFriendRequest]:
         async with self._db_session_factory() as session:
@@ -208,9 +362,6 @@ class UserService:
         async with self._db_session_factory() as session:
             await self._ensure_user_exists_session(user_id, session)
 
-    def _get_profile_picture_path(self, user_id: int) -> pathlib.Path:
-        return (self._profile_pictures_directory / str(user_id)).with_suffix('.jpg')
-
     async def _get_user_by_id_session(self, user_id: int, session: AsyncSession) -> SQLUser:
         query = sqlalchemy.Select(SQLUser).where(SQLUser.id == user_id)
         user = (await session.execute(query)).scalar_one_or_none()
@@ -227,14 +378,13 @@ class UserService:
     def _raise_user_not_found(self, user_id: int) -> t.NoReturn:
         ErrorUserNotFoundID(user_id=user_id) \
             .raise_(fastapi.status.HTTP_404_NOT_FOUND)
-        
-    async def _read_profile_picture(self, path: pathlib.Path):
-        return await asyncio.to_thread(path.read_bytes)
-        
-    async def _remove_profile_picture(self, path: pathlib.Path):
-        await asyncio.to_thread(os.remove, path)
 
-    async def _delete_user_profile_picture(self, user_id: int) -> None:
-        profile_picture_path = self._get_profile_picture_path(user_id)
-        if profile_picture_path.exists():
-            await self._remove_profile_picture(profile_picture_path)
\ No newline at end of file
+def _friend_request_changes(sender_id: int, receiver_id: int, state: str) -> list[SQLChange]:
+    # both sides have to learn about the request, `user_id` is the other side
+    return [
+        SQLChange(
+            kind=ChangeKind.FRIEND_REQUEST,
+            recipient_id=recipient_id,
+            user_id=user_id,
+            data={'sender_id': sender_id, 'receiver_id': receiver_id, 'state': state})
+        for (recipient_id, user_id) in ((sender_id, receiver_id), (receiver_id, sender_id))]
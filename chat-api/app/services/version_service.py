@@ -0,0 +1,167 @@
+import abc
+import collections
+import hashlib
+import logging
+import time
+import typing
+import uuid
+
+_logger = logging.getLogger(__name__)
+
+_KEY_PREFIX = 'chat:version:'
+_EPOCH_KEY = f'{_KEY_PREFIX}epoch'
+_PRESENCE_BUCKET_SECONDS = 60
+
+def room_key(room_id: int) -> str:
+    '''
+    Room details (name, description, type).
+    '''
+
+    return f'room:{room_id}'
+
+def room_members_key(room_id: int) -> str:
+    '''
+    Set of room members and their explicitly set activity status.
+    '''
+
+    return f'room_members:{room_id}'
+
+def room_messages_key(room_id: int) -> str:
+    '''
+    Latest message of the room.
+    '''
+
+    return f'room_messages:{room_id}'
+
+def room_receipts_key(room_id: int) -> str:
+    '''
+    Stored read receipts of room members.
+    '''
+
+    return f'room_receipts:{room_id}'
+
+def user_rooms_key(user_id: int) -> str:
+    '''
+    Set of rooms the user belongs to.
+    '''
+
+    return f'user_rooms:{user_id}'
+
+def friends_key(user_id: int) -> str:
+    '''
+    User friend list and explicitly set activity status of the friends.
+    '''
+
+    return f'friends:{user_id}'
+
+class VersionService(abc.ABC):
+    '''
+    Monotonic version counters of cached resources. Services mutating a resource bump
+    its counter, readers turn the counters a response depends on into an ETag without
+    querying the database. Counters are qualified by an epoch, so a reset of the
+    underlying store (process or Redis restart) never makes an old ETag match again.
+    '''
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def get_versions(self, keys: typing.Sequence[str]) -> tuple[str, list[int]]:
+        '''
+        Returns current epoch and versions of the given keys.
+        '''
+
+    async def bump(self, keys: typing.Iterable[str]) -> None:
+        '''
+        Bumps versions of the given keys. Callers bump after committing the change, so a
+        failure is only logged; the change is done and must not fail the request or kill
+        a background writer, caches merely serve stale data until the next bump.
+        '''
+
+        keys = list(keys)
+        try:
+            await self._bump(keys)
+        except Exception:
+            _logger.exception('Failed to bump versions of %d keys', len(keys))
+
+    @abc.abstractmethod
+    async def _bump(self, keys: list[str]) -> None:
+        ...
+
+    async def get_etag(self, keys: typing.Sequence[str], presence: bool = False) -> str:
+        '''
+        Creates ETag of a response depending on resources identified by `keys`. Responses
+        containing `last_active` times of other users should set `presence`, which makes
+        the tag expire every minute; last activity refreshes are too frequent to bump counters.
+        '''
+
+        (epoch, versions) = await self.get_versions(keys)
+
+        digest = hashlib.blake2b(digest_size=12)
+        digest.update(epoch.encode())
+        for (key, version) in zip(keys, versions):
+            digest.update(f'\0{key}={version}'.encode())
+
+        if presence:
+            digest.update(f'\0presence={int(time.time()) // _PRESENCE_BUCKET_SECONDS}'.encode())
+
+        return f'"{digest.hexdigest()}"'
+
+class LocalVersionService(VersionService):
+    '''
+    In-process counters. Only valid with a single worker process.
+    '''
+
+    def __init__(self) -> None:
+        self._epoch = uuid.uuid4().hex
+        self._versions = collections.defaultdict[str, int](int)
+
+    async def get_versions(self, keys: typing.Sequence[str]) -> tuple[str, list[int]]:
+        return (self._epoch, [self._versions.get(x, 0) for x in keys])
+
+    async def _bump(self, keys: list[str]) -> None:
+        for key in keys:
+            self._versions[key] += 1
+
+class RedisVersionService(VersionService):
+    '''
+    Counters shared by all worker processes, stored in Redis (TCP or `unix://` socket URL).
+    '''
+
+    def __init__(self, url: str) -> None:
+        self._url = url
+        self._client = None
+
+    async def start(self) -> None:
+        import redis.asyncio
+
+        self._client = redis.asyncio.from_url(self._url)
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def get_versions(self, keys: typing.Sequence[str]) -> tuple[str, list[int]]:
+        (epoch, *values) = await self._client.mget([_EPOCH_KEY, *(_KEY_PREFIX + x for x in keys)])
+        if epoch is None:
+            # first reader after Redis lost its data decides the new epoch
+            await self._client.set(_EPOCH_KEY, uuid.uuid4().hex, nx=True)
+            return await self.get_versions(keys)
+
+        return (epoch.decode(), [int(x) if x is not None else 0 for x in values])
+
+    async def _bump(self, keys: list[str]) -> None:
+        async with self._client.pipeline(transaction=False) as pipeline:
+            for key in keys:
+                pipeline.incr(_KEY_PREFIX + key)
+
+            await pipeline.execute()
+
+def create_version_service(url: str | None) -> VersionService:
+    if url:
+        return RedisVersionService(url)
+
+    return LocalVersionService()
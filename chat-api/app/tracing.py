@@ -0,0 +1,57 @@
+import typing
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+
+_SERVICE_NAME = 'chat-api'
+
+tracer = trace.get_tracer(_SERVICE_NAME)
+'''
+Application tracer. Spans are no-ops unless tracing was configured with `configure_tracing`.
+'''
+
+class FileSpanExporter(SpanExporter):
+    '''
+    Appends finished spans to a file as JSON lines.
+    '''
+
+    def __init__(self, filepath: str) -> None:
+        self._file = open(filepath, 'a', encoding='utf-8')
+
+    def export(self, spans: typing.Sequence[ReadableSpan]) -> SpanExportResult:
+        for span in spans:
+            self._file.write(span.to_json(indent=None))
+            self._file.write('\n')
+
+        self._file.flush()
+
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        self._file.close()
+
+def configure_tracing(filepath: str, otlp_endpoint: str) -> None:
+    '''
+    Installs tracer provider exporting spans to a JSON lines file and/or an OTLP/HTTP
+    collector. Tracing stays disabled when neither is provided.
+    '''
+
+    if not filepath and not otlp_endpoint:
+        return
+
+    provider = TracerProvider(resource=Resource.create({'service.name': _SERVICE_NAME}))
+
+    if filepath:
+        provider.add_span_processor(BatchSpanProcessor(FileSpanExporter(filepath)))
+
+    if otlp_endpoint:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=otlp_endpoint)))
+
+    trace.set_tracer_provider(provider)
+
+def shutdown_tracing() -> None:
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, TracerProvider):
+        provider.shutdown()
@@ -0,0 +1,241 @@
+import datetime
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import tempfile
+
+import sqlalchemy
+import sqlalchemy.ext.asyncio as sqlalchemy_asyncio
+
+RESULTS_DIRECTORY = pathlib.Path(__file__).parent / 'results'
+
+# Minimal SQLite schema mirroring the columns used on the benchmarked paths.
+# It is kept separate from the ORM metadata because the MySQL schema relies on
+# features SQLite does not have (BIGINT autoincrement, partitioning, server side UUIDs).
+_SQLITE_SCHEMA = (
+    '''
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username VARCHAR(256) NOT NULL UNIQUE,
+        email VARCHAR(254) NOT NULL UNIQUE,
+        password_hash BLOB NOT NULL,
+        is_email_verified BOOLEAN NOT NULL DEFAULT 1,
+        accepts_friend_requests BOOLEAN NOT NULL DEFAULT 1,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        last_active DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        user_activity_status VARCHAR(16) NOT NULL DEFAULT 'OFFLINE')
+    ''',
+    '''
+    CREATE TABLE chat_rooms (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(256) NOT NULL UNIQUE,
+        description TEXT NOT NULL DEFAULT '',
+        type VARCHAR(16) NOT NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE)
+    ''',
+    '''
+    CREATE TABLE chat_room_users (
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        room_id INTEGER NOT NULL REFERENCES chat_rooms(id) ON DELETE CASCADE,
+        joined_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, room_id))
+    ''',
+    '''
+    CREATE TABLE messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender_id INTEGER NOT NULL,
+        room_id INTEGER NOT NULL,
+        type VARCHAR(8) NOT NULL,
+        content VARCHAR(256) NOT NULL,
+        sent_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)
+    ''',
+    '''
+    CREATE TABLE change_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind VARCHAR(16) NOT NULL,
+        room_id INTEGER,
+        recipient_id INTEGER,
+        user_id INTEGER,
+        data JSON NOT NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)
+    ''',
+    '''
+    CREATE TABLE api_keys (
+        key BLOB PRIMARY KEY,
+        is_active BOOLEAN NOT NULL DEFAULT 1,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)
+    ''',
+)
+
+# the API module reads its configuration from the environment on import
+_API_ENVIRONMENT = {
+    'DB_USERNAME': 'bench',
+    'DB_PASSWORD': 'bench',
+    'DB_ADDRESS': 'localhost',
+    'SMTP_HOST': 'localhost',
+    'SMTP_PORT': '587',
+    'SMTP_USER': 'bench@localhost',
+    'SMTP_PASSWORD': 'bench',
+    'MIN_PASSWORD_LENGTH': '8',
+    'PASSWORD_SALT_ROUNDS': '4',
+    'JWT_SECRET': 'bench-secret',
+    'JWT_EXPIRE_TIME': '3600',
+    'EMAIL_VERIFICATION_KEY': 'bench-key',
+    'EMAIL_VERIFICATION_SALT': 'bench-salt',
+    'EMAIL_CONFIRM_CODE_MAX_AGE': '3600',
+    'EMAIL_VERIFICATION_TOKEN_SALT_ROUNDS': '4',
+    'PROFILE_PICTURE_SIZE': '128',
+}
+
+class Fixture:
+    '''
+    Temporary data directory and SQLite database with a single user joined to
+    a single room, standing in for MySQL and the data volume.
+    '''
+
+    def __init__(self) -> None:
+        self._tmp_directory = tempfile.TemporaryDirectory(prefix='chat-bench-')
+        self.data_directory = pathlib.Path(self._tmp_directory.name)
+        self.engine = sqlalchemy_asyncio.create_async_engine(
+            f'sqlite+aiosqlite:///{self.data_directory / "chat.db"}')
+        self.sessionmaker = sqlalchemy_asyncio.async_sessionmaker(self.engine)
+        self.user_id = 1
+        self.room_id = 1
+
+    async def setup(self, api_key: bytes | None = None) -> None:
+        async with self.engine.begin() as connection:
+            await connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+            for statement in _SQLITE_SCHEMA:
+                await connection.exec_driver_sql(statement)
+
+            await connection.execute(
+                sqlalchemy.text(
+                    'INSERT INTO users (id, username, email, password_hash) '
+                    'VALUES (:id, \'bench\', \'bench@localhost\', x\'00\')'),
+                {'id': self.user_id})
+            await connection.execute(
+                sqlalchemy.text(
+                    'INSERT INTO chat_rooms (id, name, type, owner_id) '
+                    'VALUES (:id, \'bench\', \'PUBLIC\', :owner_id)'),
+                {'id': self.room_id, 'owner_id': self.user_id})
+            await connection.execute(
+                sqlalchemy.text('INSERT INTO chat_room_users (user_id, room_id) VALUES (:user_id, :room_id)'),
+                {'user_id': self.user_id, 'room_id': self.room_id})
+
+            if api_key is not None:
+                await connection.execute(
+                    sqlalchemy.text('INSERT INTO api_keys (key) VALUES (:key)'),
+                    {'key': api_key})
+
+        for directory in ('attachments', 'profile_pictures', 'room_images', 'email_templates'):
+            (self.data_directory / directory).mkdir(exist_ok=True)
+
+        (self.data_directory / 'attachments' / str(self.room_id)).mkdir(exist_ok=True)
+        for template in ('account_verification.html', 'password_reset.html'):
+            (self.data_directory / 'email_templates' / template).write_text('')
+
+    async def count_messages(self) -> int:
+        async with self.engine.connect() as connection:
+            return (await connection.execute(sqlalchemy.text('SELECT COUNT(*) FROM messages'))).scalar_one()
+
+    async def close(self) -> None:
+        await self.engine.dispose()
+        self._tmp_directory.cleanup()
+
+def load_api(fixture: Fixture, **overrides):
+    '''
+    Imports the API application backed by the fixture database and data directory.
+    Providers named in `overrides` (e.g. `message_service`) are replaced by the given
+    objects. Rate limits are disabled, benchmarks measure the request path, not limits.
+    '''
+
+    os.environ.update(_API_ENVIRONMENT)
+    os.environ['FS_DATA_DIRECTORY'] = str(fixture.data_directory)
+
+    from dependency_injector import providers
+    from app import main
+
+    container = main.dependency_container
+    container.config.fs.data_directory.override(str(fixture.data_directory))
+    container.config.security.rate_limits_enabled.override('0')
+    container.db_engine.override(providers.Object(fixture.engine))
+    for (name, value) in overrides.items():
+        getattr(container, name).override(providers.Object(value))
+
+    container.reset_singletons()
+
+    return main.app, container
+
+def unload_api(container) -> None:
+    # options are overridden (and read from the environment) through overrides of the root
+    # configuration, they can't be reset one by one; drop the two that load_api added
+    container.config.reset_last_overriding()
+    container.config.reset_last_overriding()
+    for provider in container.providers.values():
+        if provider is not container.config:
+            provider.reset_override()
+
+    container.reset_singletons()
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            cwd=pathlib.Path(__file__).parent,
+            stderr=subprocess.DEVNULL,
+            text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def write_results(name: str, results: list[dict], output_directory: pathlib.Path) -> pathlib.Path:
+    revision = git_revision()
+    output_directory.mkdir(parents=True, exist_ok=True)
+    output_path = output_directory / f'{name}-{revision}.json'
+    output_path.write_text(json.dumps(
+        {
+            'benchmark': name,
+            'revision': revision,
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        },
+        indent=2))
+
+    return output_path
+
+def compare_results(current: list[dict], baseline_path: pathlib.Path, key_fields: tuple[str, ...], metrics: tuple[str, ...]) -> None:
+    '''
+    Prints relative change of selected metrics against results stored by a previous run.
+    '''
+
+    baseline = json.loads(baseline_path.read_text())
+    baseline_by_key = {
+        tuple(x[field] for field in key_fields): x
+        for x in baseline['results']}
+
+    print(f'\nComparison against {baseline["revision"]} ({baseline_path.name}):')
+    for result in current:
+        key = tuple(result[field] for field in key_fields)
+        previous = baseline_by_key.get(key)
+        if previous is None:
+            continue
+
+        changes = []
+        for metric in metrics:
+            if previous[metric]:
+                changes.append(f'{metric} {100.0 * (result[metric] - previous[metric]) / previous[metric]:+.1f}%')
+
+        print(f'  {dict(zip(key_fields, key))}: {", ".join(changes)}')
@@ -0,0 +1,265 @@
+'''
+End-to-end message throughput benchmark.
+
+Drives `MessageService.upload_message` directly and through the
+`POST /room/{room_id}/messages` route against an SQLite database stand-in,
+reporting throughput, enqueue-to-commit latency and memory usage.
+
+Usage (from the `chat-api` directory):
+
+    python -m benchmarks.message_throughput --mode service route --concurrency 1 16 64 --batch-max-size 8 256
+    python -m benchmarks.message_throughput --compare benchmarks/results/message_throughput-<revision>.json
+'''
+
+import argparse
+import asyncio
+import itertools
+import os
+import pathlib
+import random
+import resource
+import time
+import tracemalloc
+import uuid
+
+from benchmarks import _common
+
+def _parse_attachment_mix(value: str) -> tuple[tuple[int, float], ...]:
+    '''
+    Parses `size:weight` pairs, e.g. `0:0.9,4096:0.09,262144:0.01` where size 0 means text message.
+    '''
+
+    mix = list[tuple[int, float]]()
+    for item in value.split(','):
+        size, weight = item.split(':')
+        mix.append((int(size), float(weight)))
+
+    return tuple(mix)
+
+def _create_message_service_class():
+    from app.services.message_service import MessageService
+    from app.services.event_bus import LocalEventBus
+    from app.services.version_service import LocalVersionService
+
+    class TimedMessageService(MessageService):
+        '''
+        Records enqueue-to-commit latency of every uploaded message.
+        '''
+
+        def __init__(self, *args, expected_messages: int, **kwargs) -> None:
+            super().__init__(
+                *args,
+                event_bus=LocalEventBus(),
+                version_service=LocalVersionService(),
+                **kwargs)
+            self.latencies = list[float]()
+            self.batch_sizes = list[int]()
+            self.first_enqueued_at: float | None = None
+            self.last_committed_at: float | None = None
+            self._enqueued_at = dict[int, float]()
+            self._expected_messages = expected_messages
+            self._all_committed = asyncio.Event()
+            self._error: BaseException | None = None
+
+        async def upload_message(self, message) -> None:
+            enqueued_at = time.perf_counter()
+            if self.first_enqueued_at is None:
+                self.first_enqueued_at = enqueued_at
+
+            self._enqueued_at[id(message)] = enqueued_at
+            await super().upload_message(message)
+
+        async def wait_all_committed(self) -> None:
+            await self._all_committed.wait()
+            if self._error is not None:
+                raise RuntimeError('Writing a message batch failed') from self._error
+
+        async def _upload_message_batch(self, batch) -> None:
+            try:
+                await super()._upload_message_batch(batch)
+            except BaseException as e:
+                # the writer only logs failed batches, the run would wait for them forever
+                self._error = e
+                self._all_committed.set()
+                raise
+
+            committed_at = time.perf_counter()
+            self.last_committed_at = committed_at
+            self.batch_sizes.append(len(batch))
+            for message in batch:
+                self.latencies.append(committed_at - self._enqueued_at.pop(id(message)))
+
+            if len(self.latencies) >= self._expected_messages:
+                self._all_committed.set()
+
+    return TimedMessageService
+
+async def _produce_service(message_service, fixture: _common.Fixture, payloads: list[bytes | None], concurrency: int) -> None:
+    from app.services.message_service import Message
+
+    async def worker(worker_payloads: list[bytes | None]) -> None:
+        for payload in worker_payloads:
+            if payload is None:
+                message = Message(fixture.user_id, fixture.room_id, 'benchmark message', None, None)
+            else:
+                message = Message(fixture.user_id, fixture.room_id, None, payload, 'attachment.bin')
+
+            await message_service.upload_message(message)
+
+    await asyncio.gather(*(worker(payloads[i::concurrency]) for i in range(concurrency)))
+
+async def _produce_route(fixture: _common.Fixture, message_service, payloads: list[bytes | None], concurrency: int) -> None:
+    import httpx
+    import jwt
+
+    api_key = uuid.uuid4()
+    await fixture.setup(api_key.bytes)
+
+    app, container = _common.load_api(fixture, message_service=message_service)
+    token = jwt.encode({'sub': str(fixture.user_id)}, os.environ['JWT_SECRET'], algorithm='HS256')
+    headers = {'X-Api-Key': str(api_key), 'Authorization': f'Bearer {token}'}
+    url = f'/room/{fixture.room_id}/messages'
+
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+            async def worker(worker_payloads: list[bytes | None]) -> None:
+                for payload in worker_payloads:
+                    if payload is None:
+                        response = await client.post(url, headers=headers, data={'text': 'benchmark message'})
+                    else:
+                        response = await client.post(url, headers=headers, files={'attachment_file': ('attachment.bin', payload)})
+
+                    response.raise_for_status()
+
+            await asyncio.gather(*(worker(payloads[i::concurrency]) for i in range(concurrency)))
+    finally:
+        _common.unload_api(container)
+
+async def _run_case(mode: str,
+                    messages: int,
+                    concurrency: int,
+                    batch_min_size: int,
+                    batch_max_size: int,
+                    batch_target_latency: float,
+                    queue_size: int,
+                    attachment_mix: tuple[tuple[int, float], ...],
+                    trace_memory: bool,
+                    seed: int) -> dict:
+    rng = random.Random(seed)
+    sizes = rng.choices(
+        [size for size, _ in attachment_mix],
+        [weight for _, weight in attachment_mix],
+        k=messages)
+    payloads = [rng.randbytes(size) if size > 0 else None for size in sizes]
+
+    fixture = _common.Fixture()
+    message_service = _create_message_service_class()(
+        fixture.sessionmaker,
+        db_writer_tasks=1,
+        message_queue_size=queue_size,
+        message_batch_min_size=batch_min_size,
+        message_batch_max_size=batch_max_size,
+        message_batch_target_latency=batch_target_latency,
+        data_directory=fixture.data_directory,
+        expected_messages=messages)
+
+    if trace_memory:
+        tracemalloc.start()
+
+    try:
+        if mode == 'service':
+            await fixture.setup()
+
+        message_service.start_db_writer_task()
+
+        if mode == 'service':
+            await _produce_service(message_service, fixture, payloads, concurrency)
+        else:
+            await _produce_route(fixture, message_service, payloads, concurrency)
+
+        await message_service.wait_all_committed()
+        await message_service.shutdown_db_writer_task()
+
+        peak_traced_bytes = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        committed = await fixture.count_messages()
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+        await fixture.close()
+
+    elapsed = message_service.last_committed_at - message_service.first_enqueued_at
+    return {
+        'mode': mode,
+        'messages': messages,
+        'committed': committed,
+        'concurrency': concurrency,
+        'batch_min_size': batch_min_size,
+        'batch_max_size': batch_max_size,
+        'batch_target_latency_ms': 1000.0 * batch_target_latency,
+        'mean_batch_size': sum(message_service.batch_sizes) / max(1, len(message_service.batch_sizes)),
+        'attachment_mix': ','.join(f'{size}:{weight}' for size, weight in attachment_mix),
+        'elapsed_s': elapsed,
+        'throughput_msg_s': messages / elapsed if elapsed > 0 else 0.0,
+        'latency_p50_ms': 1000.0 * _common.percentile(message_service.latencies, 0.50),
+        'latency_p99_ms': 1000.0 * _common.percentile(message_service.latencies, 0.99),
+        'latency_max_ms': 1000.0 * max(message_service.latencies, default=0.0),
+        'peak_traced_bytes': peak_traced_bytes,
+        # process-wide high-water mark, only comparable between runs with the same case order
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+async def _main(args: argparse.Namespace) -> None:
+    attachment_mix = _parse_attachment_mix(args.attachment_mix)
+
+    results = list[dict]()
+    for mode, concurrency, batch_max_size in itertools.product(args.mode, args.concurrency, args.batch_max_size):
+        result = await _run_case(
+            mode,
+            args.messages,
+            concurrency,
+            args.batch_min_size,
+            batch_max_size,
+            args.batch_target_latency_ms / 1000,
+            args.queue_size,
+            attachment_mix,
+            args.trace_memory,
+            args.seed)
+        results.append(result)
+
+        print(
+            f'{mode:>7} concurrency={concurrency:<4} max_batch={batch_max_size:<4} '
+            f'mean_batch={result["mean_batch_size"]:6.1f} '
+            f'{result["throughput_msg_s"]:10.1f} msg/s  '
+            f'p50={result["latency_p50_ms"]:8.2f} ms  p99={result["latency_p99_ms"]:8.2f} ms  '
+            f'rss={result["max_rss_bytes"] / 2**20:.1f} MiB')
+
+    output_path = _common.write_results('message_throughput', results, args.output)
+    print(f'\nResults written to {output_path}')
+
+    if args.compare is not None:
+        _common.compare_results(
+            results,
+            args.compare,
+            ('mode', 'concurrency', 'batch_max_size', 'attachment_mix'),
+            ('throughput_msg_s', 'latency_p50_ms', 'latency_p99_ms'))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', nargs='+', choices=('service', 'route'), default=['service', 'route'])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--batch-min-size', type=int, default=1)
+    parser.add_argument('--batch-max-size', type=int, nargs='+', default=[8, 256])
+    parser.add_argument('--batch-target-latency-ms', type=float, default=50.0)
+    parser.add_argument('--queue-size', type=int, default=512)
+    parser.add_argument('--attachment-mix', default='0:0.9,4096:0.09,262144:0.01')
+    parser.add_argument('--trace-memory', action='store_true', help='track peak Python allocations (slows the run down)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=pathlib.Path, default=_common.RESULTS_DIRECTORY)
+    parser.add_argument('--compare', type=pathlib.Path, default=None, help='results file of a previous run')
+
+    asyncio.run(_main(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+'''
+Per-request overhead of the HTTP middleware stack.
+
+Calls ASGI applications directly (no HTTP client or server in between), each with the
+same endpoints and the API key check, timing and CORS middlewares implemented as:
+- `none` - no middleware at all, the baseline
+- `http` - `app.middleware('http')` functions running on Starlette's BaseHTTPMiddleware,
+  as the API registered them before
+- `asgi` - plain ASGI middlewares from `app.middleware`
+
+Endpoints return a small JSON document and a 1 MiB `FileResponse`. API keys are
+validated against an SQLite database stand-in, which costs the same in both stacks.
+
+Usage (from the `chat-api` directory):
+
+    python -m benchmarks.middleware_overhead --requests 5000
+    python -m benchmarks.middleware_overhead --compare benchmarks/results/middleware_overhead-<revision>.json
+'''
+
+import argparse
+import asyncio
+import pathlib
+import statistics
+import time
+import uuid
+
+from benchmarks import _common
+
+_STACKS = ('none', 'http', 'asgi')
+_ENDPOINTS = ('/ping', '/file')
+_FILE_SIZE = 1024 * 1024
+
+def _create_legacy_middlewares(container):
+    '''
+    Middleware functions as they were before the switch to plain ASGI middlewares.
+    '''
+
+    import fastapi
+    from app import metrics, request_timing
+    from app.middleware import _OPEN_ENDPOINTS, ErrorAPIKeyMissing
+
+    async def validate_api_key_header(request: fastapi.Request, call_next):
+        if request.url.path not in _OPEN_ENDPOINTS:
+            api_key = request.headers.get('x-api-key')
+            if api_key is None:
+                return fastapi.Response(
+                    content=ErrorAPIKeyMissing().model_dump_json(),
+                    status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
+                    media_type='application/json')
+
+            try:
+                await container.auth_service().validate_api_key(api_key)
+            except fastapi.HTTPException as e:
+                return fastapi.Response(
+                    content=e.detail,
+                    headers=e.headers,
+                    status_code=e.status_code,
+                    media_type='application/json')
+
+        return await call_next(request)
+
+    async def add_process_time_header(request: fastapi.Request, call_next):
+        timings = request_timing.start_request(request.url.path)
+        start_time = time.perf_counter()
+        response = await call_next(request)
+        process_time = time.perf_counter() - start_time
+        response.headers['X-Process-Time'] = str(process_time)
+        response.headers['Server-Timing'] = request_timing.format_server_timing(timings, process_time)
+        response.headers['Timing-Allow-Origin'] = '*'
+        request_timing.log_request_summary(timings, process_time)
+
+        route = request.scope.get('route')
+        metrics.REQUEST_LATENCY \
+            .labels(request.method, route.path if route is not None else 'unmatched', response.status_code) \
+            .observe(process_time)
+
+        return response
+
+    return (validate_api_key_header, add_process_time_header)
+
+def _create_app(stack: str, container, file_path: pathlib.Path):
+    import fastapi
+    import fastapi.middleware.cors
+    from app import middleware
+
+    app = fastapi.FastAPI()
+
+    @app.get('/ping')
+    async def ping():
+        return {'ok': True}
+
+    @app.get('/file')
+    async def get_file():
+        return fastapi.responses.FileResponse(file_path)
+
+    if stack == 'http':
+        (validate_api_key_header, add_process_time_header) = _create_legacy_middlewares(container)
+        app.middleware('http')(validate_api_key_header)
+        app.middleware('http')(add_process_time_header)
+    elif stack == 'asgi':
+        app.add_middleware(middleware.APIKeyMiddleware)
+        app.add_middleware(middleware.TimingMiddleware)
+
+    if stack != 'none':
+        app.add_middleware(
+            fastapi.middleware.cors.CORSMiddleware,
+            allow_credentials=True,
+            allow_origins=('*',),
+            allow_methods=('*',),
+            allow_headers=('*',),
+            expose_headers=('x-process-time', 'server-timing'))
+
+    return app
+
+async def _request(app, path: str, headers: list[tuple[bytes, bytes]]) -> int:
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': headers,
+        'client': ('127.0.0.1', 50000),
+        'server': ('bench', 80),
+    }
+    status = 0
+    request_sent = False
+    response_sent = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        # file responses listen for the disconnect while streaming, like a server the
+        # client only goes away once the response is complete
+        await response_sent.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body' and not message.get('more_body', False):
+            response_sent.set()
+
+    await app(scope, receive, send)
+    return status
+
+async def _run_case(app, path: str, headers: list[tuple[bytes, bytes]], requests: int, warmup: int) -> list[float]:
+    for _ in range(warmup):
+        await _request(app, path, headers)
+
+    durations = list[float]()
+    for _ in range(requests):
+        start_time = time.perf_counter()
+        status = await _request(app, path, headers)
+        durations.append(time.perf_counter() - start_time)
+
+        if status != 200:
+            raise RuntimeError(f'{path} responded with {status}')
+
+    return durations
+
+async def _main(args: argparse.Namespace) -> None:
+    api_key = uuid.uuid4()
+    fixture = _common.Fixture()
+    await fixture.setup(api_key.bytes)
+
+    file_path = fixture.data_directory / 'file.bin'
+    file_path.write_bytes(bytes(_FILE_SIZE))
+
+    headers = [(b'x-api-key', str(api_key).encode()), (b'origin', b'http://bench')]
+
+    (_, container) = _common.load_api(fixture)
+    results = list[dict]()
+    try:
+        baseline_us = dict[str, float]()
+        for stack in args.stack:
+            app = _create_app(stack, container, file_path)
+            for endpoint in args.endpoint:
+                durations = await _run_case(app, endpoint, headers, args.requests, args.warmup)
+                mean_us = 1e6 * statistics.fmean(durations)
+                if stack == 'none':
+                    baseline_us[endpoint] = mean_us
+
+                result = {
+                    'stack': stack,
+                    'endpoint': endpoint,
+                    'requests': args.requests,
+                    'mean_us': mean_us,
+                    'p50_us': 1e6 * _common.percentile(durations, 0.50),
+                    'p99_us': 1e6 * _common.percentile(durations, 0.99),
+                    'overhead_us': mean_us - baseline_us[endpoint] if endpoint in baseline_us else None,
+                }
+                results.append(result)
+
+                overhead = f'{result["overhead_us"]:+9.1f} us' if result['overhead_us'] is not None else '        -'
+                print(
+                    f'{stack:>5} {endpoint:<6} mean={result["mean_us"]:9.1f} us  '
+                    f'p50={result["p50_us"]:9.1f} us  p99={result["p99_us"]:9.1f} us  overhead={overhead}')
+    finally:
+        _common.unload_api(container)
+        await fixture.close()
+
+    output_path = _common.write_results('middleware_overhead', results, args.output)
+    print(f'\nResults written to {output_path}')
+
+    if args.compare is not None:
+        _common.compare_results(
+            results,
+            args.compare,
+            ('stack', 'endpoint'),
+            ('mean_us', 'p99_us'))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stack', nargs='+', choices=_STACKS, default=list(_STACKS), help='"none" must come first to report overhead')
+    parser.add_argument('--endpoint', nargs='+', choices=_ENDPOINTS, default=list(_ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--output', type=pathlib.Path, default=_common.RESULTS_DIRECTORY)
+    parser.add_argument('--compare', type=pathlib.Path, default=None, help='results file of a previous run')
+
+    asyncio.run(_main(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
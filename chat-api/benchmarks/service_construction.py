@@ -0,0 +1,116 @@
+'''
+Per-request cost of resolving services from the dependency injection container.
+
+Every request injecting `auth_service` (which includes the API key middleware) or
+`email_service` resolves them from the container. Each service is resolved as:
+- `factory` - `providers.Factory` with the container's arguments, constructing the service
+  (and its session maker) on every resolution, as the container used to
+- `singleton` - the container's own provider, constructed once
+
+Constructors are the current ones, so `factory` doesn't include the SMTP client
+`EmailService` used to create on construction before it was made lazy.
+
+Usage (from the `chat-api` directory):
+
+    python -m benchmarks.service_construction --resolutions 20000
+    python -m benchmarks.service_construction --compare benchmarks/results/service_construction-<revision>.json
+'''
+
+import argparse
+import asyncio
+import pathlib
+import statistics
+import time
+
+from benchmarks import _common
+
+_MODES = ('factory', 'singleton')
+_SERVICES = ('auth_service', 'email_service')
+# providers that were factories as well, their factory copies are injected into the services
+_FACTORY_DEPENDENCIES = ('db_sessionmaker',)
+
+def _create_factories(container) -> dict[str, object]:
+    from dependency_injector import providers
+
+    factories = dict[str, object]()
+    for name in (*_FACTORY_DEPENDENCIES, *_SERVICES):
+        provider = getattr(container, name)
+        replacements = {getattr(container, x): factories[x] for x in factories}
+        factories[name] = providers.Factory(
+            provider.provides,
+            *(replacements.get(x, x) for x in provider.args),
+            **{k: replacements.get(v, v) for (k, v) in provider.kwargs.items()})
+
+    return factories
+
+def _run_case(provider, resolutions: int, warmup: int) -> list[float]:
+    for _ in range(warmup):
+        provider()
+
+    durations = list[float]()
+    for _ in range(resolutions):
+        start_time = time.perf_counter()
+        provider()
+        durations.append(time.perf_counter() - start_time)
+
+    return durations
+
+async def _main(args: argparse.Namespace) -> None:
+    fixture = _common.Fixture()
+    await fixture.setup()
+
+    (_, container) = _common.load_api(fixture)
+    results = list[dict]()
+    try:
+        factories = _create_factories(container)
+        factory_us = dict[str, float]()
+        for service in args.service:
+            for mode in args.mode:
+                provider = factories[service] if mode == 'factory' else getattr(container, service)
+                durations = _run_case(provider, args.resolutions, args.warmup)
+                mean_us = 1e6 * statistics.fmean(durations)
+                if mode == 'factory':
+                    factory_us[service] = mean_us
+
+                result = {
+                    'service': service,
+                    'mode': mode,
+                    'resolutions': args.resolutions,
+                    'mean_us': mean_us,
+                    'p50_us': 1e6 * _common.percentile(durations, 0.50),
+                    'p99_us': 1e6 * _common.percentile(durations, 0.99),
+                    'saved_us': factory_us[service] - mean_us if mode != 'factory' and service in factory_us else None,
+                }
+                results.append(result)
+
+                saved = f'{result["saved_us"]:9.2f} us' if result['saved_us'] is not None else '        -'
+                print(
+                    f'{service:<13} {mode:<9} mean={result["mean_us"]:9.2f} us  '
+                    f'p50={result["p50_us"]:9.2f} us  p99={result["p99_us"]:9.2f} us  saved={saved}')
+    finally:
+        _common.unload_api(container)
+        await fixture.close()
+
+    output_path = _common.write_results('service_construction', results, args.output)
+    print(f'\nResults written to {output_path}')
+
+    if args.compare is not None:
+        _common.compare_results(
+            results,
+            args.compare,
+            ('service', 'mode'),
+            ('mean_us', 'p99_us'))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--service', nargs='+', choices=_SERVICES, default=list(_SERVICES))
+    parser.add_argument('--mode', nargs='+', choices=_MODES, default=list(_MODES), help='"factory" must come first to report savings')
+    parser.add_argument('--resolutions', type=int, default=10000)
+    parser.add_argument('--warmup', type=int, default=500)
+    parser.add_argument('--output', type=pathlib.Path, default=_common.RESULTS_DIRECTORY)
+    parser.add_argument('--compare', type=pathlib.Path, default=None, help='results file of a previous run')
+
+    asyncio.run(_main(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()